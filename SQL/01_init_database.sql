@@ -278,6 +278,74 @@ CREATE TABLE IF NOT EXISTS `device_sensors` (
   KEY `idx_sensor_name` (`sensor_name`) COMMENT '传感器名称索引'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='设备传感器数据表';
 
+--
+-- 表的结构 `device_sensor_segments`
+-- 传感器历史原始数据：按 (设备, 传感器) 分段，时间戳和数值列压缩后存为二进制
+-- 按天分区，过期数据按分区整体删除（分区由 mqtt-service 自动创建和清理）
+--
+
+CREATE TABLE IF NOT EXISTS `device_sensor_segments` (
+  `id` BIGINT(20) NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `day` DATE NOT NULL COMMENT '数据日期（分区键）',
+  `device_uuid` VARCHAR(36) NOT NULL COMMENT '设备UUID（关联 device_main.uuid）',
+  `sensor_name` VARCHAR(50) NOT NULL COMMENT '传感器名称',
+  `start_time` DATETIME(3) NOT NULL COMMENT '段内最早数据时间',
+  `end_time` DATETIME(3) NOT NULL COMMENT '段内最晚数据时间',
+  `point_count` INT(11) NOT NULL COMMENT '数据点数',
+  `ts_blob` BLOB NOT NULL COMMENT '时间戳列（delta-of-delta 编码）',
+  `value_blob` BLOB NOT NULL COMMENT '数值列（异或压缩编码）',
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '记录创建时间',
+
+  PRIMARY KEY (`id`, `day`),
+  KEY `idx_series_time` (`device_uuid`, `sensor_name`, `start_time`) COMMENT '按传感器和时间范围查询'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='传感器历史原始数据分段表'
+PARTITION BY RANGE COLUMNS(`day`) (
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+--
+-- 表的结构 `device_sensor_rollups_1m`
+-- 传感器历史分钟聚合（最小值/最大值/总和/点数），按天分区
+--
+
+CREATE TABLE IF NOT EXISTS `device_sensor_rollups_1m` (
+  `day` DATE NOT NULL COMMENT '数据日期（分区键）',
+  `device_uuid` VARCHAR(36) NOT NULL COMMENT '设备UUID',
+  `sensor_name` VARCHAR(50) NOT NULL COMMENT '传感器名称',
+  `bucket_start` DATETIME NOT NULL COMMENT '时间桶起始时间',
+  `min_value` DOUBLE NOT NULL COMMENT '最小值',
+  `max_value` DOUBLE NOT NULL COMMENT '最大值',
+  `sum_value` DOUBLE NOT NULL COMMENT '总和（平均值 = sum_value / point_count）',
+  `point_count` INT(11) NOT NULL COMMENT '数据点数',
+
+  PRIMARY KEY (`device_uuid`, `sensor_name`, `bucket_start`, `day`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='传感器历史分钟聚合表'
+PARTITION BY RANGE COLUMNS(`day`) (
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+--
+-- 表的结构 `device_sensor_rollups_1h`
+-- 传感器历史小时聚合，按月分区
+--
+
+CREATE TABLE IF NOT EXISTS `device_sensor_rollups_1h` (
+  `day` DATE NOT NULL COMMENT '数据日期（分区键）',
+  `device_uuid` VARCHAR(36) NOT NULL COMMENT '设备UUID',
+  `sensor_name` VARCHAR(50) NOT NULL COMMENT '传感器名称',
+  `bucket_start` DATETIME NOT NULL COMMENT '时间桶起始时间',
+  `min_value` DOUBLE NOT NULL COMMENT '最小值',
+  `max_value` DOUBLE NOT NULL COMMENT '最大值',
+  `sum_value` DOUBLE NOT NULL COMMENT '总和（平均值 = sum_value / point_count）',
+  `point_count` INT(11) NOT NULL COMMENT '数据点数',
+
+  PRIMARY KEY (`device_uuid`, `sensor_name`, `bucket_start`, `day`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='传感器历史小时聚合表'
+PARTITION BY RANGE COLUMNS(`day`) (
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+
 
 -- ========================================== 
 -- 设备模块（Device）
@@ -598,7 +666,11 @@ CREATE TABLE `kb_document_chunks` (
   `chunk_index` int(11) NOT NULL COMMENT '在文档中的顺序',
   `char_count` int(11) DEFAULT NULL COMMENT '字符数',
   `token_count` int(11) DEFAULT NULL COMMENT 'Token数（估算）',
-  `embedding_vector` json DEFAULT NULL COMMENT '向量表示（JSON数组，用于MySQL存储）',
+  `content_hash` varchar(64) COLLATE utf8mb4_unicode_ci DEFAULT NULL COMMENT '内容哈希（规范化内容+向量模型），用于复用已有向量',
+  `embedding_blob` blob DEFAULT NULL COMMENT '向量二进制数据',
+  `embedding_dtype` varchar(10) COLLATE utf8mb4_unicode_ci DEFAULT NULL COMMENT '向量存储格式：float32/float16/int8',
+  `embedding_scale` float DEFAULT NULL COMMENT 'int8量化比例',
+  `embedding_vector` json DEFAULT NULL COMMENT '向量表示（旧版JSON数组，兼容未迁移数据）',
   `previous_chunk_id` int(11) DEFAULT NULL COMMENT '上一个文本块ID',
   `next_chunk_id` int(11) DEFAULT NULL COMMENT '下一个文本块ID',
   `meta_data` json DEFAULT NULL COMMENT '扩展元数据（如段落位置、标题层级等）',
@@ -1022,6 +1094,7 @@ ALTER TABLE `kb_document_chunks`
   ADD UNIQUE KEY `uk_uuid` (`uuid`),
   ADD KEY `idx_document` (`document_id`,`chunk_index`),
   ADD KEY `idx_kb` (`knowledge_base_id`),
+  ADD KEY `idx_content_hash` (`content_hash`),
   ADD KEY `idx_created` (`created_at`);
 
 --
@@ -0,0 +1,94 @@
+-- ==========================================================================================================
+-- 文本块向量二进制存储
+-- ==========================================================================================================
+--
+-- 脚本名称: 03_add_chunk_embedding_blob.sql
+-- 脚本版本: 1.0.0
+-- 创建日期: 2026-10-18
+-- 兼容版本: MySQL 5.7.x, 8.0.x
+-- 字符集: utf8mb4
+-- 排序规则: utf8mb4_unicode_ci
+--
+-- ==========================================================================================================
+-- 脚本说明
+-- ==========================================================================================================
+--
+-- 1. 用途说明:
+--    kb_document_chunks.embedding_vector 以 JSON 数组存储向量，1536 维向量约 30KB 文本，
+--    每次检索都要反序列化为 Python 浮点数。本脚本新增二进制存储字段：
+--    float32 每个向量 6KB，float16 3KB，int8 1.5KB（由后端 EMBEDDING_STORAGE_DTYPE 配置决定）
+--
+-- 2. 变更内容:
+--    - 在 kb_document_chunks 表中添加 embedding_blob / embedding_dtype / embedding_scale 字段
+--    - 新写入的文本块只写二进制字段，embedding_vector 保留用于兼容未迁移数据
+--
+-- 3. 执行方式:
+--    mysql -h hostname -u username -p --default-character-set=utf8mb4 aiot_admin < 03_add_chunk_embedding_blob.sql
+--
+-- 4. 可重复执行:
+--    ✅ 本脚本检查字段是否存在，可安全重复执行
+--
+-- ==========================================================================================================
+
+SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci;
+
+SELECT '========================================' AS '';
+SELECT '开始添加文本块向量二进制存储字段...' AS '';
+SELECT '========================================' AS '';
+
+-- 添加 embedding_blob 字段
+SET @col_exists = (SELECT COUNT(*) FROM information_schema.COLUMNS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'kb_document_chunks' AND COLUMN_NAME = 'embedding_blob');
+SET @sql = IF(@col_exists = 0,
+  'ALTER TABLE `kb_document_chunks` ADD COLUMN `embedding_blob` BLOB DEFAULT NULL COMMENT ''向量二进制数据'' AFTER `token_count`',
+  'SELECT "Column embedding_blob already exists" AS notice');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 添加 embedding_dtype 字段
+SET @col_exists = (SELECT COUNT(*) FROM information_schema.COLUMNS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'kb_document_chunks' AND COLUMN_NAME = 'embedding_dtype');
+SET @sql = IF(@col_exists = 0,
+  'ALTER TABLE `kb_document_chunks` ADD COLUMN `embedding_dtype` VARCHAR(10) DEFAULT NULL COMMENT ''向量存储格式：float32/float16/int8'' AFTER `embedding_blob`',
+  'SELECT "Column embedding_dtype already exists" AS notice');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 添加 embedding_scale 字段
+SET @col_exists = (SELECT COUNT(*) FROM information_schema.COLUMNS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'kb_document_chunks' AND COLUMN_NAME = 'embedding_scale');
+SET @sql = IF(@col_exists = 0,
+  'ALTER TABLE `kb_document_chunks` ADD COLUMN `embedding_scale` FLOAT DEFAULT NULL COMMENT ''int8量化比例'' AFTER `embedding_dtype`',
+  'SELECT "Column embedding_scale already exists" AS notice');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 统计待迁移的文本块
+SELECT
+    COUNT(*) AS 'JSON向量待迁移文本块数'
+FROM `kb_document_chunks`
+WHERE `embedding_blob` IS NULL AND `embedding_vector` IS NOT NULL;
+
+SELECT '========================================' AS '';
+SELECT '脚本执行完成！' AS '';
+SELECT '========================================' AS '';
+
+-- ==========================================================================================================
+-- 后续操作说明
+-- ==========================================================================================================
+--
+-- 1. 迁移已有的 JSON 向量（在 backend 目录执行，可在服务运行期间执行）
+--    python migrate_embedding_storage.py
+--
+--    可选参数：
+--      --dtype float16     指定存储格式（默认使用 EMBEDDING_STORAGE_DTYPE 配置）
+--      --clear-json        迁移后清空 embedding_vector，释放存储空间
+--
+-- 2. 未迁移的数据仍可正常检索（后端会兼容读取 JSON 向量），但检索性能较差
+--
+-- ==========================================================================================================
+-- 脚本结束
+-- ==========================================================================================================
@@ -0,0 +1,81 @@
+-- ==========================================================================================================
+-- 文本块内容哈希（向量复用）
+-- ==========================================================================================================
+--
+-- 脚本名称: 04_add_chunk_content_hash.sql
+-- 脚本版本: 1.0.0
+-- 创建日期: 2026-10-18
+-- 兼容版本: MySQL 5.7.x, 8.0.x
+-- 字符集: utf8mb4
+-- 排序规则: utf8mb4_unicode_ci
+--
+-- ==========================================================================================================
+-- 脚本说明
+-- ==========================================================================================================
+--
+-- 1. 用途说明:
+--    重新上传文档或重建知识库时，内容未变化或在多个知识库中重复的文本块会被重复向量化。
+--    文本块按 "规范化内容 + 向量模型" 计算哈希，向量化前先按哈希查找已有向量，
+--    只有新增或修改的文本块才会请求向量化服务商
+--
+-- 2. 变更内容:
+--    - 在 kb_document_chunks 表中添加 content_hash 字段及索引
+--
+-- 3. 执行方式:
+--    mysql -h hostname -u username -p --default-character-set=utf8mb4 aiot_admin < 04_add_chunk_content_hash.sql
+--
+-- 4. 可重复执行:
+--    ✅ 本脚本检查字段和索引是否存在，可安全重复执行
+--
+-- ==========================================================================================================
+
+SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci;
+
+SELECT '========================================' AS '';
+SELECT '开始添加文本块内容哈希字段...' AS '';
+SELECT '========================================' AS '';
+
+-- 添加 content_hash 字段
+SET @col_exists = (SELECT COUNT(*) FROM information_schema.COLUMNS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'kb_document_chunks' AND COLUMN_NAME = 'content_hash');
+SET @sql = IF(@col_exists = 0,
+  'ALTER TABLE `kb_document_chunks` ADD COLUMN `content_hash` VARCHAR(64) DEFAULT NULL COMMENT ''内容哈希（规范化内容+向量模型），用于复用已有向量'' AFTER `token_count`',
+  'SELECT "Column content_hash already exists" AS notice');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 添加 content_hash 索引
+SET @idx_exists = (SELECT COUNT(*) FROM information_schema.STATISTICS
+  WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'kb_document_chunks' AND INDEX_NAME = 'idx_content_hash');
+SET @sql = IF(@idx_exists = 0,
+  'ALTER TABLE `kb_document_chunks` ADD KEY `idx_content_hash` (`content_hash`)',
+  'SELECT "Index idx_content_hash already exists" AS notice');
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 统计待计算哈希的文本块
+SELECT
+    COUNT(*) AS '待计算内容哈希的文本块数'
+FROM `kb_document_chunks`
+WHERE `content_hash` IS NULL;
+
+SELECT '========================================' AS '';
+SELECT '脚本执行完成！' AS '';
+SELECT '========================================' AS '';
+
+-- ==========================================================================================================
+-- 后续操作说明
+-- ==========================================================================================================
+--
+-- 1. 为已有文本块计算内容哈希（在 backend 目录执行，可在服务运行期间执行）
+--    python backfill_chunk_hashes.py --model text-embedding-v4
+--
+--    --model 必须与生成这些向量的模型一致，否则会复用到其他模型的向量
+--
+-- 2. 未计算哈希的文本块不影响检索，只是不能被复用；重新向量化后会自动写入哈希
+--
+-- ==========================================================================================================
+-- 脚本结束
+-- ==========================================================================================================
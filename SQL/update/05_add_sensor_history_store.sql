@@ -0,0 +1,132 @@
+-- ==========================================================================================================
+-- 传感器历史数据存储
+-- ==========================================================================================================
+--
+-- 脚本名称: 05_add_sensor_history_store.sql
+-- 脚本版本: 1.0.0
+-- 创建日期: 2026-10-18
+-- 兼容版本: MySQL 5.7.x, 8.0.x
+-- 字符集: utf8mb4
+-- 排序规则: utf8mb4_unicode_ci
+--
+-- ==========================================================================================================
+-- 脚本说明
+-- ==========================================================================================================
+--
+-- 1. 用途说明:
+--    device_sensors 每个传感器只保留最新一条数据，无法查询历史曲线。本脚本新增只追加的历史存储：
+--    - device_sensor_segments：原始数据按 (设备, 传感器) 分段，时间戳/数值列压缩为二进制，
+--      固定周期上报的数据每个点约 2-4 字节
+--    - device_sensor_rollups_1m / device_sensor_rollups_1h：分钟/小时预聚合（最小/最大/总和/点数），
+--      长时间范围的查询直接读聚合表
+--
+-- 2. 变更内容:
+--    - 创建以上三张表，按 day 字段 RANGE COLUMNS 分区，初始只有 p_future 分区
+--    - mqtt-service 启动后自动拆分出未来几天（小时聚合为未来几个月）的分区，
+--      并按保留天数整体删除过期分区（HISTORY_*_RETENTION_DAYS 配置）
+--
+-- 3. 执行方式:
+--    mysql -h hostname -u username -p --default-character-set=utf8mb4 aiot_admin < 05_add_sensor_history_store.sql
+--
+-- 4. 可重复执行:
+--    ✅ 本脚本使用 CREATE TABLE IF NOT EXISTS，可安全重复执行
+--
+-- ==========================================================================================================
+
+SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci;
+
+SELECT '========================================' AS '';
+SELECT '开始创建传感器历史数据表...' AS '';
+SELECT '========================================' AS '';
+
+--
+-- 表的结构 `device_sensor_segments`
+-- 传感器历史原始数据：按 (设备, 传感器) 分段，时间戳和数值列压缩后存为二进制
+-- 按天分区，过期数据按分区整体删除（分区由 mqtt-service 自动创建和清理）
+--
+
+CREATE TABLE IF NOT EXISTS `device_sensor_segments` (
+  `id` BIGINT(20) NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+  `day` DATE NOT NULL COMMENT '数据日期（分区键）',
+  `device_uuid` VARCHAR(36) NOT NULL COMMENT '设备UUID（关联 device_main.uuid）',
+  `sensor_name` VARCHAR(50) NOT NULL COMMENT '传感器名称',
+  `start_time` DATETIME(3) NOT NULL COMMENT '段内最早数据时间',
+  `end_time` DATETIME(3) NOT NULL COMMENT '段内最晚数据时间',
+  `point_count` INT(11) NOT NULL COMMENT '数据点数',
+  `ts_blob` BLOB NOT NULL COMMENT '时间戳列（delta-of-delta 编码）',
+  `value_blob` BLOB NOT NULL COMMENT '数值列（异或压缩编码）',
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '记录创建时间',
+
+  PRIMARY KEY (`id`, `day`),
+  KEY `idx_series_time` (`device_uuid`, `sensor_name`, `start_time`) COMMENT '按传感器和时间范围查询'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='传感器历史原始数据分段表'
+PARTITION BY RANGE COLUMNS(`day`) (
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+--
+-- 表的结构 `device_sensor_rollups_1m`
+-- 传感器历史分钟聚合（最小值/最大值/总和/点数），按天分区
+--
+
+CREATE TABLE IF NOT EXISTS `device_sensor_rollups_1m` (
+  `day` DATE NOT NULL COMMENT '数据日期（分区键）',
+  `device_uuid` VARCHAR(36) NOT NULL COMMENT '设备UUID',
+  `sensor_name` VARCHAR(50) NOT NULL COMMENT '传感器名称',
+  `bucket_start` DATETIME NOT NULL COMMENT '时间桶起始时间',
+  `min_value` DOUBLE NOT NULL COMMENT '最小值',
+  `max_value` DOUBLE NOT NULL COMMENT '最大值',
+  `sum_value` DOUBLE NOT NULL COMMENT '总和（平均值 = sum_value / point_count）',
+  `point_count` INT(11) NOT NULL COMMENT '数据点数',
+
+  PRIMARY KEY (`device_uuid`, `sensor_name`, `bucket_start`, `day`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='传感器历史分钟聚合表'
+PARTITION BY RANGE COLUMNS(`day`) (
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+--
+-- 表的结构 `device_sensor_rollups_1h`
+-- 传感器历史小时聚合，按月分区
+--
+
+CREATE TABLE IF NOT EXISTS `device_sensor_rollups_1h` (
+  `day` DATE NOT NULL COMMENT '数据日期（分区键）',
+  `device_uuid` VARCHAR(36) NOT NULL COMMENT '设备UUID',
+  `sensor_name` VARCHAR(50) NOT NULL COMMENT '传感器名称',
+  `bucket_start` DATETIME NOT NULL COMMENT '时间桶起始时间',
+  `min_value` DOUBLE NOT NULL COMMENT '最小值',
+  `max_value` DOUBLE NOT NULL COMMENT '最大值',
+  `sum_value` DOUBLE NOT NULL COMMENT '总和（平均值 = sum_value / point_count）',
+  `point_count` INT(11) NOT NULL COMMENT '数据点数',
+
+  PRIMARY KEY (`device_uuid`, `sensor_name`, `bucket_start`, `day`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='传感器历史小时聚合表'
+PARTITION BY RANGE COLUMNS(`day`) (
+  PARTITION `p_future` VALUES LESS THAN (MAXVALUE)
+);
+
+-- 检查分区
+SELECT
+    TABLE_NAME AS '表名',
+    COUNT(*) AS '分区数'
+FROM information_schema.PARTITIONS
+WHERE TABLE_SCHEMA = DATABASE()
+  AND TABLE_NAME IN ('device_sensor_segments', 'device_sensor_rollups_1m', 'device_sensor_rollups_1h')
+GROUP BY TABLE_NAME;
+
+SELECT '========================================' AS '';
+SELECT '脚本执行完成！' AS '';
+SELECT '========================================' AS '';
+
+-- ==========================================================================================================
+-- 后续操作说明
+-- ==========================================================================================================
+--
+-- 1. 重启 mqtt-service（HISTORY_ENABLED=true，默认开启），日志中出现"历史数据分区维护完成"即表示分区已创建
+--
+-- 2. 历史数据通过 GET /api/devices/{device_uuid}/sensor-history 查询
+--
+-- ==========================================================================================================
+-- 脚本结束
+-- ==========================================================================================================
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 from app.api import (
-    auth, devices, users, products, dashboard, firmware, 
+    auth, devices, device_stream, users, products, dashboard, firmware, 
     user_management, courses, device_groups, system_config
 )
 from app.api.ai import router as ai_router
@@ -9,6 +9,8 @@ api_router = APIRouter()
 
 api_router.include_router(auth.router, prefix="/auth", tags=["认证"])
 api_router.include_router(products.router, prefix="/products", tags=["产品管理"])
+# 实时推送路由需在设备路由之前注册，避免 /stream 被 /{device_uuid} 匹配
+api_router.include_router(device_stream.router, prefix="/devices", tags=["设备实时数据"])
 api_router.include_router(devices.router, prefix="/devices", tags=["设备管理"])
 api_router.include_router(users.router, prefix="/users", tags=["用户管理"])
 api_router.include_router(dashboard.router, prefix="/dashboard", tags=["仪表盘"])
@@ -2,8 +2,13 @@
 智能体对话 API 接口
 """
 
-from typing import List, Dict, Any, Optional
+import json
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 
@@ -14,9 +19,11 @@ from app.models.llm_model import LLMModel
 from app.models.device import Device
 from app.api.auth import get_current_user
 from app.models.user import User
-from app.services.llm_service import create_llm_service
+from app.services.llm_service import LLMService, create_llm_service
 from app.services.plugin_service import PluginService
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -91,22 +98,25 @@ class ChatDeviceResponse(BaseModel):
 # API Endpoints
 # ============================================================================
 
-@router.post("/", response_model=ChatResponse)
-async def chat_with_agent(
-    request: ChatRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
+@dataclass
+class PreparedChat:
+    """对话准备结果：模型、可调用的函数、完整消息列表和知识库检索来源"""
+    llm_model: LLMModel
+    plugin_service: PluginService
+    functions: List[Dict[str, Any]]
+    messages: List[Dict[str, Any]]
+    knowledge_sources: List[KnowledgeSourceInfo]
+
+
+async def prepare_agent_chat(request: ChatRequest, db: Session, current_user: User) -> PreparedChat:
     """
-    与智能体对话
+    准备与智能体的对话（普通对话和流式对话共用）
     
     流程：
     1. 获取智能体配置（提示词、插件、模型）
     2. 解析插件为 Function Calling 格式
-    3. 构建完整消息（系统提示词 + 历史消息 + 用户消息）
-    4. 调用大模型获取回复
-    5. 如果模型返回函数调用，执行函数并再次调用模型
-    6. 返回最终回复
+    3. 检索智能体关联的知识库
+    4. 构建完整消息（系统提示词 + 历史消息 + 用户消息）
     """
     
     # 1. 获取智能体
@@ -158,13 +168,10 @@ async def chat_with_agent(
     knowledge_context = ""
     
     try:
-        from app.models.knowledge_base import KnowledgeBase, AgentKnowledgeBase
-        from app.models.document import Document, DocumentChunk
+        from app.models.knowledge_base import AgentKnowledgeBase
         from app.services.embedding_service import get_embedding_service
-        import numpy as np
-        import logging
-        
-        logger = logging.getLogger(__name__)
+        from app.services.vector_index import vector_index_manager
+        from app.services.knowledge_retrieval import hydrate_chunks, kb_meta_cache
         
         # 查询智能体关联的知识库
         kb_associations = db.query(AgentKnowledgeBase).filter(
@@ -177,71 +184,50 @@ async def chat_with_agent(
             
             # 对用户消息进行向量化
             embedding_service = get_embedding_service()
-            query_vector = await embedding_service.embed_text(request.message)
+            query_vector = await embedding_service.embed_query(request.message)
             
             if query_vector:
                 logger.info(f"[知识库检索] 用户消息向量化成功")
                 
-                # 在每个关联的知识库中检索
-                all_results = []
+                # 在每个关联的知识库中检索（每个知识库最多取 max_results 个，合并后再取全局 top_k）
+                max_results = max([assoc.top_k for assoc in kb_associations]) if kb_associations else 5
+                kb_infos = kb_meta_cache.get_many([assoc.knowledge_base_id for assoc in kb_associations], db)
+                all_matches = []
                 for assoc in kb_associations:
-                    kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == assoc.knowledge_base_id).first()
+                    kb = kb_infos.get(assoc.knowledge_base_id)
                     if not kb:
                         continue
                     
                     logger.info(f"[知识库检索] 在知识库 '{kb.name}' 中检索...")
                     
-                    # 获取该知识库的所有已向量化文本块
-                    chunks = db.query(DocumentChunk).filter(
-                        DocumentChunk.knowledge_base_id == kb.id,
-                        DocumentChunk.embedding_vector.isnot(None)
-                    ).all()
-                    
-                    logger.info(f"[知识库检索] 找到 {len(chunks)} 个已向量化文本块")
-                    
-                    # 收集所有相似度用于调试
-                    similarities = []
+                    # 使用知识库向量索引检索（相似度已归一化到0-1，与测试界面保持一致）
                     threshold = float(assoc.similarity_threshold) if assoc.similarity_threshold else 0.7
+                    matches = await vector_index_manager.search_async(
+                        query_vector,
+                        [kb.id],
+                        max_results,
+                        threshold
+                    )
                     
-                    for chunk in chunks:
-                        if chunk.embedding_vector:
-                            # 使用embedding_service的calculate_similarity方法（已归一化到0-1）
-                            # 与测试界面保持一致
-                            similarity = embedding_service.calculate_similarity(
-                                query_vector,
-                                chunk.embedding_vector
-                            )
-                            similarities.append(similarity)
-                            
-                            # 只保留相似度高于阈值的结果
-                            if similarity >= threshold:
-                                doc = db.query(Document).filter(Document.id == chunk.document_id).first()
-                                if doc:
-                                    all_results.append({
-                                        'kb_name': kb.name,
-                                        'doc_title': doc.title,
-                                        'chunk_content': chunk.content,
-                                        'similarity': similarity,
-                                        'chunk_index': chunk.chunk_index
-                                    })
-                    
-                    # 输出相似度统计信息
-                    if similarities:
-                        max_sim = max(similarities)
-                        min_sim = min(similarities)
-                        avg_sim = sum(similarities) / len(similarities)
-                        above_threshold = sum(1 for s in similarities if s >= threshold)
-                        logger.info(f"[知识库检索] 相似度统计 - 最高:{max_sim:.4f}, 最低:{min_sim:.4f}, 平均:{avg_sim:.4f}, 阈值:{threshold}, 超过阈值:{above_threshold}个")
-                        # 输出前5个最高相似度
-                        top5 = sorted(similarities, reverse=True)[:5]
-                        logger.info(f"[知识库检索] Top5相似度: {[f'{s:.4f}' for s in top5]}")
+                    logger.info(f"[知识库检索] 超过阈值 {threshold} 的文本块: {len(matches)} 个")
+                    if matches:
+                        logger.info(f"[知识库检索] Top5相似度: {[f'{s:.4f}' for _, s in matches[:5]]}")
+                    all_matches.extend(matches)
                 
-                # 排序并取top_k
-                all_results.sort(key=lambda x: x['similarity'], reverse=True)
-                max_results = max([assoc.top_k for assoc in kb_associations]) if kb_associations else 5
-                top_results = all_results[:max_results]
+                # 排序并取top_k，只为最终结果加载文本块和文档
+                all_matches.sort(key=lambda x: x[1], reverse=True)
+                top_results = [
+                    {
+                        'kb_name': r['knowledge_base'].name,
+                        'doc_title': r['document'].title,
+                        'chunk_content': r['chunk'].content,
+                        'similarity': r['similarity_score'],
+                        'chunk_index': r['chunk'].chunk_index
+                    }
+                    for r in hydrate_chunks(all_matches[:max_results], db)
+                ]
                 
-                logger.info(f"[知识库检索] 共找到 {len(all_results)} 个相关结果，取前 {len(top_results)} 个")
+                logger.info(f"[知识库检索] 共找到 {len(all_matches)} 个相关结果，取前 {len(top_results)} 个")
                 
                 # 构建知识库上下文
                 if top_results:
@@ -395,111 +381,153 @@ async def chat_with_agent(
         "content": request.message
     })
     
-    # 6. 调用大模型
-    llm_service = create_llm_service(llm_model)
+    return PreparedChat(
+        llm_model=llm_model,
+        plugin_service=plugin_service,
+        functions=functions,
+        messages=messages,
+        knowledge_sources=knowledge_sources
+    )
+
+
+def get_function_calls(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """模型本轮请求的全部函数调用（工具调用格式可能一次返回多个）"""
+    return result.get("function_calls") or ([result["function_call"]] if result.get("function_call") else [])
+
+
+async def execute_function_calls(prepared: PreparedChat, function_calls: List[Dict[str, Any]]) -> List[PluginCallInfo]:
+    """
+    执行模型同一轮请求的函数调用，并将调用和结果按原顺序追加到消息历史
+    
+    同一轮的调用彼此独立，并行执行；每个插件的超时和并发上限由 PluginService 控制。
+    """
+    results = await asyncio.gather(*[
+        prepared.plugin_service.call_function(
+            function_name=function_call["name"],
+            arguments=function_call["arguments"],
+            functions=prepared.functions
+        )
+        for function_call in function_calls
+    ])
+    
+    calls_info = []
+    for function_call, function_result in zip(function_calls, results):
+        function_name = function_call["name"]
+        function_args = function_call["arguments"]
+        
+        # 查找插件名称
+        plugin_name = "未知插件"
+        for func in prepared.functions:
+            if func.get("name") == function_name:
+                plugin_name = func.get("metadata", {}).get("plugin_name", "未知插件")
+                break
+        
+        formatted_result = prepared.plugin_service.format_function_result(function_result)
+        
+        # 将函数调用结果添加到消息历史
+        # 注意：arguments 必须是 JSON 字符串，不能是对象
+        prepared.messages.append({
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": function_name,
+                "arguments": json.dumps(function_args, ensure_ascii=False) if isinstance(function_args, dict) else function_args
+            }
+        })
+        
+        prepared.messages.append({
+            "role": "function",
+            "name": function_name,
+            "content": formatted_result
+        })
+        
+        calls_info.append(PluginCallInfo(
+            plugin_name=plugin_name,
+            function_name=function_name,
+            arguments=function_args,
+            result=formatted_result
+        ))
+    
+    return calls_info
+
+
+def accumulate_usage(totals: Dict[str, int], usage: Optional[Dict[str, Any]]):
+    """累计多次模型调用的 token 使用量"""
+    if not usage:
+        return
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        totals[key] += usage.get(key, 0) or 0
+
+
+def build_token_usage(totals: Dict[str, int]) -> Optional[TokenUsage]:
+    if totals["total_tokens"] <= 0:
+        return None
+    return TokenUsage(**totals)
+
+
+# 防止无限循环，最多连续调用10次函数
+MAX_FUNCTION_CALLS = 10
+
+
+@router.post("/", response_model=ChatResponse)
+async def chat_with_agent(
+    request: ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    与智能体对话
+    
+    流程：
+    1. 准备对话（智能体配置、插件、知识库检索、完整消息），见 prepare_agent_chat
+    2. 调用大模型获取回复
+    3. 如果模型返回函数调用，执行函数并再次调用模型
+    4. 返回最终回复
+    """
+    prepared = await prepare_agent_chat(request, db, current_user)
+    functions = prepared.functions
+    
+    # 调用大模型
+    llm_service = create_llm_service(prepared.llm_model)
     
     # 用于收集插件调用信息
     plugin_calls_info = []
     # 用于累计 token 使用量
-    total_prompt_tokens = 0
-    total_completion_tokens = 0
-    total_tokens = 0
+    usage_totals = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
     
     try:
         # 首次调用
-        result = llm_service.chat(
-            messages=messages,
+        result = await llm_service.chat(
+            messages=prepared.messages,
             functions=functions if functions else None,
             function_call="auto" if functions else None
         )
+        accumulate_usage(usage_totals, result.get("usage"))
         
-        # 累计第一次调用的 token
-        if "usage" in result:
-            usage = result["usage"]
-            total_prompt_tokens += usage.get("prompt_tokens", 0)
-            total_completion_tokens += usage.get("completion_tokens", 0)
-            total_tokens += usage.get("total_tokens", 0)
-        
-        # 7. 处理函数调用（支持多次连续调用）
-        max_function_calls = 10  # 防止无限循环，最多连续调用10次
+        # 处理函数调用（支持多次连续调用）
         function_call_count = 0
         
-        while "function_call" in result and function_call_count < max_function_calls:
+        while "function_call" in result and function_call_count < MAX_FUNCTION_CALLS:
             function_call_count += 1
             
-            function_call = result["function_call"]
-            function_name = function_call["name"]
-            function_args = function_call["arguments"]
-            
-            # 查找插件名称
-            plugin_name = "未知插件"
-            for func in functions:
-                if func.get("name") == function_name:
-                    plugin_name = func.get("metadata", {}).get("plugin_name", "未知插件")
-                    break
-            
-            # 执行函数
-            function_result = plugin_service.call_function(
-                function_name=function_name,
-                arguments=function_args,
-                functions=functions
-            )
-            
-            # 记录插件调用信息
-            plugin_calls_info.append(PluginCallInfo(
-                plugin_name=plugin_name,
-                function_name=function_name,
-                arguments=function_args,
-                result=plugin_service.format_function_result(function_result)
-            ))
-            
-            # 将函数调用结果添加到消息历史
-            # 注意：arguments 必须是 JSON 字符串，不能是对象
-            import json
-            messages.append({
-                "role": "assistant",
-                "content": None,
-                "function_call": {
-                    "name": function_name,
-                    "arguments": json.dumps(function_args, ensure_ascii=False) if isinstance(function_args, dict) else function_args
-                }
-            })
-            
-            messages.append({
-                "role": "function",
-                "name": function_name,
-                "content": plugin_service.format_function_result(function_result)
-            })
+            # 执行函数（同一轮的多个调用并行执行）并记录插件调用信息
+            plugin_calls_info.extend(await execute_function_calls(prepared, get_function_calls(result)))
             
             # 再次调用模型，让它基于函数结果生成回复或继续调用函数
-            result = llm_service.chat(
-                messages=messages,
+            result = await llm_service.chat(
+                messages=prepared.messages,
                 functions=functions if functions else None,
                 function_call="auto" if functions else None
             )
-            
-            # 累计后续调用的 token
-            if "usage" in result:
-                usage = result["usage"]
-                total_prompt_tokens += usage.get("prompt_tokens", 0)
-                total_completion_tokens += usage.get("completion_tokens", 0)
-                total_tokens += usage.get("total_tokens", 0)
-        
-        # 8. 返回回复
-        token_usage = None
-        if total_tokens > 0:
-            token_usage = TokenUsage(
-                prompt_tokens=total_prompt_tokens,
-                completion_tokens=total_completion_tokens,
-                total_tokens=total_tokens
-            )
+            accumulate_usage(usage_totals, result.get("usage"))
         
+        # 返回回复
         response = ChatResponse(
             response=result.get("response", "抱歉，我现在无法回答这个问题。"),
             function_call=result.get("function_call"),
-            token_usage=token_usage,
+            token_usage=build_token_usage(usage_totals),
             plugin_calls=plugin_calls_info if plugin_calls_info else [],
-            knowledge_sources=knowledge_sources if knowledge_sources else []
+            knowledge_sources=prepared.knowledge_sources if prepared.knowledge_sources else []
         )
         
         return response
@@ -512,6 +540,91 @@ async def chat_with_agent(
         )
 
 
+def sse_event(event: str, data: Any) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_agent_chat(prepared: PreparedChat, llm_service: LLMService) -> AsyncIterator[str]:
+    """流式对话事件生成器（模型文本片段到达即转发，函数调用在两轮生成之间执行）"""
+    functions = prepared.functions
+    plugin_calls_info = []
+    usage_totals = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    
+    try:
+        if prepared.knowledge_sources:
+            yield sse_event("knowledge_sources", [source.model_dump() for source in prepared.knowledge_sources])
+        
+        function_call_count = 0
+        while True:
+            result = None
+            async for event in llm_service.chat_stream(
+                messages=prepared.messages,
+                functions=functions if functions else None,
+                function_call="auto" if functions else None
+            ):
+                if event["type"] == "delta":
+                    yield sse_event("delta", {"content": event["content"]})
+                else:
+                    result = event
+            accumulate_usage(usage_totals, result.get("usage"))
+            
+            if not result.get("function_call") or function_call_count >= MAX_FUNCTION_CALLS:
+                break
+            function_call_count += 1
+            
+            for call_info in await execute_function_calls(prepared, get_function_calls(result)):
+                plugin_calls_info.append(call_info)
+                yield sse_event("plugin_call", call_info.model_dump())
+        
+        token_usage = build_token_usage(usage_totals)
+        if token_usage:
+            logger.info(f"📊 流式对话Token使用: {token_usage.model_dump()}")
+        
+        yield sse_event("done", {
+            "response": result.get("response") or "抱歉，我现在无法回答这个问题。",
+            "function_call": result.get("function_call"),
+            "token_usage": token_usage.model_dump() if token_usage else None,
+            "plugin_calls": [call.model_dump() for call in plugin_calls_info],
+            "knowledge_sources": [source.model_dump() for source in prepared.knowledge_sources]
+        })
+    
+    except Exception as e:
+        logger.error(f"流式调用大模型失败: {e}", exc_info=True)
+        yield sse_event("error", {"message": f"调用大模型失败: {str(e)}"})
+
+
+@router.post("/stream")
+async def chat_with_agent_stream(
+    request: ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    与智能体流式对话（Server-Sent Events）
+    
+    请求参数与普通对话相同，准备阶段（权限、模型、知识库检索）出错时直接返回错误响应。
+    
+    事件类型：
+    - knowledge_sources: 知识库检索来源（开始生成前发送）
+    - delta: 模型输出的文本片段 {"content": "..."}
+    - plugin_call: 插件调用完成（PluginCallInfo）
+    - done: 结束，包含最终回复、token_usage、plugin_calls、knowledge_sources
+    - error: 调用失败 {"message": "..."}
+    """
+    prepared = await prepare_agent_chat(request, db, current_user)
+    llm_service = create_llm_service(prepared.llm_model)
+    
+    return StreamingResponse(
+        stream_agent_chat(prepared, llm_service),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁止 Nginx 缓冲，保证事件实时送达
+        }
+    )
+
+
 @router.get("/my-devices", response_model=List[ChatDeviceResponse])
 async def get_my_devices(
     db: Session = Depends(get_db),
@@ -670,6 +670,10 @@ async def delete_document(
     
     db.commit()
     
+    # 从知识库检索索引中移除该文档
+    from app.services.knowledge_retrieval import refresh_document_indexes
+    refresh_document_indexes(kb.id, doc.id, db)
+    
     return success_response(message="文档已删除")
 
 
@@ -787,7 +791,7 @@ async def list_document_chunks(
     chunk_list = []
     for chunk in chunks:
         chunk_dict = DocumentChunkResponse.from_orm(chunk).model_dump()
-        chunk_dict['has_embedding'] = chunk.embedding_vector is not None
+        chunk_dict['has_embedding'] = chunk.has_embedding
         chunk_list.append(chunk_dict)
     
     return success_response(data={
@@ -885,7 +889,7 @@ async def search_knowledge_base(
     # 检查知识库是否有向量化的文档
     chunk_count = db.query(func.count(DocumentChunk.id)).filter(
         DocumentChunk.knowledge_base_id == kb.id,
-        DocumentChunk.embedding_vector.isnot(None)
+        DocumentChunk.has_embedding
     ).scalar()
     
     if chunk_count == 0:
@@ -915,52 +919,28 @@ async def search_knowledge_base(
         from app.services.embedding_service import get_embedding_service
         embedding_service = get_embedding_service()
         
-        query_vector = await embedding_service.embed_text(expanded_query)
+        query_vector = await embedding_service.embed_query(expanded_query)
         
         if not query_vector:
             return error_response(message="查询文本向量化失败，请稍后重试", code=500)
         
-        # 2. 获取所有有向量的文档块
-        chunks = db.query(DocumentChunk).filter(
-            DocumentChunk.knowledge_base_id == kb.id,
-            DocumentChunk.embedding_vector.isnot(None)
-        ).all()
-        
-        logger.info(f"找到 {len(chunks)} 个已向量化的文档块")
-        
-        # 4. 计算相似度（使用embedding_service的统一方法）
-        results = []
-        similarities = []  # 用于统计
+        # 3. 通过知识库向量索引取相似度最高的 top_k 个文档块（阈值在下面统一处理，便于降级）
+        from app.services.vector_index import vector_index_manager
+        from app.services.knowledge_retrieval import hydrate_chunks
+        matches = await vector_index_manager.search_async(query_vector, [kb.id], top_k, 0.0)
         
-        for chunk in chunks:
-            if chunk.embedding_vector:
-                # 使用embedding_service的calculate_similarity方法（已归一化到0-1）
-                similarity = embedding_service.calculate_similarity(
-                    query_vector,
-                    chunk.embedding_vector
-                )
-                similarities.append(similarity)
-                
-                results.append({
-                    'chunk': chunk,
-                    'similarity': float(similarity)
-                })
+        # 4. 批量加载文档块和文档信息（保持相似度降序）
+        results = [
+            {'chunk': r['chunk'], 'document': r['document'], 'similarity': r['similarity_score']}
+            for r in hydrate_chunks(matches, db)
+        ]
         
         # 5. 相似度统计
-        if similarities:
-            max_sim = max(similarities)
-            min_sim = min(similarities)
-            avg_sim = sum(similarities) / len(similarities)
-            logger.info(f"相似度统计 - 最高:{max_sim:.4f}, 最低:{min_sim:.4f}, 平均:{avg_sim:.4f}, 总数:{len(similarities)}")
-            
-            # 输出Top5相似度
-            top5 = sorted(similarities, reverse=True)[:5]
+        if results:
+            top5 = [r['similarity'] for r in results[:5]]
             logger.info(f"Top5相似度: {[f'{s:.4f}' for s in top5]}")
         
-        # 6. 按相似度排序
-        results.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        # 7. 应用相似度阈值过滤
+        # 6. 应用相似度阈值过滤
         filtered_results = [r for r in results if r['similarity'] >= similarity_threshold]
         
         if filtered_results:
@@ -977,18 +957,17 @@ async def search_knowledge_base(
                 # 如果降级后仍没有结果，至少返回最高相似度的结果
                 filtered_results = results[:1] if results else []
         
-        # 8. 取前 top_k 个
+        # 7. 取前 top_k 个
         top_results = filtered_results[:top_k]
         
         if top_results:
             logger.info(f"最终返回 {len(top_results)} 个结果，最高相似度: {top_results[0]['similarity']:.4f}")
         
-        # 5. 构建响应数据
+        # 8. 构建响应数据
         result_list = []
         for item in top_results:
             chunk = item['chunk']
-            # 获取文档信息
-            doc = db.query(Document).filter(Document.id == chunk.document_id).first()
+            doc = item['document']
             
             result_list.append({
                 'chunk_id': chunk.id,
@@ -1012,7 +991,7 @@ async def search_knowledge_base(
             "query": query,
             "results": result_list,
             "total": len(result_list),
-            "searched_chunks": len(chunks),
+            "searched_chunks": chunk_count,
             "kb_info": {
                 "name": kb.name,
                 "document_count": kb.document_count,
@@ -5,17 +5,21 @@
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import time
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.core.response import success_response, error_response
 from app.api.auth import get_current_user
 from app.models.user import User
 from app.models.knowledge_base import KnowledgeBase
-from app.models.document import Document, DocumentChunk
+from app.models.document import Document
 from app.schemas.document_schema import KnowledgeSearchRequest, KnowledgeSearchResponse, SearchResultItem
 from app.services.embedding_service import get_embedding_service
+from app.services.vector_index import vector_index_manager
+from app.services.keyword_index import keyword_index_manager
+from app.services.knowledge_retrieval import hydrate_chunks, normalize_keyword_scores, fuse_hybrid_scores
 from app.utils.timezone import get_beijing_time_naive
 
 router = APIRouter()
@@ -46,12 +50,59 @@ def get_accessible_kb_ids(user: User, db: Session) -> List[int]:
     return accessible_ids
 
 
-async def vector_search(
+async def vector_candidates(
     query: str,
     kb_ids: List[int],
     top_k: int,
     similarity_threshold: float,
+    db: Session,
+    exact: bool = False
+) -> List[Tuple[int, float]]:
+    """
+    向量检索候选（未加载文本块和文档）
+    
+    Returns:
+        List[Tuple[int, float]]: (chunk_id, 0-1相似度)，按相似度降序
+    """
+    # 获取Embedding服务
+    embedding_service = get_embedding_service()
+    
+    # 对查询进行向量化
+    query_embedding = await embedding_service.embed_query(query)
+    if not query_embedding:
+        return []
+    
+    return await vector_index_manager.search_async(
+        query_embedding,
+        kb_ids,
+        top_k,
+        similarity_threshold,
+        exact=exact
+    )
+
+
+async def keyword_candidates(
+    query: str,
+    kb_ids: List[int],
+    top_k: int,
     db: Session
+) -> List[Tuple[int, float]]:
+    """
+    BM25关键词检索候选（未加载文本块和文档）
+    
+    Returns:
+        List[Tuple[int, float]]: (chunk_id, 按最高分归一化到0-1的得分)，按得分降序
+    """
+    return normalize_keyword_scores(await keyword_index_manager.search_async(query, kb_ids, top_k))
+
+
+async def vector_search(
+    query: str,
+    kb_ids: List[int],
+    top_k: int,
+    similarity_threshold: float,
+    db: Session,
+    exact: bool = False
 ) -> List[dict]:
     """
     向量检索
@@ -62,68 +113,26 @@ async def vector_search(
         top_k: 返回数量
         similarity_threshold: 相似度阈值
         db: 数据库会话
+        exact: 是否跳过近似索引，使用精确检索
     
     Returns:
         List[dict]: 检索结果列表
     """
-    # 获取Embedding服务
-    embedding_service = get_embedding_service()
-    
-    # 对查询进行向量化
-    query_embedding = await embedding_service.embed_text(query)
-    if not query_embedding:
-        return []
+    # 多取一些候选，过滤掉已删除/禁用文档后再截断
+    candidates = await vector_candidates(query, kb_ids, top_k * 2, similarity_threshold, db, exact=exact)
     
-    # 查询所有相关文本块
-    chunks = db.query(DocumentChunk).join(
-        Document, DocumentChunk.document_id == Document.id
-    ).filter(
-        DocumentChunk.knowledge_base_id.in_(kb_ids),
-        DocumentChunk.embedding_vector.isnot(None),
-        Document.deleted_at.is_(None),
-        Document.is_active == 1
-    ).all()
-    
-    # 计算相似度
-    results = []
-    for chunk in chunks:
-        if chunk.embedding_vector:
-            # 从JSON中提取向量
-            chunk_embedding = chunk.embedding_vector
-            
-            # 计算余弦相似度
-            similarity = embedding_service.calculate_similarity(
-                query_embedding,
-                chunk_embedding
-            )
-            
-            # 过滤低于阈值的结果
-            if similarity >= similarity_threshold:
-                # 获取文档和知识库信息
-                doc = db.query(Document).filter(Document.id == chunk.document_id).first()
-                kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == chunk.knowledge_base_id).first()
-                
-                if doc and kb:
-                    results.append({
-                        'chunk': chunk,
-                        'document': doc,
-                        'knowledge_base': kb,
-                        'similarity_score': similarity
-                    })
-    
-    # 按相似度排序并取topK
-    results.sort(key=lambda x: x['similarity_score'], reverse=True)
-    return results[:top_k]
+    # 排序完成后一次性加载文本块、文档和知识库信息
+    return hydrate_chunks(candidates, db)[:top_k]
 
 
-def keyword_search(
+async def keyword_search(
     query: str,
     kb_ids: List[int],
     top_k: int,
     db: Session
 ) -> List[dict]:
     """
-    关键词检索
+    关键词检索（BM25倒排索引，支持中英文）
     
     Args:
         query: 查询文本
@@ -134,37 +143,28 @@ def keyword_search(
     Returns:
         List[dict]: 检索结果列表
     """
-    # 查询包含关键词的文本块
-    chunks = db.query(DocumentChunk).join(
-        Document, DocumentChunk.document_id == Document.id
-    ).filter(
-        DocumentChunk.knowledge_base_id.in_(kb_ids),
-        DocumentChunk.content.like(f"%{query}%"),
-        Document.deleted_at.is_(None),
-        Document.is_active == 1
-    ).limit(top_k * 2).all()  # 多取一些，后续可以排序
-    
-    results = []
-    for chunk in chunks:
-        # 获取文档和知识库信息
-        doc = db.query(Document).filter(Document.id == chunk.document_id).first()
-        kb = db.query(KnowledgeBase).filter(KnowledgeBase.id == chunk.knowledge_base_id).first()
-        
-        if doc and kb:
-            # 简单的相关性评分（关键词出现次数）
-            keyword_count = chunk.content.lower().count(query.lower())
-            score = min(1.0, keyword_count * 0.2)  # 简单归一化
-            
-            results.append({
-                'chunk': chunk,
-                'document': doc,
-                'knowledge_base': kb,
-                'similarity_score': score
-            })
-    
-    # 按评分排序
-    results.sort(key=lambda x: x['similarity_score'], reverse=True)
-    return results[:top_k]
+    candidates = await keyword_candidates(query, kb_ids, top_k * 2, db)
+    return hydrate_chunks(candidates, db)[:top_k]
+
+
+async def hybrid_search(
+    query: str,
+    kb_ids: List[int],
+    top_k: int,
+    similarity_threshold: float,
+    db: Session,
+    exact: bool = False
+) -> List[dict]:
+    """
+    混合检索：向量相似度与BM25得分加权融合
+    
+    向量候选仍受相似度阈值约束，关键词候选不受阈值约束（保证精确词命中能被召回）。
+    """
+    vector_results = await vector_candidates(query, kb_ids, top_k * 2, similarity_threshold, db, exact=exact)
+    keyword_results = await keyword_candidates(query, kb_ids, top_k * 2, db)
+    
+    fused = fuse_hybrid_scores(vector_results, keyword_results, settings.hybrid_vector_weight)
+    return hydrate_chunks(fused[:top_k * 2], db)[:top_k]
 
 
 @router.post("/search", response_model=dict)
@@ -212,11 +212,12 @@ async def search_knowledge(
             kb_ids,
             search_request.top_k,
             search_request.similarity_threshold,
-            db
+            db,
+            exact=search_request.exact_search
         )
     elif search_request.retrieval_mode == 'keyword':
         # 纯关键词检索
-        results = keyword_search(
+        results = await keyword_search(
             search_request.query,
             kb_ids,
             search_request.top_k,
@@ -224,40 +225,14 @@ async def search_knowledge(
         )
     else:
         # 混合检索（向量+关键词）
-        vector_results = await vector_search(
+        results = await hybrid_search(
             search_request.query,
             kb_ids,
             search_request.top_k,
             search_request.similarity_threshold,
-            db
-        )
-        
-        keyword_results = keyword_search(
-            search_request.query,
-            kb_ids,
-            search_request.top_k // 2,
-            db
+            db,
+            exact=search_request.exact_search
         )
-        
-        # 合并结果（去重）
-        seen_chunks = set()
-        results = []
-        
-        # 先添加向量检索结果
-        for r in vector_results:
-            if r['chunk'].id not in seen_chunks:
-                results.append(r)
-                seen_chunks.add(r['chunk'].id)
-        
-        # 再添加关键词检索结果
-        for r in keyword_results:
-            if r['chunk'].id not in seen_chunks and len(results) < search_request.top_k:
-                results.append(r)
-                seen_chunks.add(r['chunk'].id)
-        
-        # 重新排序
-        results.sort(key=lambda x: x['similarity_score'], reverse=True)
-        results = results[:search_request.top_k]
     
     # 转换为响应格式
     search_results = []
@@ -338,3 +313,18 @@ async def get_search_suggestions(
     
     return success_response(data={"suggestions": suggestions})
 
+
+
+@router.get("/cache-stats", response_model=dict)
+async def get_search_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """获取检索缓存命中统计（仅平台管理员）"""
+    if current_user.role != 'platform_admin':
+        return error_response(message="仅平台管理员可查看", code=403)
+    
+    from app.services.embedding_cache import query_embedding_cache
+    
+    return success_response(data={
+        "query_embedding": query_embedding_cache.get_stats()
+    })
@@ -320,6 +320,10 @@ async def update_knowledge_base(
     db.commit()
     db.refresh(kb)
     
+    # 失效检索结果中使用的知识库元数据缓存
+    from app.services.knowledge_retrieval import kb_meta_cache
+    kb_meta_cache.invalidate(kb.id)
+    
     return success_response(message="知识库更新成功")
 
 
@@ -359,6 +363,10 @@ async def delete_knowledge_base(
     
     db.commit()
     
+    # 释放该知识库的检索索引（内存和磁盘）和元数据缓存
+    from app.services.knowledge_retrieval import invalidate_kb_indexes
+    invalidate_kb_indexes(kb.id)
+    
     return success_response(message="知识库已删除")
 
 
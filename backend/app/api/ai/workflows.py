@@ -23,6 +23,8 @@ from app.api.auth import get_current_user
 from app.models.user import User
 from app.services.workflow_validator import WorkflowValidator
 from app.services.workflow_executor import WorkflowExecutor
+from app.services.workflow_plan import workflow_plan_cache
+from app.services.workflow_trace import summarize_executions
 from app.utils.timezone import get_beijing_time_naive
 
 logger = logging.getLogger(__name__)
@@ -51,6 +53,22 @@ def can_edit_workflow(workflow: Workflow, user: User) -> bool:
     return workflow.user_id == user.id
 
 
+def record_workflow_execution(db: Session, workflow: Workflow, success: bool):
+    """
+    累加工作流执行统计
+
+    使用 UPDATE 原子累加，并保持 updated_at 不变：执行统计不算编辑，
+    不应让执行计划缓存（按 updated_at 区分版本）失效
+    """
+    values = {
+        Workflow.execution_count: func.coalesce(Workflow.execution_count, 0) + 1,
+        Workflow.updated_at: Workflow.updated_at,
+    }
+    if success:
+        values[Workflow.success_count] = func.coalesce(Workflow.success_count, 0) + 1
+    db.query(Workflow).filter(Workflow.id == workflow.id).update(values, synchronize_session=False)
+
+
 @router.get("/", response_model=WorkflowListResponse)
 @router.get("", response_model=WorkflowListResponse)
 def get_workflows(
@@ -98,6 +116,20 @@ def get_workflows(
     return WorkflowListResponse(total=total, items=items)
 
 
+@router.get("/plan-cache/stats")
+def get_plan_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """获取工作流执行计划缓存的命中统计（仅管理员）"""
+    if not is_admin_user(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="仅管理员可查看"
+        )
+    
+    return success_response(data=workflow_plan_cache.get_stats())
+
+
 @router.post("/", response_model=WorkflowResponse)
 @router.post("", response_model=WorkflowResponse)
 def create_workflow(
@@ -217,6 +249,9 @@ def update_workflow(
     db.commit()
     db.refresh(workflow)
     
+    # 执行计划缓存失效（其他进程按 updated_at 判断版本）
+    workflow_plan_cache.invalidate(workflow_uuid)
+    
     return WorkflowResponse.model_validate(workflow)
 
 
@@ -249,6 +284,8 @@ def delete_workflow(
     workflow.is_deleted = 1
     db.commit()
     
+    workflow_plan_cache.invalidate(workflow_uuid)
+    
     return success_response(message="工作流删除成功")
 
 
@@ -277,14 +314,8 @@ def validate_workflow(
             detail="无权访问该工作流"
         )
     
-    # 执行验证（将JSON数据转换为WorkflowNode和WorkflowEdge对象）
-    nodes = [WorkflowNode(**node) if isinstance(node, dict) else node for node in workflow.nodes]
-    edges = [WorkflowEdge(**edge) if isinstance(edge, dict) else edge for edge in workflow.edges]
-    
-    validator = WorkflowValidator()
-    validation_result = validator.validate(nodes, edges)
-    
-    return validation_result
+    # 验证结果随执行计划编译并缓存
+    return workflow_plan_cache.get_plan(workflow).validation
 
 
 @router.post("/{workflow_uuid}/execute", response_model=WorkflowExecuteResponse)
@@ -313,12 +344,9 @@ async def execute_workflow(
             detail="无权执行该工作流"
         )
     
-    # 验证工作流（将JSON数据转换为WorkflowNode和WorkflowEdge对象）
-    nodes = [WorkflowNode(**node) if isinstance(node, dict) else node for node in workflow.nodes]
-    edges = [WorkflowEdge(**edge) if isinstance(edge, dict) else edge for edge in workflow.edges]
-    
-    validator = WorkflowValidator()
-    validation_result = validator.validate(nodes, edges)
+    # 获取执行计划（已验证、已编译，按工作流版本缓存）
+    plan = workflow_plan_cache.get_plan(workflow)
+    validation_result = plan.validation
     
     if not validation_result.is_valid:
         raise HTTPException(
@@ -341,11 +369,12 @@ async def execute_workflow(
         # 执行工作流
         executor = WorkflowExecutor()
         result = await executor.execute(
-            nodes=nodes,
-            edges=edges,
+            nodes=plan.nodes,
+            edges=plan.edges,
             input_data=execute_request.input,
             config=workflow.config,
-            db_session=db
+            db_session=db,
+            plan=plan
         )
         
         # 更新执行记录
@@ -356,8 +385,7 @@ async def execute_workflow(
         execution.execution_time = result.get("execution_time")
         
         # 更新工作流统计
-        workflow.execution_count += 1
-        workflow.success_count += 1
+        record_workflow_execution(db, workflow, success=True)
         
         db.commit()
         
@@ -377,7 +405,7 @@ async def execute_workflow(
         execution.completed_at = get_beijing_time_naive()
         
         # 更新工作流统计
-        workflow.execution_count += 1
+        record_workflow_execution(db, workflow, success=False)
         
         db.commit()
         
@@ -388,6 +416,44 @@ async def execute_workflow(
         )
 
 
+@router.get("/{workflow_uuid}/latency")
+def get_workflow_latency(
+    workflow_uuid: str,
+    limit: int = Query(200, ge=1, le=5000, description="统计最近的执行记录数"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """获取工作流及各节点的延迟分布（p50/p95/p99，基于最近的执行记录）"""
+    workflow = db.query(Workflow).filter(
+        Workflow.uuid == workflow_uuid,
+        Workflow.is_deleted == 0
+    ).first()
+    
+    if not workflow:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="工作流不存在"
+        )
+    
+    # 权限检查
+    if not can_access_workflow(workflow, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权访问该工作流"
+        )
+    
+    # 只加载统计需要的列
+    executions = db.query(
+        WorkflowExecution.execution_time,
+        WorkflowExecution.node_executions
+    ).filter(
+        WorkflowExecution.workflow_id == workflow.id,
+        WorkflowExecution.status.in_(["completed", "failed"])
+    ).order_by(WorkflowExecution.created_at.desc()).limit(limit).all()
+    
+    return success_response(data=summarize_executions(executions))
+
+
 @router.get("/executions/{execution_id}", response_model=WorkflowExecutionResponse)
 def get_execution(
     execution_id: str,
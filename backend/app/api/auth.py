@@ -26,6 +26,7 @@ from app.core.constants import (
     ErrorMessages, SuccessMessages
 )
 from app.core.config import settings
+from app.core.principal_cache import principal_cache
 from app.services.email import send_welcome_email, send_password_reset_email
 from app.utils.captcha import captcha_store, create_captcha
 
@@ -266,7 +267,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == int(user_id)).first()
+    user = await principal_cache.get_user(db, int(user_id))
     if user is None:
         raise credentials_exception
     
@@ -363,7 +364,7 @@ async def verify_internal_or_user(
             payload = verify_token(token)
             user_id: str = payload.get("sub")
             if user_id:
-                user = db.query(User).filter(User.id == int(user_id)).first()
+                user = await principal_cache.get_user(db, int(user_id))
                 if user:
                     logger.info(f"✅ JWT认证通过: user_id={user_id}")
                     return user
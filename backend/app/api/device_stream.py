@@ -0,0 +1,253 @@
+"""
+设备数据实时推送接口
+替代轮询 /devices/{uuid}/realtime-data 和 /sensor-data：
+- SSE：GET /devices/stream?devices=uuid1,uuid2&interval=1
+- WebSocket：/devices/ws?interval=1，连接后发送 {"action": "subscribe", "devices": [...]}
+
+浏览器的 EventSource/WebSocket 无法设置请求头，token 可通过查询参数传递。
+订阅后先推送一帧当前数据（snapshot），之后按推送间隔推送合并后的增量（sensor_update）。
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.deps import oauth2_scheme
+from app.core.response import dumps_json, success_response
+from app.models.device import Device
+from app.models.device_sensor import DeviceSensor
+from app.models.user import User
+from app.api.auth import get_current_user
+from app.api.devices import can_access_device, is_admin_user
+from app.services.sensor_push import SensorSubscription, parse_sensor_value, sensor_push_hub
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# WebSocket 关闭码（4000-4999 为应用自定义）
+WS_CLOSE_UNAUTHORIZED = 4401
+
+
+def _parse_device_list(devices: Optional[str]) -> List[str]:
+    return [uuid.strip() for uuid in (devices or "").split(",") if uuid.strip()]
+
+
+async def _authenticate(token: Optional[str]) -> User:
+    """验证 token 并返回用户（使用短生命周期的数据库会话，不在整个连接期间占用连接）"""
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="需要认证",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    db = SessionLocal()
+    try:
+        user = await get_current_user(token=token, db=db)
+        db.expunge(user)
+        return user
+    finally:
+        db.close()
+
+
+def _authorize_devices(user: User, device_uuids: List[str]) -> Tuple[List[str], List[str], Dict[str, Dict[str, Any]]]:
+    """
+    按用户权限过滤设备并加载当前数据（两次查询）
+
+    Returns:
+        Tuple: (允许订阅的设备, 拒绝的设备, 当前数据快照)
+    """
+    device_uuids = list(dict.fromkeys(device_uuids))
+    if not device_uuids:
+        return [], [], {}
+
+    db = SessionLocal()
+    try:
+        devices = db.query(Device).filter(Device.uuid.in_(device_uuids)).all()
+        allowed = [device.uuid for device in devices if can_access_device(device, user, db)]
+        allowed_set = set(allowed)
+        denied = [uuid for uuid in device_uuids if uuid not in allowed_set]
+
+        snapshot: Dict[str, Dict[str, Any]] = {}
+        for device in devices:
+            if device.uuid in allowed_set:
+                snapshot[device.uuid] = {
+                    "online": bool(device.is_online),
+                    "last_seen": device.last_seen.isoformat() if device.last_seen else None,
+                    "sensors": {},
+                }
+        if allowed:
+            for row in db.query(DeviceSensor).filter(DeviceSensor.device_uuid.in_(allowed)):
+                snapshot[row.device_uuid]["sensors"][row.sensor_name] = {
+                    "value": parse_sensor_value(row.sensor_value),
+                    "unit": row.sensor_unit or "",
+                    "type": row.sensor_type or "",
+                    "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                }
+        return allowed, denied, snapshot
+    finally:
+        db.close()
+
+
+async def _subscribe_devices(
+    subscription: SensorSubscription,
+    user: User,
+    device_uuids: List[str]
+) -> Tuple[List[str], List[str], Dict[str, Dict[str, Any]]]:
+    """校验权限并加入订阅（超出单连接设备数上限的部分拒绝）"""
+    room = max(settings.sensor_push_max_devices - len(subscription.device_uuids), 0)
+    new_uuids = [uuid for uuid in dict.fromkeys(device_uuids) if uuid not in subscription.device_uuids]
+    over_limit = new_uuids[room:]
+    # 数据库查询放到线程中执行，订阅索引只在事件循环中修改
+    allowed, denied, snapshot = await asyncio.to_thread(_authorize_devices, user, new_uuids[:room])
+    sensor_push_hub.add_devices(subscription, allowed)
+    return allowed, denied + over_limit, snapshot
+
+
+def _sse_event(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps_json(data) + b"\n\n"
+
+
+@router.get("/stream", summary="设备数据实时推送（SSE）")
+async def stream_device_data(
+    request: Request,
+    devices: str = Query(..., description="设备UUID列表，逗号分隔"),
+    interval: Optional[float] = Query(None, gt=0, description="推送间隔（秒），间隔内的更新合并为一帧"),
+    token: Optional[str] = Query(None, description="访问令牌（EventSource 无法设置请求头时使用）"),
+    header_token: Optional[str] = Depends(oauth2_scheme)
+):
+    """以 Server-Sent Events 推送设备传感器数据
+
+    事件类型：
+    - snapshot：订阅时的当前数据
+    - sensor_update：推送间隔内合并后的增量 {"ts", "devices": {uuid: {sensors, status, online, last_seen}}}
+    """
+    user = await _authenticate(header_token or token)
+    device_uuids = _parse_device_list(devices)
+    if not device_uuids:
+        raise HTTPException(status_code=400, detail="请指定要订阅的设备")
+
+    subscription = sensor_push_hub.subscribe(interval)
+    try:
+        allowed, denied, snapshot = await _subscribe_devices(subscription, user, device_uuids)
+    except BaseException:
+        subscription.close()
+        raise
+    if not allowed:
+        subscription.close()
+        raise HTTPException(status_code=403, detail="无权访问所请求的设备")
+
+    async def event_stream():
+        try:
+            yield _sse_event("snapshot", {"devices": snapshot, "denied": denied})
+            while True:
+                frame = await subscription.next_frame(timeout=settings.sensor_push_keepalive)
+                if await request.is_disconnected():
+                    break
+                if frame is None:
+                    yield b": keepalive\n\n"
+                else:
+                    yield _sse_event("sensor_update", {"ts": time.time(), "devices": frame})
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 关闭 Nginx 缓冲
+        },
+        # 连接在开始推送前断开时生成器不会执行，由后台任务兜底释放订阅
+        background=BackgroundTask(subscription.close)
+    )
+
+
+@router.websocket("/ws")
+async def websocket_device_data(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None),
+    interval: Optional[float] = Query(None, gt=0)
+):
+    """以 WebSocket 推送设备传感器数据
+
+    客户端消息：
+    - {"action": "subscribe", "devices": [...]} / {"action": "unsubscribe", "devices": [...]}
+    - {"action": "ping"}
+
+    服务端消息：subscribed / unsubscribed / snapshot / sensor_update / pong / error
+    """
+    auth_header = websocket.headers.get("authorization", "")
+    if auth_header.startswith("Bearer "):
+        token = auth_header[7:]
+    try:
+        user = await _authenticate(token)
+    except HTTPException as e:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    subscription = sensor_push_hub.subscribe(interval)
+
+    async def send(message: Dict[str, Any]):
+        await websocket.send_text(dumps_json(message).decode("utf-8"))
+
+    async def receive_loop():
+        while True:
+            message = await websocket.receive_json()
+            action = message.get("action") if isinstance(message, dict) else None
+            device_uuids = message.get("devices") if isinstance(message, dict) else None
+            if not isinstance(device_uuids, list):
+                device_uuids = []
+            device_uuids = [str(uuid) for uuid in device_uuids]
+
+            if action == "subscribe":
+                allowed, denied, snapshot = await _subscribe_devices(subscription, user, device_uuids)
+                await send({"type": "subscribed", "devices": allowed, "denied": denied})
+                if snapshot:
+                    await send({"type": "snapshot", "devices": snapshot})
+            elif action == "unsubscribe":
+                sensor_push_hub.remove_devices(subscription, device_uuids)
+                await send({"type": "unsubscribed", "devices": device_uuids})
+            elif action == "ping":
+                await send({"type": "pong"})
+            else:
+                await send({"type": "error", "message": f"不支持的操作: {action}"})
+
+    async def send_loop():
+        while True:
+            frame = await subscription.next_frame(timeout=settings.sensor_push_keepalive)
+            if frame is None:
+                await send({"type": "ping"})
+            else:
+                await send({"type": "sensor_update", "ts": time.time(), "devices": frame})
+
+    tasks = [asyncio.create_task(receive_loop()), asyncio.create_task(send_loop())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                logger.warning(f"⚠️ 设备推送连接异常关闭: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        subscription.close()
+
+
+@router.get("/stream/stats", summary="设备数据推送统计")
+async def get_stream_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """获取推送中心的订阅和分发统计（仅管理员）"""
+    if not is_admin_user(current_user):
+        raise HTTPException(status_code=403, detail="仅管理员可查看")
+
+    return success_response(data=sensor_push_hub.get_stats())
@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import text
+from sqlalchemy import text, update
 from typing import List, Optional
 import uuid
 import logging
 from datetime import datetime
 
 from app.core.database import get_db
+from app.core.device_registry import device_registry
+from app.services.device_heartbeat import heartbeat_write_behind
 from app.models.device import Device
 from app.models.product import Product
 from app.models.device_sensor import DeviceSensor
@@ -234,43 +236,28 @@ def get_beijing_now():
     from datetime import datetime
     return datetime.now(BEIJING_TZ).replace(tzinfo=None)
 
-def check_and_update_device_offline_status(device: Device, db: Session) -> bool:
+def is_device_online(device: Device) -> bool:
     """
-    检查设备是否超时并自动更新为离线状态
-    
-    Args:
-        device: 设备对象
-        db: 数据库会话
-        
-    Returns:
-        bool: 如果设备状态被更新为离线，返回True；否则返回False
+    设备是否在线（只读，不修改数据库）
+
+    超时离线由 mqtt-service 的在线检测线程批量写入数据库；检测间隔内数据库中的
+    is_online 可能尚未更新，这里按 last_seen 一并判断，列表中不会显示已超时的设备为在线。
+    心跳接口延迟写入的心跳不参与判断（缓冲区按进程独立），写入间隔远小于离线超时时间。
     """
-    # 如果设备已经标记为离线，不需要检查
     if not device.is_online:
         return False
-    
-    # 如果没有最后在线时间，无法判断，保持原状态
+    # 没有最后在线时间无法判断，保持原状态
     if not device.last_seen:
-        return False
-    
-    # 计算超时时间（分钟转秒）
-    timeout_seconds = settings.device_offline_timeout_minutes * 60
-    
-    # 计算时间差
-    now = get_beijing_now()
-    time_diff = (now - device.last_seen).total_seconds()
-    
-    # 如果超过超时时间，设置为离线
-    if time_diff > timeout_seconds:
-        device.is_online = False
-        db.commit()
-        logger.debug(
-            f"设备 {device.uuid} ({device.name}) 超时离线: "
-            f"最后在线时间 {device.last_seen}, 已超时 {int(time_diff/60)} 分钟"
-        )
         return True
-    
-    return False
+    timeout_seconds = settings.device_offline_timeout_minutes * 60
+    return (get_beijing_now() - device.last_seen).total_seconds() <= timeout_seconds
+
+def get_device_last_seen(device: Device):
+    """设备最后在线时间（包括本进程尚未写入数据库的心跳）"""
+    pending = heartbeat_write_behind.get_last_seen(device.uuid)
+    if pending and (device.last_seen is None or pending > device.last_seen):
+        return pending
+    return device.last_seen
 
 def format_datetime_beijing(dt):
     """格式化datetime对象为北京时间（UTC+8）
@@ -328,9 +315,6 @@ def get_devices_with_product_info(
         # 构造响应数据
         result = []
         for device in devices:
-            # 检查设备是否超时，自动更新为离线状态
-            check_and_update_device_offline_status(device, db)
-            
             # 安全地获取设备状态（如果是枚举，转换为字符串）
             device_status_value = None
             if device.device_status:
@@ -369,9 +353,9 @@ def get_devices_with_product_info(
                 "location": device.location,
                 "group_name": device.group_name,
                 "is_active": device.is_active,
-                "is_online": device.is_online,
+                "is_online": is_device_online(device),
                 "error_count": device.error_count or 0,
-                "last_seen": format_datetime_beijing(device.last_seen),  # 格式化为北京时间
+                "last_seen": format_datetime_beijing(get_device_last_seen(device)),  # 格式化为北京时间
                 "created_at": format_datetime_beijing(device.created_at),  # 格式化为北京时间
                 "updated_at": format_datetime_beijing(device.updated_at),  # 格式化为北京时间
                 "description": device.description,
@@ -419,10 +403,11 @@ def get_device(
             detail="无权访问该设备"
         )
     
-    # 检查设备是否超时，自动更新为离线状态
-    check_and_update_device_offline_status(device, db)
-    
-    return device
+    # 在线状态和最后在线时间与列表接口使用相同的判断
+    response = DeviceResponse.model_validate(device)
+    response.is_online = is_device_online(device)
+    response.last_seen = get_device_last_seen(device)
+    return response
 
 @router.put("/{device_uuid}", response_model=DeviceResponse)
 def update_device(
@@ -782,22 +767,17 @@ async def device_heartbeat(
     db: Session = Depends(get_db)
 ):
     """设备心跳（模拟设备在线状态更新）"""
-    device = db.query(Device).filter(
-        Device.uuid == device_uuid,
-        Device.user_id == current_user.id
-    ).first()
+    # 设备身份从注册表缓存获取，只执行一条 UPDATE
+    device = device_registry.get_by_uuid(db, device_uuid)
     
-    if not device:
+    if not device or device.user_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="设备不存在"
         )
     
-    # 更新设备在线状态和最后心跳时间
-    device.is_online = True
-    device.last_seen = get_beijing_now()
-    
-    db.commit()
+    # 记录心跳，由后台任务合并后批量写入（间隔内只写最新一次）
+    heartbeat_write_behind.record(device.id, device.uuid, get_beijing_now())
     
     return success_response(message="心跳更新成功")
 
@@ -871,6 +851,7 @@ async def pre_register_device(
         existing_device.name = device_data.name
         existing_device.description = device_data.description
         existing_device.device_id = device_id  # 更新设备ID
+        heartbeat_write_behind.discard(existing_device.uuid)  # 丢弃旧UUID尚未写入的心跳
         existing_device.uuid = device_uuid  # 更新UUID
         existing_device.device_secret = device_secret  # 更新密钥
         existing_device.product_id = device_data.product_id  # 重新绑定产品
@@ -1007,6 +988,7 @@ async def register_device(
     device.hardware_version = register_data.hardware_version
     device.ip_address = register_data.ip_address
     device.mac_address = register_data.mac_address
+    heartbeat_write_behind.discard(device.uuid)
     device.is_online = True
     device.last_seen = get_beijing_now()
     device.updated_at = get_beijing_now()
@@ -1076,8 +1058,13 @@ async def get_device_config(
     - 保留此接口以支持前端和兼容性
     - 已移除权限校验，任何人都可以访问
     """
-    # 使用joinedload预加载产品信息，避免N+1查询问题
-    device = db.query(Device).options(joinedload(Device.product)).filter(Device.uuid == device_uuid).first()
+    # 不存在的设备由注册表缓存直接返回，不查询数据库
+    entry = device_registry.get_by_uuid(db, device_uuid)
+    
+    # 使用joinedload预加载产品信息，避免N+1查询问题（按主键查询）
+    device = None
+    if entry:
+        device = db.query(Device).options(joinedload(Device.product)).filter(Device.id == entry.id).first()
     
     if not device:
         raise HTTPException(
@@ -1274,11 +1261,8 @@ async def upload_device_data(
     db: Session = Depends(get_db)
 ):
     """设备数据上传 - 存储每个传感器的最后一次数据和上传时间"""
-    # 验证设备ID和密钥
-    device = db.query(Device).filter(
-        Device.device_id == data.device_id,
-        Device.device_secret == data.device_secret
-    ).first()
+    # 验证设备ID和密钥（设备身份从注册表缓存获取）
+    device = device_registry.authenticate(db, data.device_id, data.device_secret)
     
     if not device:
         raise HTTPException(
@@ -1289,13 +1273,13 @@ async def upload_device_data(
     # 获取当前时间（北京时间）
     current_time = get_beijing_now()
     
-    # 更新设备最后在线时间
-    device.last_seen = current_time
-    device.is_online = True
+    # 更新设备最后在线时间（丢弃尚未写入的心跳，避免之后覆盖）
+    heartbeat_write_behind.discard(device.uuid)
+    values = {"last_seen": current_time, "is_online": True}
     
     # 如果有IP地址信息，更新设备IP
     if hasattr(data, 'status') and data.status and 'ip_address' in data.status:
-        device.ip_address = data.status['ip_address']
+        values["ip_address"] = data.status['ip_address']
     
     # 构建传感器数据存储结构
     sensor_data_dict = {}
@@ -1308,20 +1292,16 @@ async def upload_device_data(
                 "timestamp": sensor.timestamp.isoformat() if sensor.timestamp else current_time.isoformat()
             }
     
-    # 更新设备的最后上报数据（JSON格式）
-    device.last_report_data = {
+    # 更新设备的最后上报数据（JSON格式，整体替换）
+    values["last_report_data"] = {
         "sensors": sensor_data_dict,
         "status": data.status if data.status else {},
         "location": data.location if data.location else {},
         "upload_timestamp": current_time.isoformat()  # 整体上传时间
     }
     
-    # 标记JSON字段已修改（SQLAlchemy需要）
-    from sqlalchemy.orm.attributes import flag_modified
-    flag_modified(device, "last_report_data")
-    
+    db.execute(update(Device).where(Device.id == device.id).values(**values))
     db.commit()
-    db.refresh(device)
     
     logger.info(
         f"✅ 设备数据上传成功 - 设备: {device.name} ({data.device_id}), "
@@ -1346,11 +1326,8 @@ async def update_device_status(
     db: Session = Depends(get_db)
 ):
     """设备状态更新"""
-    # 验证设备ID和密钥
-    device = db.query(Device).filter(
-        Device.device_id == status_data.device_id,
-        Device.device_secret == status_data.device_secret
-    ).first()
+    # 验证设备ID和密钥（设备身份从注册表缓存获取）
+    device = device_registry.authenticate(db, status_data.device_id, status_data.device_secret)
     
     if not device:
         raise HTTPException(
@@ -1358,16 +1335,20 @@ async def update_device_status(
             detail="设备ID或密钥无效"
         )
     
-    # 更新设备状态
-    device.is_online = (status_data.status == "online")
-    device.last_seen = get_beijing_now()
+    # 更新设备状态（丢弃尚未写入的心跳，避免之后把离线状态覆盖为在线）
+    heartbeat_write_behind.discard(device.uuid)
+    values = {
+        "is_online": status_data.status == "online",
+        "last_seen": get_beijing_now()
+    }
     
     # 更新其他信息
     if status_data.ip_address:
-        device.ip_address = status_data.ip_address
+        values["ip_address"] = status_data.ip_address
     if status_data.firmware_version:
-        device.firmware_version = status_data.firmware_version
+        values["firmware_version"] = status_data.firmware_version
     
+    db.execute(update(Device).where(Device.id == device.id).values(**values))
     db.commit()
     
     return success_response(
@@ -1612,6 +1593,71 @@ async def get_device_sensor_data(
     })
 
 
+@router.get("/{device_uuid}/sensor-history")
+async def get_device_sensor_history(
+    device_uuid: str,
+    sensors: Optional[str] = Query(None, description="传感器名称，逗号分隔（为空返回全部传感器）"),
+    start: Optional[datetime] = Query(None, description="开始时间（默认结束时间前1小时）"),
+    end: Optional[datetime] = Query(None, description="结束时间（默认当前时间）"),
+    resolution: str = Query("auto", description="数据精度：auto / raw（原始数据，最长 2 天）/ 1m（分钟聚合）/ 1h（小时聚合）"),
+    limit: int = Query(10000, ge=1, le=50000, description="每个传感器最多返回的数据点数"),
+    user_or_internal = Depends(verify_internal_or_user),
+    db: Session = Depends(get_db)
+):
+    """查询设备传感器历史数据 - 支持JWT和内部API密钥认证
+
+    时间为北京时间（不带时区时按北京时间处理）。auto 精度下 2 小时以内返回原始数据，
+    2 天以内返回分钟聚合，更长范围返回小时聚合。历史数据由 mqtt-service 分段写入，
+    最近几分钟的数据可能尚未写入，最新值请使用 /{device_uuid}/sensor-data。
+
+    返回格式：
+    {
+        "resolution": "raw",
+        "sensors": {
+            "temperature": [{"time": "...", "value": 25.5}],                          // raw
+            "humidity": [{"time": "...", "min": 58, "max": 61, "avg": 59.6, "count": 12}]  // 1m / 1h
+        }
+    }
+    """
+    from app.services.sensor_history import RAW_MAX_RANGE, RESOLUTIONS, query_sensor_history
+    from app.utils.timezone import utc_to_beijing
+
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"不支持的数据精度: {resolution}")
+
+    device = db.query(Device).filter(Device.uuid == device_uuid).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="设备不存在")
+
+    if user_or_internal != "internal":
+        if not can_access_device(device, user_or_internal, db):
+            raise HTTPException(status_code=403, detail="无权访问该设备")
+
+    # 带时区的时间转换为北京时间
+    if end is not None and end.tzinfo is not None:
+        end = utc_to_beijing(end)
+    if start is not None and start.tzinfo is not None:
+        start = utc_to_beijing(start)
+    end = end or get_beijing_now()
+    start = start or end - timedelta(hours=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="开始时间必须早于结束时间")
+    if resolution == "raw" and end - start > RAW_MAX_RANGE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"原始数据查询的时间范围不能超过 {RAW_MAX_RANGE.days} 天，请使用 1m / 1h 聚合数据"
+        )
+
+    sensor_names = [name.strip() for name in (sensors or "").split(",") if name.strip()] or None
+    history = query_sensor_history(
+        db, device_uuid, start, end,
+        sensor_names=sensor_names,
+        resolution=resolution,
+        max_points=limit
+    )
+    return success_response(data={"device_uuid": device_uuid, **history})
+
+
 @router.get("/{device_uuid}/realtime-data")
 async def get_device_realtime_data(
     device_uuid: str,
@@ -1928,6 +1974,19 @@ async def get_device_presets(
     return success_response(data={"presets": presets})
 
 
+@router.get("/mqtt-publisher/stats", summary="MQTT发布客户端统计")
+async def get_mqtt_publisher_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """获取控制指令MQTT发布客户端的连接状态和在途消息统计（仅管理员）"""
+    if not is_admin_user(current_user):
+        raise HTTPException(status_code=403, detail="仅管理员可查看")
+    
+    from app.core.mqtt_publisher import get_mqtt_publisher
+    
+    return success_response(data=get_mqtt_publisher().get_metrics())
+
+
 @router.post("/{device_uuid}/control")
 async def control_device(
     device_uuid: str,
@@ -2054,59 +2113,30 @@ async def control_device(
                     "parameters": target_preset.get("parameters", {})
                 }
                 
-                # 直接连接MQTT Broker发送预设指令
-                import paho.mqtt.client as mqtt
-                from app.core.config import settings
+                # 通过共享MQTT发布客户端发送预设指令
+                from app.core.mqtt_publisher import get_mqtt_publisher, MQTTPublishError
                 
                 control_topic = f"devices/{device_uuid}/control"
-                message = json.dumps(preset_command)
                 
                 try:
-                    # 创建临时MQTT客户端
-                    mqtt_client = mqtt.Client(
-                        client_id=f"preset_client_{device_uuid}_{int(__import__('time').time())}",
-                        protocol=mqtt.MQTTv311
-                    )
-                    
-                    # 设置认证
-                    if settings.mqtt_username and settings.mqtt_password:
-                        mqtt_client.username_pw_set(settings.mqtt_username, settings.mqtt_password)
-                    
-                    # 连接到MQTT Broker
-                    mqtt_client.connect(settings.mqtt_broker_host, settings.mqtt_broker_port, 60)
-                    
-                    # 发布消息
-                    result = mqtt_client.publish(control_topic, message, qos=1)
-                    
-                    # 等待消息发送完成
-                    mqtt_client.loop_start()
-                    result.wait_for_publish(timeout=5)
-                    mqtt_client.loop_stop()
-                    mqtt_client.disconnect()
-                    
-                    if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                        logger.info(f"✅ 预设指令发送成功 - 设备: {device_uuid}, 预设: {target_preset.get('name')}")
-                        return success_response(
-                            message="预设指令发送成功",
-                            data={
-                                "device_uuid": device_uuid,
-                                "preset_key": preset_key,
-                                "preset_name": target_preset.get("name"),
-                                "topic": control_topic
-                            }
-                        )
-                    else:
-                        raise HTTPException(
-                            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=f"MQTT消息发送失败，错误代码: {result.rc}"
-                        )
-                        
-                except Exception as mqtt_error:
-                    logger.error(f"❌ 预设指令MQTT发送失败: {mqtt_error}", exc_info=True)
+                    await get_mqtt_publisher().publish_async(control_topic, preset_command, qos=1)
+                except MQTTPublishError as mqtt_error:
+                    logger.error(f"❌ 预设指令MQTT发送失败: {mqtt_error}")
                     raise HTTPException(
                         status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                        detail=f"MQTT服务连接失败: {str(mqtt_error)}"
+                        detail=f"MQTT消息发送失败: {str(mqtt_error)}"
                     )
+                
+                logger.info(f"✅ 预设指令发送成功 - 设备: {device_uuid}, 预设: {target_preset.get('name')}")
+                return success_response(
+                    message="预设指令发送成功",
+                    data={
+                        "device_uuid": device_uuid,
+                        "preset_key": preset_key,
+                        "preset_name": target_preset.get("name"),
+                        "topic": control_topic
+                    }
+                )
         
         # 检查是否是序列指令
         elif control_data.get("type") == "sequence":
@@ -2153,68 +2183,31 @@ async def control_device(
                     detail=str(e)
                 )
         else:
-            # 单指令控制 - 直接连接MQTT Broker发送控制指令
-            import paho.mqtt.client as mqtt
-            import json
-            import time
-            from app.core.config import settings
+            # 单指令控制 - 通过共享MQTT发布客户端发送控制指令
+            from app.core.mqtt_publisher import get_mqtt_publisher, MQTTPublishError
             
             # 构建控制主题
             control_topic = f"devices/{device_uuid}/control"
             
             try:
-                # 创建临时MQTT客户端
-                client_kwargs = {
-                    "client_id": f"control_client_{device_uuid}_{int(time.time())}",
-                    "protocol": mqtt.MQTTv311,
-                    "transport": "tcp"
-                }
-                callback_api_version = getattr(mqtt, "CallbackAPIVersion", None)
-                if callback_api_version:
-                    client_kwargs["callback_api_version"] = callback_api_version.VERSION1
-
-                mqtt_client = mqtt.Client(**client_kwargs)
-                
-                # 设置认证
-                if settings.mqtt_username and settings.mqtt_password:
-                    mqtt_client.username_pw_set(settings.mqtt_username, settings.mqtt_password)
-                
-                # 连接到MQTT Broker
-                mqtt_client.connect(settings.mqtt_broker_host, settings.mqtt_broker_port, 60)
-                
-                # 发布消息
-                message = json.dumps(control_data)
-                result = mqtt_client.publish(control_topic, message, qos=1)
-                
-                # 等待消息发送完成
-                mqtt_client.loop_start()
-                result.wait_for_publish(timeout=5)
-                mqtt_client.loop_stop()
-                mqtt_client.disconnect()
-                
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    logger.info(f"✅ 控制命令发送成功 - 设备: {device_uuid}, 命令: {control_data}")
-                    return success_response(
-                        message="控制命令发送成功",
-                        data={
-                            "device_uuid": device_uuid,
-                            "command": control_data,
-                            "topic": control_topic
-                        }
-                    )
-                else:
-                    raise HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"MQTT消息发送失败，错误代码: {result.rc}"
-                    )
-                    
-            except Exception as mqtt_error:
-                logger.error(f"❌ MQTT连接或发送失败: {mqtt_error}", exc_info=True)
+                await get_mqtt_publisher().publish_async(control_topic, control_data, qos=1)
+            except MQTTPublishError as mqtt_error:
+                logger.error(f"❌ MQTT控制命令发送失败: {mqtt_error}")
                 raise HTTPException(
                     status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail=f"MQTT服务连接失败: {str(mqtt_error)}"
+                    detail=f"MQTT消息发送失败: {str(mqtt_error)}"
                 )
             
+            logger.info(f"✅ 控制命令发送成功 - 设备: {device_uuid}, 命令: {control_data}")
+            return success_response(
+                message="控制命令发送成功",
+                data={
+                    "device_uuid": device_uuid,
+                    "command": control_data,
+                    "topic": control_topic
+                }
+            )
+            
     except HTTPException:
         raise
     except Exception as e:
@@ -2354,6 +2347,7 @@ async def unbind_device(
         device.mac_address = None  # 清空MAC地址，防止设备通过MAC地址查询配置
         device.ip_address = None  # 清空IP地址
         device.updated_at = get_beijing_now()
+        heartbeat_write_behind.discard(device.uuid)
         device.is_online = False  # 重置在线状态
         
         # 清除设备最后上报数据（已优化：日志表已删除）
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import field_validator, model_validator, Field
-from typing import Optional
+from typing import Dict, Optional
 import secrets
 import logging
 
@@ -38,6 +38,11 @@ class Settings(BaseSettings):
         description="refresh token有效期（分钟）"
     )
     
+    # 认证用户缓存（按用户ID缓存 core_users 记录，用户修改后自动失效）
+    auth_principal_cache_size: int = 4096  # 进程内LRU缓存条目数（0表示禁用缓存）
+    auth_principal_cache_ttl: int = 30  # 缓存有效期（秒），也是其他worker感知用户变更的最长延迟
+    auth_principal_cache_redis_enabled: bool = False  # 启用Redis二级缓存（多worker共享）
+
     # 内部API密钥（用于内部服务调用，可选）
     internal_api_key: Optional[str] = None
     
@@ -46,7 +51,15 @@ class Settings(BaseSettings):
     mqtt_broker_port: int = 1883
     mqtt_username: str = ""  # 支持空值（Mosquitto默认无需认证）
     mqtt_password: str = ""  # 支持空值（Mosquitto默认无需认证）
-    
+
+    # MQTT发布客户端配置（设备控制指令复用长连接发送）
+    mqtt_publish_timeout: float = 5.0  # 等待Broker确认（PUBACK）的超时时间（秒）
+    mqtt_publisher_connect_timeout: float = 3.0  # 发布时等待连接恢复的最长时间（秒）
+    mqtt_publisher_keepalive: int = 60  # 心跳间隔（秒）
+    mqtt_publisher_max_inflight: int = 100  # 最多同时等待确认的QoS1消息数
+    mqtt_publisher_reconnect_min_delay: int = 1  # 断线重连最小间隔（秒）
+    mqtt_publisher_reconnect_max_delay: int = 30  # 断线重连最大间隔（秒）
+
     # 邮件服务配置（可选）
     mail_username: Optional[str] = None
     mail_password: Optional[str] = None
@@ -69,9 +82,66 @@ class Settings(BaseSettings):
     cache_recent_logs_ttl: int = 300  # 最近日志缓存时间（秒）
     cache_stats_ttl: int = 3600  # 统计数据缓存时间（秒）
     cache_device_status_ttl: int = 60  # 设备状态缓存时间（秒）
-    
+    cache_kb_metadata_ttl: int = 300  # 知识库元数据缓存时间（秒）
+    
+    # 设备数据实时推送（WebSocket/SSE，数据来自 mqtt-service 发布到 Redis 的批次增量）
+    sensor_push_redis_enabled: bool = True  # 订阅Redis推送频道
+    sensor_push_channel: str = "device:sensor_updates"  # 推送频道（需与mqtt-service一致）
+    sensor_push_interval: float = 1.0  # 默认推送间隔（秒），间隔内的更新合并为一帧
+    sensor_push_min_interval: float = 0.2  # 客户端可请求的最小推送间隔（秒）
+    sensor_push_max_interval: float = 60.0  # 客户端可请求的最大推送间隔（秒）
+    sensor_push_max_devices: int = 500  # 单个连接最多订阅的设备数
+    sensor_push_keepalive: float = 15.0  # 无数据时发送心跳的间隔（秒）
+
+    # 设备注册表缓存（设备上报接口按 uuid/device_id 查询的设备身份信息，设备修改后自动失效）
+    device_registry_cache_size: int = 10000  # 进程内LRU缓存条目数（0表示禁用缓存）
+    device_registry_cache_ttl: int = 300  # 缓存有效期（秒），也是其他worker感知设备变更的最长延迟
+    device_registry_negative_ttl: int = 60  # 不存在设备的缓存有效期（秒）
+
     # 设备离线超时配置
-    device_offline_timeout_minutes: int = 5  # 设备离线超时时间（分钟），超过此时间未收到数据则自动设置为离线
+    device_heartbeat_flush_interval: float = 5.0  # 心跳接口的在线时间合并写入间隔（秒），间隔内只写每台设备的最新心跳
+    device_offline_timeout_minutes: int = 5  # 设备离线超时时间（分钟），需与mqtt-service一致（由其在线检测线程批量设置离线）
+    
+    # 查询向量缓存配置
+    query_embedding_cache_size: int = 2048  # 进程内LRU缓存条目数（0表示禁用缓存）
+    query_embedding_cache_ttl: int = 3600  # 缓存有效期（秒）
+    query_embedding_cache_redis_enabled: bool = False  # 启用Redis二级缓存（多worker共享）
+    
+    # 知识库向量存储格式
+    embedding_storage_dtype: str = "float32"  # 文本块向量存储格式：float32（无损）/float16/int8（量化）
+    
+    # 文档向量化配置
+    embedding_max_concurrency: int = 4  # 同时进行的向量化请求批次数（收到429时自动减半）
+    embedding_max_retries: int = 3  # 单批次失败重试次数（不含429限流重试）
+    embedding_write_batch_size: int = 500  # 文本块批量写入数据库的每批行数
+    
+    # 知识库向量索引配置
+    vector_index_enabled: bool = True  # 启用IVF近似最近邻索引（关闭则始终精确检索）
+    vector_index_min_ann_size: int = 2000  # 知识库文本块数低于此值时直接精确检索
+    vector_index_nprobe: int = 16  # 近似检索时探查的聚类数（越大越准确、越慢）
+    hybrid_vector_weight: float = 0.7  # 混合检索中向量相似度的权重（其余为BM25关键词得分）
+
+    # 外部HTTP服务连接池配置（向量化等服务商接口）
+    http_client_http2: bool = True  # 启用HTTP/2（需要安装h2）
+    http_client_max_connections: int = 100  # 每个服务地址的最大连接数
+    http_client_max_keepalive_connections: int = 20  # 每个服务地址保持的空闲长连接数
+    http_client_keepalive_expiry: float = 30.0  # 空闲长连接保持时间（秒）
+    http_client_timeout: float = 60.0  # 默认请求超时（秒）
+    http_client_connect_timeout: float = 10.0  # 建立连接超时（秒）
+    
+    # 大模型调用配置
+    llm_request_timeout: float = 60.0  # 单次大模型请求超时（秒）
+    llm_max_concurrency: int = 32  # 每个提供商的最大并发请求数（每个worker进程）
+    llm_provider_concurrency: Dict[str, int] = {}  # 按提供商覆盖并发上限，如 {"qwen": 64, "deepseek": 8}
+    
+    # 插件调用配置（插件 OpenAPI 规范中的 x-timeout / x-max-concurrency 优先）
+    plugin_request_timeout: float = 30.0  # 单次插件接口调用超时（秒）
+    plugin_max_concurrency: int = 8  # 每个插件的最大并发调用数（每个worker进程）
+    
+    # 工作流执行配置（可在工作流 config 中按工作流覆盖）
+    workflow_max_parallelism: int = 4  # 同一工作流同时执行的最大节点数
+    workflow_node_timeout: float = 300.0  # 单个节点执行超时（秒）
+    workflow_plan_cache_size: int = 256  # 进程内缓存的工作流执行计划数（0表示禁用缓存）
     
     # 性能配置
     max_concurrent_writes: int = 10  # 最大并发写入数
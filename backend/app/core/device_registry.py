@@ -0,0 +1,237 @@
+"""
+设备注册表缓存
+设备上报类接口（心跳、数据上传、状态更新）每次请求都要按 uuid / device_id 查询 device_main，
+但只用到设备的身份信息。本模块缓存这部分投影（不含配置、上报数据等大字段）：
+- 进程内 LRU + TTL，按需加载；同时按 uuid 和 device_id 索引
+- 不存在的 uuid / device_id 也缓存（负缓存，TTL 更短），未注册设备的重复上报不再查询数据库
+- 设备记录通过 ORM 新增/更新/删除并提交后自动失效（注册、修改、解绑、删除等）；
+  其他 worker 的缓存最长在 TTL 后过期
+- 设备密钥只保存 SHA-256 摘要
+"""
+import hashlib
+import hmac
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from app.core.config import settings
+from app.models.device import Device
+
+logger = logging.getLogger(__name__)
+
+# 会话中待失效的缓存键（提交后处理）
+SESSION_INFO_KEY = "device_registry_invalidations"
+
+# 缓存投影包含的字段：只有这些字段变化时才需要失效（last_seen、is_online 等频繁更新的字段不影响缓存）
+PROJECTED_FIELDS = (
+    "uuid", "device_id", "name", "product_id", "user_id", "team_id", "is_active", "device_secret"
+)
+
+
+class DeviceEntry(NamedTuple):
+    """设备身份信息投影"""
+    id: int
+    uuid: str
+    device_id: str
+    name: str
+    product_id: Optional[int]
+    user_id: Optional[int]
+    team_id: Optional[int]
+    is_active: bool
+    secret_digest: str
+
+
+def _digest(secret: Optional[str]) -> str:
+    return hashlib.sha256((secret or "").encode("utf-8")).hexdigest()
+
+
+# 只查询投影列
+_PROJECTION = (
+    Device.id, Device.uuid, Device.device_id, Device.name, Device.product_id,
+    Device.user_id, Device.team_id, Device.is_active, Device.device_secret
+)
+
+
+class DeviceRegistry:
+    """设备注册表进程内缓存"""
+
+    def __init__(self, max_size: int, ttl: int, negative_ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # (索引字段, 值) -> (过期时间, 设备信息或None)
+        self._items: "OrderedDict[Tuple[str, str], Tuple[float, Optional[DeviceEntry]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # 缓存读写
+    # ------------------------------------------------------------------
+
+    def _get(self, key: Tuple[str, str]) -> Tuple[bool, Optional[DeviceEntry]]:
+        """Returns: (是否命中, 设备信息)"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return False, None
+            if item[0] <= time.monotonic():
+                del self._items[key]
+                return False, None
+            self._items.move_to_end(key)
+            return True, item[1]
+
+    def _set(self, key: Tuple[str, str], entry: Optional[DeviceEntry]):
+        expires_at = time.monotonic() + (self.ttl if entry is not None else self.negative_ttl)
+        with self._lock:
+            self._items[key] = (expires_at, entry)
+            self._items.move_to_end(key)
+            if entry is not None:
+                # 同一设备的另一个索引一并写入
+                for other in (("uuid", entry.uuid), ("device_id", entry.device_id)):
+                    if other != key:
+                        self._items[other] = (expires_at, entry)
+                        self._items.move_to_end(other)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def _lookup(self, db: Session, field: str, value: str) -> Optional[DeviceEntry]:
+        if self.max_size <= 0:
+            return self._load(db, field, value)
+
+        key = (field, value)
+        hit, entry = self._get(key)
+        if hit:
+            self.stats['hits' if entry is not None else 'negative_hits'] += 1
+            return entry
+
+        self.stats['misses'] += 1
+        entry = self._load(db, field, value)
+        self._set(key, entry)
+        return entry
+
+    @staticmethod
+    def _load(db: Session, field: str, value: str) -> Optional[DeviceEntry]:
+        column = Device.uuid if field == "uuid" else Device.device_id
+        row = db.query(*_PROJECTION).filter(column == value).first()
+        if row is None:
+            return None
+        return DeviceEntry(
+            id=row.id,
+            uuid=row.uuid,
+            device_id=row.device_id,
+            name=row.name,
+            product_id=row.product_id,
+            user_id=row.user_id,
+            team_id=row.team_id,
+            is_active=bool(row.is_active) if row.is_active is not None else True,
+            secret_digest=_digest(row.device_secret)
+        )
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+
+    def get_by_uuid(self, db: Session, device_uuid: str) -> Optional[DeviceEntry]:
+        """按设备UUID获取设备信息（设备不存在返回None）"""
+        return self._lookup(db, "uuid", device_uuid)
+
+    def get_by_device_id(self, db: Session, device_id: str) -> Optional[DeviceEntry]:
+        """按设备ID获取设备信息（设备不存在返回None）"""
+        return self._lookup(db, "device_id", device_id)
+
+    def authenticate(self, db: Session, device_id: str, device_secret: str) -> Optional[DeviceEntry]:
+        """校验设备ID和密钥，失败返回None"""
+        entry = self.get_by_device_id(db, device_id)
+        if entry is None or not hmac.compare_digest(entry.secret_digest, _digest(device_secret)):
+            return None
+        return entry
+
+    def invalidate(self, keys: Set[Tuple[str, str]]):
+        """移除缓存（同时移除同一设备的另一个索引）"""
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                item = self._items.pop(key, None)
+                if item is not None and item[1] is not None:
+                    self._items.pop(("uuid", item[1].uuid), None)
+                    self._items.pop(("device_id", item[1].device_id), None)
+        self.stats['invalidations'] += len(keys)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> dict:
+        """缓存命中统计"""
+        hits = self.stats['hits'] + self.stats['negative_hits']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'negative_ttl': self.negative_ttl,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+
+
+# 全局设备注册表缓存
+device_registry = DeviceRegistry(
+    max_size=settings.device_registry_cache_size,
+    ttl=settings.device_registry_cache_ttl,
+    negative_ttl=settings.device_registry_negative_ttl
+)
+
+
+# ----------------------------------------------------------------------
+# 失效：设备记录变更在事务提交后失效，回滚则丢弃
+# ----------------------------------------------------------------------
+
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    keys = session.info.setdefault(SESSION_INFO_KEY, set())
+    state = inspect(target)
+    for field in ("uuid", "device_id"):
+        # 包括修改前的值（uuid / device_id 被修改时旧键也要失效）
+        history = state.attrs[field].history
+        for value in (getattr(target, field), *history.deleted):
+            if value is not None:
+                keys.add((field, value))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    keys = session.info.pop(SESSION_INFO_KEY, None)
+    if keys:
+        device_registry.invalidate(keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(SESSION_INFO_KEY, None)
+
+
+def _mark_updated(mapper, connection, target):
+    # 只有投影字段变化的 UPDATE 才失效
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PROJECTED_FIELDS):
+        _mark_changed(mapper, connection, target)
+
+
+event.listen(Device, "after_insert", _mark_changed)
+event.listen(Device, "after_update", _mark_updated)
+event.listen(Device, "after_delete", _mark_changed)
@@ -0,0 +1,89 @@
+"""
+共享HTTP客户端连接池
+按服务地址（scheme://host:port）复用 httpx.AsyncClient，保持长连接，避免每次请求重新握手TLS：
+- 安装了 h2 时启用 HTTP/2，否则使用 HTTP/1.1 keep-alive
+- httpx 客户端绑定创建时的事件循环，Celery 任务等每次新建事件循环的场景会按循环分别创建，
+  循环关闭后对应的客户端自动丢弃
+- 应用关闭时由 lifespan 调用 close_http_clients() 释放连接
+"""
+import asyncio
+import logging
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  # httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# (事件循环ID, 服务地址) -> (事件循环, 客户端)
+_clients: Dict[Tuple[int, str], Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+_http2_warned = False
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _create_client() -> httpx.AsyncClient:
+    global _http2_warned
+    http2 = settings.http_client_http2 and HTTP2_AVAILABLE
+    if settings.http_client_http2 and not HTTP2_AVAILABLE and not _http2_warned:
+        _http2_warned = True
+        logger.warning("⚠️ 未安装 h2，HTTP客户端使用 HTTP/1.1 keep-alive（pip install httpx[http2] 启用HTTP/2）")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(settings.http_client_timeout, connect=settings.http_client_connect_timeout),
+        limits=httpx.Limits(
+            max_connections=settings.http_client_max_connections,
+            max_keepalive_connections=settings.http_client_max_keepalive_connections,
+            keepalive_expiry=settings.http_client_keepalive_expiry
+        )
+    )
+
+
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """
+    获取指定服务地址的共享客户端（必须在事件循环中调用）
+
+    Args:
+        url: 请求地址（只使用其 scheme://host:port 部分区分连接池）
+
+    Returns:
+        httpx.AsyncClient: 共享客户端，调用方不要关闭
+    """
+    loop = asyncio.get_running_loop()
+
+    # 清理已关闭事件循环的客户端（连接随循环一起失效）
+    for key in [key for key, (owner, _) in _clients.items() if owner.is_closed()]:
+        del _clients[key]
+
+    key = (id(loop), _origin(url))
+    entry = _clients.get(key)
+    if entry is None or entry[1].is_closed:
+        client = _create_client()
+        _clients[key] = (loop, client)
+        logger.info(f"🔧 创建HTTP连接池: {key[1]}")
+        return client
+    return entry[1]
+
+
+async def close_http_clients():
+    """关闭当前事件循环中的全部共享客户端（应用关闭时调用）"""
+    loop = asyncio.get_running_loop()
+    for key, (owner, client) in list(_clients.items()):
+        if owner is not loop:
+            continue
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"⚠️ 关闭HTTP连接池失败 {key[1]}: {e}")
+        del _clients[key]
@@ -0,0 +1,302 @@
+"""
+共享MQTT发布客户端
+设备控制、预设序列等场景复用同一个长连接发布消息，避免每条指令都重新建立 TCP+MQTT 连接：
+- 后台网络线程（loop_start）维持连接，断线后按退避间隔自动重连
+- publish() / publish_async() 等待 Broker 确认（QoS1 PUBACK）后返回，超时抛出 MQTTPublishError
+- Broker 未连接时等待片刻仍未恢复则直接失败，不把控制指令积压到重连之后再发送
+- 每个进程一个实例：FastAPI 由 lifespan 启停，Celery worker 在首次使用时创建
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import paho.mqtt.client as mqtt
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Payload = Union[str, bytes, dict, list]
+
+# 先于登记到达的确认的有效期（秒）：超过此时间仍未被认领的确认视为已放弃消息的迟到确认，
+# 避免 mid 回绕（65535）后新消息被误认为已确认
+EARLY_ACK_TTL = 5.0
+
+
+class MQTTPublishError(Exception):
+    """MQTT消息发布失败（未连接、发送失败或等待确认超时）"""
+
+
+class MQTTPublisher:
+    """长连接MQTT发布客户端（线程安全，可在同步代码和事件循环中共用）"""
+
+    def __init__(self, client_id_prefix: str = "backend_publisher"):
+        self.client_id = f"{client_id_prefix}_{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex[:6]}"
+        self.client: Optional[mqtt.Client] = None
+        self._connected = threading.Event()
+        self._lock = threading.Lock()
+        # mid -> (发送时间, 确认回调)
+        self._pending: Dict[int, Tuple[float, Callable[[], None]]] = {}
+        # 注册等待前就已收到确认的 mid -> 收到时间
+        self._early_acks: Dict[int, float] = {}
+        self.stats = {
+            'published': 0,
+            'acked': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'late_acks': 0,  # 超时放弃后才到达的确认
+            'connects': 0,
+            'disconnects': 0,
+            'ack_latency_total': 0.0,
+            'ack_latency_max': 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # 连接管理
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """创建客户端并在后台线程中连接（不阻塞，连接结果由 on_connect 回调更新）"""
+        if self.client is not None:
+            return
+
+        client_kwargs = {
+            "client_id": self.client_id,
+            "protocol": mqtt.MQTTv311,
+            "transport": "tcp"
+        }
+        callback_api_version = getattr(mqtt, "CallbackAPIVersion", None)
+        if callback_api_version:
+            client_kwargs["callback_api_version"] = callback_api_version.VERSION1
+
+        client = mqtt.Client(**client_kwargs)
+        if settings.mqtt_username and settings.mqtt_password:
+            client.username_pw_set(settings.mqtt_username, settings.mqtt_password)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.reconnect_delay_set(
+            min_delay=settings.mqtt_publisher_reconnect_min_delay,
+            max_delay=settings.mqtt_publisher_reconnect_max_delay
+        )
+        client.max_inflight_messages_set(settings.mqtt_publisher_max_inflight)
+
+        # connect_async + loop_start：Broker 暂时不可用时由网络线程持续重试
+        client.connect_async(settings.mqtt_broker_host, settings.mqtt_broker_port, settings.mqtt_publisher_keepalive)
+        client.loop_start()
+        self.client = client
+        logger.info(f"🔌 MQTT发布客户端启动: {settings.mqtt_broker_host}:{settings.mqtt_broker_port} ({self.client_id})")
+
+    def stop(self):
+        """断开连接并停止网络线程，未确认的消息按失败处理"""
+        client, self.client = self.client, None
+        if client is None:
+            return
+        try:
+            client.disconnect()
+            client.loop_stop()
+        except Exception as e:
+            logger.warning(f"⚠️ 关闭MQTT发布客户端失败: {e}")
+        self._connected.clear()
+        with self._lock:
+            abandoned = len(self._pending)
+            self._pending.clear()
+            self._early_acks.clear()
+            self.stats['failed'] += abandoned
+        logger.info(f"🛑 MQTT发布客户端已关闭（未确认消息 {abandoned} 条）")
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected.is_set()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.stats['connects'] += 1
+            self._connected.set()
+            logger.info("✅ MQTT发布客户端已连接")
+        else:
+            logger.error(f"❌ MQTT发布客户端连接失败，返回码: {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        self.stats['disconnects'] += 1
+        if rc != 0:
+            logger.warning(f"⚠️ MQTT发布客户端连接断开（rc={rc}），将自动重连")
+
+    def _on_publish(self, client, userdata, mid):
+        with self._lock:
+            entry = self._pending.pop(mid, None)
+            if entry is None:
+                now = time.monotonic()
+                self._prune_early_acks(now)
+                self._early_acks[mid] = now
+                return
+            self._record_ack(entry[0])
+        entry[1]()
+
+    def _prune_early_acks(self, now: float):
+        """丢弃过期的未认领确认（调用方持有锁）"""
+        expired = [mid for mid, received_at in self._early_acks.items() if now - received_at > EARLY_ACK_TTL]
+        for mid in expired:
+            del self._early_acks[mid]
+        self.stats['late_acks'] += len(expired)
+
+    def _record_ack(self, sent_at: float):
+        latency = time.monotonic() - sent_at
+        self.stats['acked'] += 1
+        self.stats['ack_latency_total'] += latency
+        self.stats['ack_latency_max'] = max(self.stats['ack_latency_max'], latency)
+
+    # ------------------------------------------------------------------
+    # 发布
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _encode(payload: Payload) -> Union[str, bytes]:
+        if isinstance(payload, (dict, list)):
+            return json.dumps(payload)
+        return payload
+
+    def _send(self, topic: str, payload: Payload, qos: int, on_ack: Callable[[], None]) -> int:
+        """发送消息并登记确认回调，返回 mid"""
+        client = self.client
+        if client is None:
+            raise MQTTPublishError("MQTT发布客户端未启动")
+
+        info = client.publish(topic, self._encode(payload), qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.stats['failed'] += 1
+            raise MQTTPublishError(f"MQTT消息发送失败，错误代码: {info.rc}")
+        self.stats['published'] += 1
+
+        sent_at = time.monotonic()
+        with self._lock:
+            received_at = self._early_acks.pop(info.mid, None)
+            if received_at is not None and sent_at - received_at <= EARLY_ACK_TTL:
+                self._record_ack(sent_at)
+                acked = True
+            else:
+                if received_at is not None:
+                    self.stats['late_acks'] += 1
+                self._pending[info.mid] = (sent_at, on_ack)
+                acked = False
+        if acked:
+            on_ack()
+        return info.mid
+
+    def _abandon(self, mid: int):
+        """等待确认超时：移除登记并计入失败"""
+        with self._lock:
+            if self._pending.pop(mid, None) is None:
+                return False
+            self.stats['timeouts'] += 1
+            self.stats['failed'] += 1
+        return True
+
+    def publish(self, topic: str, payload: Payload, qos: int = 1, timeout: Optional[float] = None) -> int:
+        """
+        同步发布消息并等待Broker确认（供 Celery 任务等同步代码使用）
+
+        Args:
+            topic: 主题
+            payload: 消息内容（dict/list 自动序列化为JSON）
+            qos: 服务质量等级
+            timeout: 等待确认的超时时间（秒），默认 settings.mqtt_publish_timeout
+
+        Returns:
+            int: 消息ID
+
+        Raises:
+            MQTTPublishError: 未连接、发送失败或确认超时
+        """
+        timeout = settings.mqtt_publish_timeout if timeout is None else timeout
+        if not self._connected.wait(settings.mqtt_publisher_connect_timeout):
+            self.stats['failed'] += 1
+            raise MQTTPublishError("MQTT Broker未连接")
+
+        acked = threading.Event()
+        mid = self._send(topic, payload, qos, acked.set)
+        if not acked.wait(timeout) and self._abandon(mid):
+            raise MQTTPublishError(f"等待MQTT确认超时（{timeout}秒）")
+        return mid
+
+    async def publish_async(self, topic: str, payload: Payload, qos: int = 1, timeout: Optional[float] = None) -> int:
+        """
+        异步发布消息并等待Broker确认（不阻塞事件循环）
+
+        参数与返回值同 publish()
+        """
+        timeout = settings.mqtt_publish_timeout if timeout is None else timeout
+        if not self._connected.is_set():
+            connected = await asyncio.to_thread(self._connected.wait, settings.mqtt_publisher_connect_timeout)
+            if not connected:
+                self.stats['failed'] += 1
+                raise MQTTPublishError("MQTT Broker未连接")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_ack():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        mid = self._send(topic, payload, qos, on_ack)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if self._abandon(mid):
+                raise MQTTPublishError(f"等待MQTT确认超时（{timeout}秒）")
+        except asyncio.CancelledError:
+            self._abandon(mid)
+            raise
+        return mid
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """发布统计（含当前等待确认的消息数）"""
+        with self._lock:
+            in_flight = len(self._pending)
+        acked = self.stats['acked']
+        return {
+            'connected': self.is_connected,
+            'client_id': self.client_id,
+            'in_flight': in_flight,
+            'published': self.stats['published'],
+            'acked': acked,
+            'failed': self.stats['failed'],
+            'timeouts': self.stats['timeouts'],
+            'late_acks': self.stats['late_acks'],
+            'connects': self.stats['connects'],
+            'disconnects': self.stats['disconnects'],
+            'ack_latency_avg_ms': round(self.stats['ack_latency_total'] / acked * 1000, 2) if acked else None,
+            'ack_latency_max_ms': round(self.stats['ack_latency_max'] * 1000, 2),
+        }
+
+
+_publisher: Optional[MQTTPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def get_mqtt_publisher() -> MQTTPublisher:
+    """获取当前进程的共享发布客户端（首次调用时创建并启动）"""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                publisher = MQTTPublisher()
+                publisher.start()
+                _publisher = publisher
+    return _publisher
+
+
+def stop_mqtt_publisher():
+    """关闭共享发布客户端（应用关闭时调用）"""
+    global _publisher
+    with _publisher_lock:
+        publisher, _publisher = _publisher, None
+    if publisher is not None:
+        publisher.stop()
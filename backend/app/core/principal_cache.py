@@ -0,0 +1,281 @@
+"""
+认证用户缓存
+每个已认证请求都要按 token 中的用户ID查询 core_users，轮询类页面下这是最频繁的查询。
+用户记录的列值按用户ID缓存，命中时直接挂到当前数据库会话，不再查询数据库：
+- 一级：进程内 LRU + TTL
+- 二级（可选）：Redis，多个 worker 共享
+- 用户记录通过 ORM 更新/删除并提交后自动失效（资料修改、禁用、角色变更等）；
+  其他 worker 的进程内缓存最长在 TTL 后过期
+- 密码哈希不进入缓存，访问时按需从数据库加载
+"""
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect, DateTime, Date
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+
+from app.core.config import settings
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Redis 失败后暂停使用的时间（秒），避免每个请求都等待超时
+REDIS_RETRY_INTERVAL = 30
+REDIS_KEY_PREFIX = "auth_principal:"
+
+# 不缓存的列
+EXCLUDED_COLUMNS = {"password_hash"}
+
+# 会话中待失效的用户ID（提交后处理）
+SESSION_INFO_KEY = "principal_cache_invalidations"
+
+
+def _cached_columns() -> Dict[str, Any]:
+    """需要缓存的列：属性名 -> 列对象"""
+    return {
+        attr.key: attr.columns[0]
+        for attr in inspect(User).column_attrs
+        if attr.key not in EXCLUDED_COLUMNS
+    }
+
+
+class PrincipalCache:
+    """认证用户两级缓存"""
+
+    def __init__(self, max_size: int, ttl: int, redis_enabled: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_enabled = redis_enabled
+        self.columns = _cached_columns()
+        self._items: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_disabled_until = 0.0
+        # Redis 客户端所在的事件循环（同步路由在线程池中提交时用于投递失效操作）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {
+            'memory_hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'redis_errors': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # 序列化
+    # ------------------------------------------------------------------
+
+    def snapshot(self, user: User) -> Dict[str, Any]:
+        """提取用户记录的列值"""
+        return {key: getattr(user, key) for key in self.columns}
+
+    def attach(self, db: Session, values: Dict[str, Any]) -> User:
+        """用缓存的列值构造用户对象并挂到会话（不查询数据库）"""
+        user = User()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+
+    def _encode(self, values: Dict[str, Any]) -> str:
+        return json.dumps({
+            key: value.isoformat() if isinstance(value, (date, datetime)) else value
+            for key, value in values.items()
+        })
+
+    def _decode(self, data: bytes) -> Dict[str, Any]:
+        raw = json.loads(data)
+        values = {}
+        for key, column in self.columns.items():
+            value = raw.get(key)
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif value is not None and isinstance(column.type, Date):
+                value = date.fromisoformat(value)
+            values[key] = value
+        return values
+
+    # ------------------------------------------------------------------
+    # 一级缓存
+    # ------------------------------------------------------------------
+
+    def _memory_get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return item[1]
+
+    def _memory_set(self, user_id: int, values: Dict[str, Any]):
+        with self._lock:
+            self._items[user_id] = (time.monotonic() + self.ttl, values)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # 二级缓存
+    # ------------------------------------------------------------------
+
+    def _redis_available(self) -> bool:
+        return self.redis_enabled and time.monotonic() >= self._redis_disabled_until
+
+    def _redis_failed(self, e: Exception):
+        self.stats['redis_errors'] += 1
+        self._redis_disabled_until = time.monotonic() + REDIS_RETRY_INTERVAL
+        logger.warning(f"⚠️ 认证用户Redis缓存不可用，{REDIS_RETRY_INTERVAL}秒内仅使用进程内缓存: {e}")
+
+    async def _redis_get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        if not self._redis_available():
+            return None
+        try:
+            from app.core.redis_client import get_async_redis
+
+            data = await get_async_redis().get(f"{REDIS_KEY_PREFIX}{user_id}")
+            return self._decode(data) if data else None
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+    async def _redis_set(self, user_id: int, values: Dict[str, Any]):
+        if not self._redis_available():
+            return
+        try:
+            from app.core.redis_client import get_async_redis
+
+            await get_async_redis().setex(f"{REDIS_KEY_PREFIX}{user_id}", self.ttl, self._encode(values))
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def _redis_delete(self, user_ids: Set[int]):
+        try:
+            from app.core.redis_client import get_async_redis
+
+            await get_async_redis().delete(*(f"{REDIS_KEY_PREFIX}{user_id}" for user_id in user_ids))
+        except Exception as e:
+            self._redis_failed(e)
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+
+    async def get_user(self, db: Session, user_id: int) -> Optional[User]:
+        """
+        按用户ID获取用户（命中缓存时不查询数据库）
+
+        Args:
+            db: 当前请求的数据库会话（返回的对象挂在该会话上，可正常修改和加载关联）
+            user_id: 用户ID
+
+        Returns:
+            Optional[User]: 用户对象，不存在时返回None（不存在的结果不缓存）
+        """
+        if self.max_size <= 0:
+            return db.query(User).filter(User.id == user_id).first()
+
+        if self.redis_enabled and self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+        values = self._memory_get(user_id)
+        if values is not None:
+            self.stats['memory_hits'] += 1
+            return self.attach(db, values)
+
+        values = await self._redis_get(user_id)
+        if values is not None:
+            self.stats['redis_hits'] += 1
+            self._memory_set(user_id, values)
+            return self.attach(db, values)
+
+        self.stats['misses'] += 1
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is not None:
+            values = self.snapshot(user)
+            self._memory_set(user_id, values)
+            await self._redis_set(user_id, values)
+        return user
+
+    def invalidate(self, *user_ids: int):
+        """移除用户缓存（可在同步代码或事件循环中调用）"""
+        ids = {user_id for user_id in user_ids if user_id is not None}
+        if not ids:
+            return
+        with self._lock:
+            for user_id in ids:
+                self._items.pop(user_id, None)
+        self.stats['invalidations'] += len(ids)
+
+        if not self.redis_enabled or self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._loop.create_task(self._redis_delete(ids))
+        else:
+            # 同步路由在线程池中执行，投递到 Redis 客户端所在的事件循环
+            asyncio.run_coroutine_threadsafe(self._redis_delete(ids), self._loop)
+
+    def clear(self):
+        """清空进程内缓存"""
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> dict:
+        """缓存命中统计"""
+        hits = self.stats['memory_hits'] + self.stats['redis_hits']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'redis_enabled': self.redis_enabled,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+
+
+# 全局认证用户缓存
+principal_cache = PrincipalCache(
+    max_size=settings.auth_principal_cache_size,
+    ttl=settings.auth_principal_cache_ttl,
+    redis_enabled=settings.auth_principal_cache_redis_enabled
+)
+
+
+# ----------------------------------------------------------------------
+# 失效：用户记录变更在事务提交后失效，回滚则丢弃
+# ----------------------------------------------------------------------
+
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.id is not None:
+        session.info.setdefault(SESSION_INFO_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    user_ids = session.info.pop(SESSION_INFO_KEY, None)
+    if user_ids:
+        principal_cache.invalidate(*user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(SESSION_INFO_KEY, None)
+
+
+event.listen(User, "after_update", _mark_changed)
+event.listen(User, "after_delete", _mark_changed)
@@ -0,0 +1,36 @@
+"""
+Redis客户端
+按需创建的全局异步连接，Redis不可用时由调用方降级处理
+"""
+import logging
+from typing import Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_async_redis = None
+
+
+def get_async_redis():
+    """获取全局异步Redis客户端（首次调用时创建，短超时避免拖慢请求）"""
+    global _async_redis
+    if _async_redis is None:
+        import redis.asyncio as aioredis
+        _async_redis = aioredis.from_url(
+            settings.redis_url,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+    return _async_redis
+
+
+async def close_async_redis():
+    """关闭全局异步Redis客户端（应用关闭时调用）"""
+    global _async_redis
+    if _async_redis is not None:
+        try:
+            await _async_redis.close()
+        except Exception as e:
+            logger.warning(f"⚠️ 关闭Redis连接失败: {e}")
+        _async_redis = None
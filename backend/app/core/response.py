@@ -2,11 +2,19 @@
 统一响应格式
 提供标准的 API 响应格式，包含 code、message、data 字段
 """
+import json
+from datetime import date, datetime
 from typing import Any, Optional, Generic, TypeVar
 from pydantic import BaseModel, Field
 from fastapi.responses import JSONResponse
 from fastapi import status as http_status
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 T = TypeVar('T')
 
 class StandardResponse(BaseModel, Generic[T]):
@@ -108,3 +116,51 @@ def error_response_dict(
     
     return response_data
 
+
+
+def _json_default(obj: Any) -> Any:
+    """未安装 orjson 时的序列化兜底（datetime 规则与 orjson 配置一致）"""
+    if isinstance(obj, datetime):
+        # 无时区的时间按UTC处理，添加Z后缀
+        return obj.isoformat() + 'Z' if obj.tzinfo is None else obj.isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(content: Any) -> bytes:
+    """序列化为紧凑的UTF-8 JSON（优先使用 orjson，原生处理 datetime）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+        default=_json_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON响应（使用 dumps_json 序列化，不包装响应格式）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+class EnvelopeJSONResponse(FastJSONResponse):
+    """
+    默认响应类：成功响应在序列化时直接包装为标准格式 {code, message, data}
+    
+    已经是标准格式（包含 code 字段）的内容和非2xx响应原样输出；
+    路由直接返回的 StreamingResponse、FileResponse 等不经过此类，保持不变。
+    """
+
+    def render(self, content: Any) -> bytes:
+        if 200 <= self.status_code < 300 and self.status_code != 204:
+            if not (isinstance(content, dict) and "code" in content):
+                content = success_response(data=content)
+        return super().render(content)
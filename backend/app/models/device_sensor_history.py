@@ -0,0 +1,56 @@
+"""
+设备传感器历史数据模型
+数据由 mqtt-service 写入，后端只读：
+- device_sensor_segments：原始数据分段（时间戳列/数值列压缩编码，见 app.utils.timeseries_codec）
+- device_sensor_rollups_1m / device_sensor_rollups_1h：分钟/小时预聚合
+三张表均按 day 字段分区，过期数据按分区整体删除
+"""
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, Date, Float, LargeBinary, Index
+from sqlalchemy.dialects.mysql import DATETIME, DOUBLE
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class DeviceSensorSegment(Base):
+    """传感器历史原始数据分段表"""
+    __tablename__ = "device_sensor_segments"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True, comment="主键ID")
+    day = Column(Date, primary_key=True, comment="数据日期（分区键）")
+    device_uuid = Column(String(36), nullable=False, comment="设备UUID")
+    sensor_name = Column(String(50), nullable=False, comment="传感器名称")
+    start_time = Column(DateTime().with_variant(DATETIME(fsp=3), "mysql"), nullable=False, comment="段内最早数据时间")
+    end_time = Column(DateTime().with_variant(DATETIME(fsp=3), "mysql"), nullable=False, comment="段内最晚数据时间")
+    point_count = Column(Integer, nullable=False, comment="数据点数")
+    ts_blob = Column(LargeBinary, nullable=False, comment="时间戳列（delta-of-delta 编码）")
+    value_blob = Column(LargeBinary, nullable=False, comment="数值列（异或压缩编码）")
+    created_at = Column(DateTime, server_default=func.now(), comment="记录创建时间")
+
+    __table_args__ = (
+        Index('idx_series_time', 'device_uuid', 'sensor_name', 'start_time'),
+        {'comment': '传感器历史原始数据分段表'}
+    )
+
+
+class _SensorRollupColumns:
+    """分钟/小时聚合表的公共字段"""
+    day = Column(Date, primary_key=True, comment="数据日期（分区键）")
+    device_uuid = Column(String(36), primary_key=True, comment="设备UUID")
+    sensor_name = Column(String(50), primary_key=True, comment="传感器名称")
+    bucket_start = Column(DateTime, primary_key=True, comment="时间桶起始时间")
+    min_value = Column(Float().with_variant(DOUBLE(), "mysql"), nullable=False, comment="最小值")
+    max_value = Column(Float().with_variant(DOUBLE(), "mysql"), nullable=False, comment="最大值")
+    sum_value = Column(Float().with_variant(DOUBLE(), "mysql"), nullable=False, comment="总和")
+    point_count = Column(Integer, nullable=False, comment="数据点数")
+
+
+class DeviceSensorRollup1m(_SensorRollupColumns, Base):
+    """传感器历史分钟聚合表"""
+    __tablename__ = "device_sensor_rollups_1m"
+    __table_args__ = {'comment': '传感器历史分钟聚合表'}
+
+
+class DeviceSensorRollup1h(_SensorRollupColumns, Base):
+    """传感器历史小时聚合表"""
+    __tablename__ = "device_sensor_rollups_1h"
+    __table_args__ = {'comment': '传感器历史小时聚合表'}
@@ -2,8 +2,9 @@
 文档模型
 包含：文档、文本块
 """
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, BigInteger, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, BigInteger, Enum, LargeBinary, Float, or_
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 from app.core.database import Base
 from app.utils.timezone import get_beijing_time_naive
 import uuid as uuid_lib
@@ -97,8 +98,14 @@ class DocumentChunk(Base):
     chunk_index = Column(Integer, nullable=False, comment="在文档中的顺序")
     char_count = Column(Integer, comment="字符数")
     token_count = Column(Integer, comment="Token数")
+    content_hash = Column(String(64), index=True, comment="内容哈希（规范化内容+向量模型），用于复用已有向量")
     
-    # 向量（存储在MySQL的JSON字段）
+    # 向量（二进制紧凑存储，编解码见 app.utils.embedding_codec）
+    embedding_blob = Column(LargeBinary, comment="向量二进制数据")
+    embedding_dtype = Column(String(10), comment="向量存储格式：float32/float16/int8")
+    embedding_scale = Column(Float, comment="int8量化比例")
+    
+    # 向量（旧版JSON存储，仅用于兼容未迁移的数据）
     embedding_vector = Column(JSON, comment="向量表示（JSON数组）")
     
     # 上下文信息
@@ -118,6 +125,15 @@ class DocumentChunk(Base):
     previous_chunk = relationship("DocumentChunk", remote_side=[id], foreign_keys=[previous_chunk_id])
     next_chunk = relationship("DocumentChunk", remote_side=[id], foreign_keys=[next_chunk_id])
     
+    @hybrid_property
+    def has_embedding(self):
+        """是否已向量化（兼容二进制和JSON两种存储）"""
+        return self.embedding_blob is not None or self.embedding_vector is not None
+    
+    @has_embedding.expression
+    def has_embedding(cls):
+        return or_(cls.embedding_blob.isnot(None), cls.embedding_vector.isnot(None))
+    
     def __repr__(self):
         return f"<DocumentChunk(id={self.id}, doc_id={self.document_id}, index={self.chunk_index})>"
 
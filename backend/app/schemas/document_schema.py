@@ -167,6 +167,7 @@ class KnowledgeSearchRequest(BaseModel):
     top_k: int = Field(5, ge=1, le=20, description="返回数量")
     similarity_threshold: float = Field(0.70, ge=0.0, le=1.0, description="相似度阈值")
     retrieval_mode: str = Field("hybrid", description="检索模式：vector/keyword/hybrid")
+    exact_search: bool = Field(False, description="是否跳过近似索引，使用精确向量检索")
     include_inherited: bool = Field(True, description="是否包含继承的知识库")
     filters: Optional[Dict[str, Any]] = Field(None, description="过滤条件")
     
@@ -116,10 +116,14 @@ class NodeExecutionResult(BaseModel):
     """节点执行结果Schema"""
     node_id: str = Field(..., description="节点ID")
     node_type: str = Field(..., description="节点类型")
-    status: str = Field(..., description="执行状态（success/failed/skipped）")
+    status: str = Field(..., description="执行状态（success/failed/skipped/cancelled）")
     output: Optional[Dict[str, Any]] = Field(None, description="节点输出")
     error_message: Optional[str] = Field(None, description="错误信息")
     execution_time: Optional[int] = Field(None, description="执行时间（毫秒）")
+    queue_wait_time: Optional[int] = Field(None, description="就绪后等待执行的时间（毫秒，受并行度限制）")
+    bytes_in: Optional[int] = Field(None, description="输入字节数（前驱节点输出，开始节点为工作流输入）")
+    bytes_out: Optional[int] = Field(None, description="输出字节数")
+    retries: Optional[int] = Field(None, description="重试次数")
     started_at: Optional[datetime] = Field(None, description="开始时间")
     completed_at: Optional[datetime] = Field(None, description="完成时间")
 
@@ -0,0 +1,139 @@
+"""
+设备心跳延迟合并写入
+心跳接口只记录每台设备的最新心跳时间，由后台任务定期批量写入 device_main：
+- 间隔内同一设备的多次心跳只写最新一次
+- 每次写入按主键分块，每块一条 UPDATE ... CASE，单个事务；数据库中 last_seen 已更新的设备
+  （期间通过其他接口上报了状态，包括离线）不再覆盖
+- 其他修改 is_online 的接口在写入前调用 discard，丢弃该设备尚未写入的心跳
+- 缓冲区在每个进程（uvicorn worker）内独立，get_last_seen 只能看到本进程收到的心跳；
+  在线状态以数据库为准，写入间隔需远小于离线超时时间
+- 应用关闭时写入剩余的心跳；进程异常退出最多丢失一个写入间隔的心跳时间
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, or_, update
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.device import Device
+
+logger = logging.getLogger(__name__)
+
+# 单条 UPDATE 最多包含的设备数
+SQL_CHUNK_SIZE = 500
+
+
+class HeartbeatWriteBehind:
+    """设备心跳延迟写入（每个进程一个实例，在事件循环中使用）"""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        # 设备UUID -> (设备主键, 最新心跳时间)
+        self._pending: Dict[str, Tuple[int, datetime]] = {}
+        # 正在写入的心跳（写入完成前读取仍以此为准）
+        self._inflight: Dict[str, Tuple[int, datetime]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'heartbeats': 0,
+            'rows_written': 0,
+            'stale_dropped': 0,  # 数据库中已有更新记录而丢弃的心跳
+            'flushes': 0,
+            'errors': 0,
+        }
+
+    def record(self, device_id: int, device_uuid: str, seen_at: datetime):
+        """记录心跳（不访问数据库）"""
+        self._pending[device_uuid] = (device_id, seen_at)
+        self.stats['heartbeats'] += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def discard(self, device_uuid: str):
+        """丢弃设备尚未写入的心跳（其他接口修改 is_online 前调用）"""
+        self._pending.pop(device_uuid, None)
+
+    def get_last_seen(self, device_uuid: str) -> Optional[datetime]:
+        """本进程尚未写入数据库的最新心跳时间"""
+        item = self._pending.get(device_uuid) or self._inflight.get(device_uuid)
+        return item[1] if item else None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self._pending:
+                # 没有新的心跳时退出，下次记录心跳时重新启动
+                return
+
+    async def flush(self):
+        """写入待写入的心跳"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._inflight = pending
+        try:
+            written = await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            self.stats['errors'] += 1
+            # 放回待写入（期间收到的新心跳优先），下次重试
+            for device_uuid, item in pending.items():
+                self._pending.setdefault(device_uuid, item)
+            logger.error(f"❌ 设备心跳写入失败，{len(pending)} 台设备稍后重试: {e}")
+            return
+        finally:
+            self._inflight = {}
+        self.stats['rows_written'] += written
+        self.stats['stale_dropped'] += len(pending) - written
+        self.stats['flushes'] += 1
+
+    @staticmethod
+    def _write(pending: Dict[str, Tuple[int, datetime]]) -> int:
+        """Returns: 实际更新的设备数"""
+        items = list(pending.values())
+        written = 0
+        db = SessionLocal()
+        try:
+            for i in range(0, len(items), SQL_CHUNK_SIZE):
+                chunk = dict(items[i:i + SQL_CHUNK_SIZE])
+                seen_at = case(chunk, value=Device.id)
+                result = db.execute(
+                    update(Device)
+                    .where(
+                        Device.id.in_(list(chunk)),
+                        # 只写入比数据库更新的心跳，不覆盖期间写入的状态（如离线上报）
+                        or_(Device.last_seen.is_(None), Device.last_seen < seen_at)
+                    )
+                    .values(is_online=True, last_seen=seen_at)
+                )
+                written += result.rowcount
+            db.commit()
+            return written
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def stop(self):
+        """停止后台任务并写入剩余心跳（应用关闭时调用）"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        heartbeats = self.stats['heartbeats']
+        return {
+            **self.stats,
+            'pending': len(self._pending),
+            'flush_interval': self.flush_interval,
+            'coalesce_ratio': round(1 - self.stats['rows_written'] / heartbeats, 4) if heartbeats else None,
+        }
+
+
+# 全局设备心跳延迟写入
+heartbeat_write_behind = HeartbeatWriteBehind(flush_interval=settings.device_heartbeat_flush_interval)
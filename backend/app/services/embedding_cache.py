@@ -0,0 +1,207 @@
+"""
+查询向量缓存
+课堂场景下大量设备会反复提出相同的问题，检索前的查询向量化结果按 (模型, 规范化文本) 缓存：
+- 一级：进程内 LRU + TTL
+- 二级（可选）：Redis，多个 worker 共享
+- 同一查询并发未命中时只调用一次向量化接口（在独立任务中执行，单个调用方被取消不影响其他等待者）
+"""
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis 失败后暂停使用的时间（秒），避免每个请求都等待超时
+REDIS_RETRY_INTERVAL = 30
+REDIS_KEY_PREFIX = "query_embedding:"
+
+
+class QueryEmbeddingCache:
+    """查询向量两级缓存"""
+
+    def __init__(self, max_size: int, ttl: int, redis_enabled: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_enabled = redis_enabled
+        self._items: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._redis_disabled_until = 0.0
+        self.stats = {
+            'memory_hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'redis_errors': 0,
+        }
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """规范化查询文本：全角转半角、合并空白"""
+        return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+    @staticmethod
+    def make_key(model: Optional[str], text: str) -> str:
+        return hashlib.sha256(f"{model or ''}\n{text}".encode('utf-8')).hexdigest()
+
+    # ------------------------------------------------------------------
+    # 一级缓存
+    # ------------------------------------------------------------------
+
+    def _memory_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def _memory_set(self, key: str, embedding: List[float]):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, embedding)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # 二级缓存
+    # ------------------------------------------------------------------
+
+    def _redis_available(self) -> bool:
+        return self.redis_enabled and time.monotonic() >= self._redis_disabled_until
+
+    def _redis_failed(self, e: Exception):
+        self.stats['redis_errors'] += 1
+        self._redis_disabled_until = time.monotonic() + REDIS_RETRY_INTERVAL
+        logger.warning(f"⚠️ 查询向量Redis缓存不可用，{REDIS_RETRY_INTERVAL}秒内仅使用进程内缓存: {e}")
+
+    async def _redis_get(self, key: str) -> Optional[List[float]]:
+        if not self._redis_available():
+            return None
+        try:
+            from app.core.redis_client import get_async_redis
+            from app.utils.embedding_codec import decode_embedding
+
+            data = await get_async_redis().get(REDIS_KEY_PREFIX + key)
+            return decode_embedding(data).tolist() if data else None
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+    async def _redis_set(self, key: str, embedding: List[float]):
+        if not self._redis_available():
+            return
+        try:
+            from app.core.redis_client import get_async_redis
+            from app.utils.embedding_codec import encode_embedding
+
+            blob, _ = encode_embedding(embedding, 'float32')
+            await get_async_redis().setex(REDIS_KEY_PREFIX + key, self.ttl, blob)
+        except Exception as e:
+            self._redis_failed(e)
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+
+    async def get_or_embed(
+        self,
+        model: Optional[str],
+        text: str,
+        embed: Callable[[str], Awaitable[Optional[List[float]]]]
+    ) -> Optional[List[float]]:
+        """
+        获取查询向量，未命中时调用 embed 计算并写入缓存
+
+        Args:
+            model: 向量模型名称（不同模型的向量不能混用）
+            text: 查询文本
+            embed: 实际的向量化函数
+
+        Returns:
+            Optional[List[float]]: 查询向量（向量化失败返回None，失败结果不缓存）
+        """
+        if self.max_size <= 0:
+            return await embed(text)
+
+        normalized = self.normalize(text)
+        key = self.make_key(model, normalized)
+
+        embedding = self._memory_get(key)
+        if embedding is not None:
+            self.stats['memory_hits'] += 1
+            return embedding
+
+        # 同一查询正在向量化时等待其结果，否则创建独立任务执行
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._load(key, normalized, embed))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # 调用方被取消（节点超时、客户端断开）时任务继续执行，其他等待者正常获得结果
+        return await asyncio.shield(task)
+
+    async def _load(
+        self,
+        key: str,
+        normalized: str,
+        embed: Callable[[str], Awaitable[Optional[List[float]]]]
+    ) -> Optional[List[float]]:
+        """Redis -> 向量化接口，结果写入缓存"""
+        embedding = await self._redis_get(key)
+        if embedding is not None:
+            self.stats['redis_hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            embedding = await embed(normalized)
+            if embedding:
+                await self._redis_set(key, embedding)
+
+        if embedding:
+            self._memory_set(key, embedding)
+        return embedding
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 避免无人等待时出现 "exception was never retrieved" 警告
+            task.exception()
+
+    def clear(self):
+        """清空进程内缓存"""
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> dict:
+        """缓存命中统计"""
+        hits = self.stats['memory_hits'] + self.stats['redis_hits'] + self.stats['coalesced']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'redis_enabled': self.redis_enabled,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+
+
+# 全局查询向量缓存
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=settings.query_embedding_cache_size,
+    ttl=settings.query_embedding_cache_ttl,
+    redis_enabled=settings.query_embedding_cache_redis_enabled
+)
@@ -2,18 +2,43 @@
 Embedding服务
 支持通义千问等Embedding模型
 """
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Tuple
 import httpx
 import asyncio
 import logging
 from sqlalchemy.orm import Session
 
+from app.core.http_client import get_http_client
+
 logger = logging.getLogger(__name__)
 
 
+class EmbeddingRateLimitError(Exception):
+    """向量化服务商返回429限流"""
+    
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__(f"向量化接口限流（Retry-After: {retry_after}）")
+        self.retry_after = retry_after
+
+
+def check_rate_limit(response: httpx.Response):
+    """服务商返回429时抛出 EmbeddingRateLimitError（携带 Retry-After 秒数）"""
+    if response.status_code != 429:
+        return
+    retry_after = None
+    try:
+        retry_after = float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        pass
+    raise EmbeddingRateLimitError(retry_after)
+
+
 class EmbeddingService:
     """Embedding服务基类"""
     
+    # 单次请求最多的文本数（文档向量化时按此大小分批）
+    max_batch_size = 10
+    
     def __init__(self):
         self.model_name = None
         self.dimension = 1536  # 默认维度
@@ -39,9 +64,27 @@ class EmbeddingService:
         
         Returns:
             List[Optional[List[float]]]: 向量列表
+        
+        Raises:
+            EmbeddingRateLimitError: 服务商限流，由调用方降低并发后重试
         """
         raise NotImplementedError
     
+    async def embed_query(self, text: str) -> Optional[List[float]]:
+        """
+        对检索查询进行向量化（带缓存）
+        
+        相同模型下规范化后相同的查询直接复用缓存结果，文档入库请使用 embed_texts
+        
+        Args:
+            text: 查询文本
+        
+        Returns:
+            List[float]: 向量（如果失败返回None）
+        """
+        from app.services.embedding_cache import query_embedding_cache
+        return await query_embedding_cache.get_or_embed(self.model_name, text, self.embed_text)
+    
     def calculate_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """
         计算两个向量的余弦相似度
@@ -79,6 +122,8 @@ class QwenEmbeddingService(EmbeddingService):
     使用 text-embedding-v4 模型（最新版本，性能更好）
     """
     
+    max_batch_size = 10  # text-embedding-v4 单次请求最多10条
+    
     def __init__(self, api_key: str, base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/embeddings", model: str = "text-embedding-v4"):
         super().__init__()
         self.api_key = api_key
@@ -96,36 +141,37 @@ class QwenEmbeddingService(EmbeddingService):
             return None
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.base_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model_name,
-                        "input": text  # v4 使用 OpenAI 兼容格式，直接传文本
-                    }
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                # v4 使用 OpenAI 兼容格式的响应
-                # {"data": [{"embedding": [...], "index": 0}], "model": "...", "usage": {...}}
-                if result.get("data") and len(result["data"]) > 0:
-                    return result["data"][0].get("embedding")
-                
-                # 兼容旧格式（以防万一）
-                if result.get("output") and result["output"].get("embeddings"):
-                    embeddings = result["output"]["embeddings"]
-                    if embeddings and len(embeddings) > 0:
-                        return embeddings[0].get("embedding")
-                
-                logger.error(f"通义千问Embedding响应格式错误: {result}")
-                return None
-        
+            client = get_http_client(self.base_url)
+            response = await client.post(
+                self.base_url,
+                timeout=30.0,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": self.model_name,
+                    "input": text  # v4 使用 OpenAI 兼容格式，直接传文本
+                }
+            )
+            
+            response.raise_for_status()
+            result = response.json()
+            
+            # v4 使用 OpenAI 兼容格式的响应
+            # {"data": [{"embedding": [...], "index": 0}], "model": "...", "usage": {...}}
+            if result.get("data") and len(result["data"]) > 0:
+                return result["data"][0].get("embedding")
+            
+            # 兼容旧格式（以防万一）
+            if result.get("output") and result["output"].get("embeddings"):
+                embeddings = result["output"]["embeddings"]
+                if embeddings and len(embeddings) > 0:
+                    return embeddings[0].get("embedding")
+            
+            logger.error(f"通义千问Embedding响应格式错误: {result}")
+            return None
+
         except httpx.HTTPStatusError as e:
             logger.error(f"通义千问Embedding HTTP错误: {e.response.status_code} - {e.response.text}")
             return None
@@ -137,56 +183,56 @@ class QwenEmbeddingService(EmbeddingService):
         """
         批量向量化文本
         使用 text-embedding-v4 的 compatible-mode API
+        限流（429）时抛出 EmbeddingRateLimitError，其他错误对应位置返回None
         """
         if not texts:
             return []
         
-        # v4 支持批量请求（建议最多25条）
-        batch_size = 25
+        batch_size = self.max_batch_size
         all_embeddings = []
         
         for i in range(0, len(texts), batch_size):
             batch = texts[i:i + batch_size]
             
             try:
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(
-                        self.base_url,
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": self.model_name,
-                            "input": batch  # v4 使用 OpenAI 兼容格式，直接传文本列表
-                        }
-                    )
-                    
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    # v4 使用 OpenAI 兼容格式的响应
-                    if result.get("data"):
-                        # 按 index 排序确保顺序正确
-                        data_items = sorted(result["data"], key=lambda x: x.get("index", 0))
-                        batch_embeddings = [item.get("embedding") for item in data_items]
-                        all_embeddings.extend(batch_embeddings)
-                    # 兼容旧格式
-                    elif result.get("output") and result["output"].get("embeddings"):
-                        embeddings = result["output"]["embeddings"]
-                        batch_embeddings = [e.get("embedding") for e in embeddings]
-                        all_embeddings.extend(batch_embeddings)
-                    else:
-                        logger.error(f"批量向量化响应格式错误: {result}")
-                        all_embeddings.extend([None] * len(batch))
-            
+                client = get_http_client(self.base_url)
+                response = await client.post(
+                    self.base_url,
+                    timeout=60.0,
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": self.model_name,
+                        "input": batch  # v4 使用 OpenAI 兼容格式，直接传文本列表
+                    }
+                )
+                
+                check_rate_limit(response)
+                response.raise_for_status()
+                result = response.json()
+                
+                # v4 使用 OpenAI 兼容格式的响应
+                if result.get("data"):
+                    # 按 index 排序确保顺序正确
+                    data_items = sorted(result["data"], key=lambda x: x.get("index", 0))
+                    batch_embeddings = [item.get("embedding") for item in data_items]
+                    all_embeddings.extend(batch_embeddings)
+                # 兼容旧格式
+                elif result.get("output") and result["output"].get("embeddings"):
+                    embeddings = result["output"]["embeddings"]
+                    batch_embeddings = [e.get("embedding") for e in embeddings]
+                    all_embeddings.extend(batch_embeddings)
+                else:
+                    logger.error(f"批量向量化响应格式错误: {result}")
+                    all_embeddings.extend([None] * len(batch))
+
+            except EmbeddingRateLimitError:
+                raise
             except Exception as e:
                 logger.error(f"批量向量化失败: {str(e)}")
                 all_embeddings.extend([None] * len(batch))
-            
-            # 避免请求过快
-            if i + batch_size < len(texts):
-                await asyncio.sleep(0.1)
         
         return all_embeddings
 
@@ -197,6 +243,8 @@ class OpenAIEmbeddingService(EmbeddingService):
     备用方案
     """
     
+    max_batch_size = 100  # 接口上限2048条，控制单次请求体大小
+    
     def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1/embeddings", model: str = "text-embedding-ada-002"):
         super().__init__()
         self.api_key = api_key
@@ -210,42 +258,78 @@ class OpenAIEmbeddingService(EmbeddingService):
             return None
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            client = get_http_client(self.base_url)
+            response = await client.post(
+                self.base_url,
+                timeout=30.0,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": self.model_name,
+                    "input": text[:8000]  # OpenAI限制
+                }
+            )
+            
+            response.raise_for_status()
+            result = response.json()
+            
+            if result.get("data") and len(result["data"]) > 0:
+                return result["data"][0].get("embedding")
+            
+            return None
+
+        except Exception as e:
+            logger.error(f"OpenAI Embedding失败: {str(e)}")
+            return None
+    
+    async def embed_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量向量化文本（限流时抛出 EmbeddingRateLimitError）"""
+        all_embeddings = []
+        
+        for i in range(0, len(texts), self.max_batch_size):
+            batch = texts[i:i + self.max_batch_size]
+            
+            # 接口不接受空文本，空文本对应位置返回None
+            positions = [j for j, text in enumerate(batch) if text and text.strip()]
+            batch_embeddings: List[Optional[List[float]]] = [None] * len(batch)
+            if not positions:
+                all_embeddings.extend(batch_embeddings)
+                continue
+            
+            try:
+                client = get_http_client(self.base_url)
                 response = await client.post(
                     self.base_url,
+                    timeout=60.0,
                     headers={
                         "Authorization": f"Bearer {self.api_key}",
                         "Content-Type": "application/json"
                     },
                     json={
                         "model": self.model_name,
-                        "input": text[:8000]  # OpenAI限制
+                        "input": [batch[j][:8000] for j in positions]  # OpenAI限制
                     }
                 )
                 
+                check_rate_limit(response)
                 response.raise_for_status()
                 result = response.json()
                 
-                if result.get("data") and len(result["data"]) > 0:
-                    return result["data"][0].get("embedding")
-                
-                return None
-        
-        except Exception as e:
-            logger.error(f"OpenAI Embedding失败: {str(e)}")
-            return None
-    
-    async def embed_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
-        """批量向量化文本"""
-        # OpenAI支持批量，但每次最多2048条
-        # 为简化，这里逐个处理
-        embeddings = []
-        for text in texts:
-            embedding = await self.embed_text(text)
-            embeddings.append(embedding)
-            await asyncio.sleep(0.05)  # 避免限流
+                for item in result.get("data") or []:
+                    index = item.get("index", 0)
+                    if index < len(positions):
+                        batch_embeddings[positions[index]] = item.get("embedding")
+            
+            except EmbeddingRateLimitError:
+                raise
+            except Exception as e:
+                logger.error(f"OpenAI批量Embedding失败: {str(e)}")
+            
+            all_embeddings.extend(batch_embeddings)
         
-        return embeddings
+        return all_embeddings
 
 
 class EmbeddingServiceFactory:
@@ -347,27 +431,175 @@ def get_embedding_service(
 # 文档向量化流程
 # ============================================================================
 
+# 单批次因429限流重试的最大次数（限流等待由 AdaptiveConcurrencyLimiter 控制）
+MAX_RATE_LIMIT_RETRIES = 10
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    向量化请求自适应并发控制（AIMD）
+    - 最多 max_concurrency 个批次同时请求
+    - 收到429：并发上限减半，并在 Retry-After（没有则指数退避）期间暂停发出新请求
+    - 连续成功达到当前上限次数后并发上限加1，逐步恢复
+    """
+    
+    def __init__(self, max_concurrency: int, base_backoff: float = 1.0, max_backoff: float = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._backoff = base_backoff
+        self._successes = 0
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+    
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._cond:
+                delay = self._paused_until - loop.time()
+                if delay <= 0:
+                    if self.active < self.limit:
+                        self.active += 1
+                        return self
+                    await self._cond.wait()
+                    continue
+            await asyncio.sleep(delay)
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+    
+    def on_success(self):
+        self._backoff = self.base_backoff
+        self._successes += 1
+        if self.limit < self.max_concurrency and self._successes >= self.limit:
+            self.limit += 1
+            self._successes = 0
+    
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+        delay = retry_after if retry_after else self._backoff
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+        self._paused_until = max(self._paused_until, asyncio.get_running_loop().time() + delay)
+        logger.warning(f"⚠️ 向量化接口限流，并发降至 {self.limit}，暂停 {delay:.1f} 秒")
+
+
+def load_embeddings_by_hash(
+    content_hashes: Set[str],
+    db: Session,
+    query_batch_size: int = 500
+) -> Dict[str, Tuple[bytes, str, Optional[float]]]:
+    """
+    按内容哈希查找已存储的向量（哈希已包含模型名称，不同模型的向量不会混用）
+    
+    Args:
+        content_hashes: 内容哈希集合
+        db: 数据库会话
+        query_batch_size: 每次 IN 查询的哈希数量
+    
+    Returns:
+        Dict[str, Tuple]: 内容哈希 -> (embedding_blob, embedding_dtype, embedding_scale)
+    """
+    from app.models.document import DocumentChunk
+    
+    found = {}
+    hashes = list(content_hashes)
+    for i in range(0, len(hashes), query_batch_size):
+        rows = db.query(
+            DocumentChunk.content_hash,
+            DocumentChunk.embedding_blob,
+            DocumentChunk.embedding_dtype,
+            DocumentChunk.embedding_scale
+        ).filter(
+            DocumentChunk.content_hash.in_(hashes[i:i + query_batch_size]),
+            DocumentChunk.embedding_blob.isnot(None)
+        ).all()
+        for content_hash, blob, dtype, scale in rows:
+            found.setdefault(content_hash, (blob, dtype, scale))
+    return found
+
+
+async def embed_batch_with_retry(
+    embedding_service: EmbeddingService,
+    texts: List[str],
+    limiter: AdaptiveConcurrencyLimiter,
+    label: str,
+    max_retries: int = 3
+) -> Optional[List[Optional[List[float]]]]:
+    """
+    向量化一个批次，失败时重试
+    
+    429限流交给 limiter 统一降速后重试；其他错误（包括非空文本未返回向量）按指数退避重试 max_retries 次。
+    
+    Returns:
+        Optional[List]: 与 texts 一一对应的向量列表（空文本对应None），多次重试仍失败返回None
+    """
+    attempt = 0
+    rate_limited = 0
+    retry_delay = 2
+    
+    while True:
+        try:
+            async with limiter:
+                try:
+                    embeddings = await embedding_service.embed_texts(texts)
+                except EmbeddingRateLimitError as e:
+                    limiter.on_rate_limited(e.retry_after)
+                    raise
+                
+                missing = [
+                    i for i, text in enumerate(texts)
+                    if text and text.strip() and (i >= len(embeddings) or not embeddings[i])
+                ]
+                if missing:
+                    raise ValueError(f"{len(missing)} 个文本块未返回向量")
+                limiter.on_success()
+            return embeddings
+        
+        except EmbeddingRateLimitError:
+            rate_limited += 1
+            if rate_limited > MAX_RATE_LIMIT_RETRIES:
+                logger.error(f"{label} 持续限流，放弃")
+                return None
+        
+        except Exception as e:
+            attempt += 1
+            if attempt >= max_retries:
+                logger.error(f"{label} 多次重试失败: {str(e)}")
+                return None
+            logger.warning(f"{label} 失败，将在 {retry_delay} 秒后重试 (尝试 {attempt}/{max_retries}): {str(e)}")
+            await asyncio.sleep(retry_delay)
+            retry_delay *= 2  # 指数退避
+
+
 async def embed_document(
     document_id: int,
     db: Session,
     embedding_service: Optional[EmbeddingService] = None,
-    batch_size: int = 10  # 每批处理的文本块数量
+    batch_size: Optional[int] = None  # 每批处理的文本块数量
 ):
     """
     对文档进行向量化（包括切分和嵌入）
-    增强版：支持批量处理、断点续传、自动重试
+    多个批次并发请求（收到429时自适应降低并发），单批次失败自动重试，
+    全部完成后在同一事务中替换旧文本块并批量写入
     
     Args:
         document_id: 文档ID
         db: 数据库会话
         embedding_service: Embedding服务实例（可选）
-        batch_size: 每批处理的文本块数量（默认10）
+        batch_size: 每批处理的文本块数量（默认使用服务商单次请求上限）
     """
     from app.models.document import Document, DocumentChunk
     from app.models.knowledge_base import KnowledgeBase
     from app.utils.document_parser import parse_and_split_document
     from app.utils.timezone import get_beijing_time_naive
-    import time
+    from app.utils.embedding_codec import encode_embedding, chunk_content_hash
+    from app.core.config import settings
+    from sqlalchemy import insert
     
     # 获取文档
     doc = db.query(Document).filter(Document.id == document_id).first()
@@ -408,7 +640,7 @@ async def embed_document(
         logger.info(f"切分参数: mode={split_mode}, size={chunk_size}, overlap={chunk_overlap}")
         
         # 解析和切分文档
-        logger.info(f"[步骤1/4] 开始解析和切分文档 {doc.id}")
+        logger.info(f"[步骤1/3] 开始解析和切分文档 {doc.id}")
         
         try:
             _, chunks_data = parse_and_split_document(
@@ -426,112 +658,118 @@ async def embed_document(
             return
         
         total_chunks = len(chunks_data)
-        logger.info(f"[步骤1/4] 文档 {doc.id} 切分完成: {total_chunks} 个文本块")
+        logger.info(f"[步骤1/3] 文档 {doc.id} 切分完成: {total_chunks} 个文本块")
         
         # 检查文本块数量，如果太多则警告
         if total_chunks > 200:
             logger.warning(f"文档 {doc.id} 文本块数量较多 ({total_chunks})，将使用批量处理")
         
-        # 删除旧的文本块
-        logger.info(f"[步骤2/4] 清理旧的文本块记录...")
-        db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).delete()
-        db.commit()
-        logger.info(f"[步骤2/4] 旧文本块清理完成")
-        
         # 获取Embedding服务
-        logger.info(f"[步骤3/4] 初始化向量化服务...")
+        logger.info(f"[步骤2/3] 初始化向量化服务...")
         if embedding_service is None:
             embedding_service = get_embedding_service()
-        logger.info(f"[步骤3/4] 向量化服务就绪，准备处理 {total_chunks} 个文本块")
+        batch_size = batch_size or embedding_service.max_batch_size
+        
+        # 按内容哈希复用已有向量（包括本文档旧文本块和其他知识库），文档内重复内容只请求一次
+        content_hashes = [chunk_content_hash(chunk['content'], embedding_service.model_name) for chunk in chunks_data]
+        reusable = load_embeddings_by_hash(set(content_hashes), db)
+        pending_hashes = list(dict.fromkeys(h for h in content_hashes if h not in reusable))
+        pending_texts = {h: chunk['content'] for h, chunk in zip(content_hashes, chunks_data)}
+        
+        batch_count = (len(pending_hashes) + batch_size - 1) // batch_size
+        logger.info(f"[步骤2/3] 向量化服务就绪，{total_chunks} 个文本块中 {total_chunks - len(pending_hashes)} 个复用已有向量，"
+                    f"{len(pending_hashes)} 个分 {batch_count} 批向量化，最多 {settings.embedding_max_concurrency} 批并发")
+        
+        # 并发向量化（限流时自动降低并发）
+        limiter = AdaptiveConcurrencyLimiter(settings.embedding_max_concurrency)
+        embedded: Dict[str, Optional[List[float]]] = {}
+        failed_hashes = set()
+        
+        async def process_batch(batch_start: int):
+            batch_hashes = pending_hashes[batch_start:batch_start + batch_size]
+            label = f"文档 {doc.id}: 批次 {batch_start//batch_size + 1}/{batch_count}"
+            texts = [pending_texts[h] for h in batch_hashes]
+            
+            batch_embeddings = await embed_batch_with_retry(
+                embedding_service, texts, limiter, label, max_retries=settings.embedding_max_retries
+            )
+            if batch_embeddings is None:
+                failed_hashes.update(batch_hashes)
+                return
+            embedded.update(zip(batch_hashes, batch_embeddings))
+            logger.info(f"{label} 处理成功 ({len(embedded)}/{len(pending_hashes)})")
         
-        # 批量向量化（分批处理，避免超时和内存问题）
-        chunk_objects = []
-        failed_indices = []
+        await asyncio.gather(*(process_batch(start) for start in range(0, len(pending_hashes), batch_size)))
         
-        for batch_start in range(0, total_chunks, batch_size):
-            batch_end = min(batch_start + batch_size, total_chunks)
-            batch_chunks = chunks_data[batch_start:batch_end]
-            
-            logger.info(f"文档 {doc.id}: 处理批次 {batch_start//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size} "
-                       f"({batch_start+1}-{batch_end}/{total_chunks})")
-            
-            # 提取文本
-            texts = [chunk['content'] for chunk in batch_chunks]
-            logger.info(f"批次 {batch_start//batch_size + 1}: 准备向量化 {len(texts)} 个文本块")
-            
-            # 向量化（带重试）
-            max_retries = 3
-            retry_delay = 2
+        # 替换旧文本块并批量写入（同一事务，向量化期间旧文本块仍可检索）
+        logger.info(f"[步骤3/3] 写入文本块并更新文档状态...")
+        storage_dtype = settings.embedding_storage_dtype
+        failed_indices = []
+        chunk_rows = []
+        for index, (chunk_data, content_hash) in enumerate(zip(chunks_data, content_hashes)):
+            if content_hash in failed_hashes:
+                failed_indices.append(index)
+                continue
             
-            for attempt in range(max_retries):
-                try:
-                    logger.debug(f"批次 {batch_start//batch_size + 1}: 调用向量化API (尝试 {attempt + 1}/{max_retries})")
-                    embeddings = await embedding_service.embed_texts(texts)
-                    logger.info(f"批次 {batch_start//batch_size + 1}: 向量化API调用成功，获得 {len(embeddings)} 个向量")
-                    
-                    # 创建文本块记录
-                    for i, (chunk_data, embedding) in enumerate(zip(batch_chunks, embeddings)):
-                        actual_index = batch_start + i
-                        
-                        chunk = DocumentChunk(
-                            document_id=doc.id,
-                            knowledge_base_id=doc.knowledge_base_id,
-                            content=chunk_data['content'],
-                            chunk_index=actual_index,
-                            char_count=chunk_data['char_count'],
-                            token_count=chunk_data['token_count'],
-                            embedding_vector=embedding,  # JSON格式存储
-                            meta_data=chunk_data.get('metadata')
-                        )
-                        
-                        chunk_objects.append(chunk)
-                        db.add(chunk)
-                    
-                    # 提交当前批次
-                    db.commit()
-                    logger.info(f"文档 {doc.id}: 批次 {batch_start//batch_size + 1} 处理成功")
-                    break  # 成功则跳出重试循环
-                    
-                except Exception as batch_error:
-                    if attempt < max_retries - 1:
-                        logger.warning(f"文档 {doc.id}: 批次 {batch_start//batch_size + 1} 失败，"
-                                      f"将在 {retry_delay} 秒后重试 (尝试 {attempt + 1}/{max_retries}): {str(batch_error)}")
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2  # 指数退避
-                    else:
-                        logger.error(f"文档 {doc.id}: 批次 {batch_start//batch_size + 1} 多次重试失败: {str(batch_error)}")
-                        failed_indices.extend(range(batch_start, batch_end))
-                        break
+            if content_hash in reusable:
+                # 直接复用已存储的二进制向量（保留其原有存储格式）
+                embedding_blob, embedding_dtype, embedding_scale = reusable[content_hash]
+            else:
+                # 向量以二进制紧凑格式存储
+                embedding = embedded.get(content_hash)
+                embedding_blob, embedding_scale = (
+                    encode_embedding(embedding, storage_dtype) if embedding else (None, None)
+                )
+                embedding_dtype = storage_dtype if embedding_blob is not None else None
             
-            # 批次间短暂延迟，避免API限流
-            if batch_end < total_chunks:
-                await asyncio.sleep(0.5)
+            chunk_rows.append({
+                'document_id': doc.id,
+                'knowledge_base_id': doc.knowledge_base_id,
+                'content': chunk_data['content'],
+                'chunk_index': index,
+                'char_count': chunk_data['char_count'],
+                'token_count': chunk_data['token_count'],
+                'content_hash': content_hash,
+                'embedding_blob': embedding_blob,
+                'embedding_dtype': embedding_dtype,
+                'embedding_scale': embedding_scale,
+                'meta_data': chunk_data.get('metadata')
+            })
+        
+        db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).delete()
+        write_batch_size = settings.embedding_write_batch_size
+        for i in range(0, len(chunk_rows), write_batch_size):
+            db.execute(insert(DocumentChunk), chunk_rows[i:i + write_batch_size])
         
         # 更新文档状态
-        logger.info(f"[步骤4/4] 更新文档状态...")
         if not failed_indices:
             doc.embedding_status = 'completed'
-            doc.chunk_count = len(chunk_objects)
+            doc.chunk_count = len(chunk_rows)
             doc.embedded_at = get_beijing_time_naive()
             doc.embedding_error = None
-            logger.info(f"[步骤4/4] ✅ 文档 {doc.id} 向量化完成，共 {len(chunk_objects)} 个文本块")
+            logger.info(f"[步骤3/3] ✅ 文档 {doc.id} 向量化完成，共 {len(chunk_rows)} 个文本块")
         else:
             doc.embedding_status = 'failed'
-            doc.chunk_count = len(chunk_objects)
+            doc.chunk_count = len(chunk_rows)
             doc.embedding_error = f"部分文本块向量化失败: {len(failed_indices)} 个（{failed_indices[:10]}...）"
-            logger.error(f"[步骤4/4] ❌ 文档 {doc.id} 部分向量化失败，成功 {len(chunk_objects)}/{total_chunks}")
+            logger.error(f"[步骤3/3] ❌ 文档 {doc.id} 部分向量化失败，成功 {len(chunk_rows)}/{total_chunks}")
         
         # 更新知识库统计
-        kb.chunk_count = (kb.chunk_count or 0) + len(chunk_objects)
+        kb.chunk_count = (kb.chunk_count or 0) + len(chunk_rows)
         kb.last_updated_at = get_beijing_time_naive()
         
         db.commit()
-        logger.info(f"[步骤4/4] 数据库更新完成")
+        logger.info(f"[步骤3/3] 数据库更新完成")
+        
+        # 增量更新知识库检索索引（失败不影响向量化结果，下次检索时会自动重建）
+        from app.services.knowledge_retrieval import refresh_document_indexes
+        refresh_document_indexes(doc.knowledge_base_id, doc.id, db)
     
     except Exception as e:
         logger.error(f"文档 {doc.id} 向量化失败: {str(e)}")
         import traceback
         logger.error(f"详细错误: {traceback.format_exc()}")
+        db.rollback()
         doc.embedding_status = 'failed'
         doc.embedding_error = str(e)
         db.commit()
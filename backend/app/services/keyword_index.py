@@ -0,0 +1,346 @@
+"""
+知识库关键词索引服务
+为每个知识库维护一个 BM25 倒排索引，替代 LIKE '%query%' 全表扫描：
+- 中文按连续汉字切分为二元组（单字词保留单字），英文/数字按单词切分并转小写
+- 文档向量化入库时增量更新，持久化到磁盘，与向量索引使用相同的过期检测机制
+"""
+import math
+import os
+import asyncio
+import re
+import pickle
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models.document import DocumentChunk
+from app.services.vector_index import INDEX_DIR, chunk_signatures, index_file_lock
+
+logger = logging.getLogger(__name__)
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 分词规则变更时递增，旧索引文件会被自动重建
+TOKENIZER_VERSION = 1
+
+_TOKEN_PATTERN = re.compile(r'[一-鿿]+|[a-z0-9]+(?:[._-][a-z0-9]+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中英文混合分词
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        List[str]: 词项列表（保留重复，用于统计词频）
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.findall(text.lower()):
+        if '一' <= match[0] <= '鿿':
+            if len(match) == 1:
+                tokens.append(match)
+            else:
+                tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    单个知识库的 BM25 倒排索引
+
+    postings: 词项 -> {chunk_id: 词频}
+    检索时每个词项的倒排表会缓存为 NumPy 数组，批量计算得分。
+    """
+
+    def __init__(self, kb_id: int):
+        self.kb_id = kb_id
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.chunk_terms: Dict[int, Tuple[str, ...]] = {}
+        self.document_chunks: Dict[int, List[int]] = {}
+        self.total_length = 0
+        self.signature: Tuple[int, int] = (0, 0)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.lengths)
+
+    def add(self, chunk_id: int, document_id: int, content: str):
+        """添加一个文本块"""
+        if chunk_id in self.lengths:
+            return
+        counts = Counter(tokenize(content or ''))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+            self._arrays.pop(term, None)
+        length = sum(counts.values())
+        self.lengths[chunk_id] = length
+        self.chunk_terms[chunk_id] = tuple(counts.keys())
+        self.document_chunks.setdefault(document_id, []).append(chunk_id)
+        self.total_length += length
+
+    def remove_document(self, document_id: int) -> int:
+        """移除文档的全部文本块，返回移除数量"""
+        chunk_ids = self.document_chunks.pop(document_id, [])
+        for chunk_id in chunk_ids:
+            for term in self.chunk_terms.pop(chunk_id, ()):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+                self._arrays.pop(term, None)
+            self.total_length -= self.lengths.pop(chunk_id, 0)
+        return len(chunk_ids)
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """词项倒排表的 (chunk_ids, 词频, 文本块长度) 数组（惰性构建，写入后失效）"""
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self.postings[term]
+            chunk_ids = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+            tfs = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+            lengths = np.fromiter((self.lengths[c] for c in postings.keys()), dtype=np.float32, count=len(postings))
+            arrays = (chunk_ids, tfs, lengths)
+            self._arrays[term] = arrays
+        return arrays
+
+    def search(self, terms: List[str], top_k: int) -> List[Tuple[int, float]]:
+        """
+        BM25 检索
+
+        Args:
+            terms: 查询词项
+            top_k: 返回数量
+
+        Returns:
+            List[Tuple[int, float]]: (chunk_id, BM25得分) 列表，按得分降序
+        """
+        n = self.size
+        if n == 0 or top_k <= 0:
+            return []
+        avg_length = max(self.total_length / n, 1.0)
+
+        all_ids, all_scores = [], []
+        for term, query_tf in Counter(terms).items():
+            if term not in self.postings:
+                continue
+            chunk_ids, tfs, lengths = self._term_arrays(term)
+            df = chunk_ids.shape[0]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+            all_ids.append(chunk_ids)
+            all_scores.append(query_tf * idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+
+        if not all_ids:
+            return []
+
+        # 同一文本块命中多个词项时累加得分
+        unique_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+
+        k = min(top_k, scores.shape[0])
+        order = np.argpartition(scores, -k)[-k:]
+        order = order[np.argsort(scores[order])[::-1]]
+        return [(int(unique_ids[i]), float(scores[i])) for i in order]
+
+    def save(self, path: Path):
+        """原子写入磁盘（先写临时文件再替换）"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'version': TOKENIZER_VERSION,
+                'postings': self.postings,
+                'lengths': self.lengths,
+                'chunk_terms': self.chunk_terms,
+                'document_chunks': self.document_chunks,
+                'total_length': self.total_length,
+                'signature': self.signature,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, kb_id: int, path: Path) -> Optional['KeywordIndex']:
+        """从磁盘加载索引（文件不存在、损坏或分词规则已变更时返回None）"""
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') != TOKENIZER_VERSION:
+                return None
+            index = cls(kb_id)
+            index.postings = data['postings']
+            index.lengths = data['lengths']
+            index.chunk_terms = data['chunk_terms']
+            index.document_chunks = data['document_chunks']
+            index.total_length = data['total_length']
+            index.signature = tuple(data['signature'])
+            return index
+        except Exception as e:
+            logger.warning(f"⚠️ 知识库 {kb_id} 关键词索引文件损坏，将重新构建: {e}")
+            return None
+
+
+class KeywordIndexManager:
+    """知识库关键词索引管理器（过期检测、加锁和持久化策略与 VectorIndexManager 一致）"""
+
+    def __init__(self, index_dir: Path = INDEX_DIR):
+        self.index_dir = index_dir
+        self._indexes: Dict[int, KeywordIndex] = {}
+        # 全局锁只保护 _indexes / _kb_locks 的读写，不在构建索引期间持有
+        self._lock = threading.Lock()
+        self._kb_locks: Dict[int, threading.Lock] = {}
+
+    def _index_path(self, kb_id: int) -> Path:
+        return self.index_dir / f"kb_{kb_id}.bm25.pkl"
+
+    def _lock_path(self, kb_id: int) -> Path:
+        return self.index_dir / f"kb_{kb_id}.bm25.lock"
+
+    def _kb_lock(self, kb_id: int) -> threading.Lock:
+        """知识库级别的锁（加载、重建、增量更新时持有）"""
+        with self._lock:
+            lock = self._kb_locks.get(kb_id)
+            if lock is None:
+                lock = self._kb_locks[kb_id] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _load_chunks(index: KeywordIndex, db: Session, document_id: Optional[int] = None):
+        """从数据库读取文本块内容写入索引"""
+        query = db.query(
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.content
+        ).filter(DocumentChunk.knowledge_base_id == index.kb_id)
+        if document_id is not None:
+            query = query.filter(DocumentChunk.document_id == document_id)
+
+        for chunk_id, doc_id, content in query.yield_per(1000):
+            index.add(chunk_id, doc_id, content)
+
+    def _persist(self, index: KeywordIndex):
+        try:
+            index.save(self._index_path(index.kb_id))
+        except Exception as e:
+            logger.warning(f"⚠️ 知识库 {index.kb_id} 关键词索引持久化失败: {e}")
+
+    def _get_index(self, kb_id: int, signature: Tuple[int, int], db: Session) -> KeywordIndex:
+        """获取与数据库签名一致的索引：内存 -> 磁盘 -> 重建"""
+        with self._lock:
+            current = self._indexes.get(kb_id)
+        if current is not None and current.signature == signature:
+            return current
+
+        lock = self._kb_lock(kb_id)
+        # 其他线程正在重建时先使用旧索引；没有旧索引才等待
+        if not lock.acquire(blocking=current is None):
+            return current
+        try:
+            with self._lock:
+                index = self._indexes.get(kb_id)
+            # 等待期间可能已由其他线程重建
+            if index is not None and index.signature == signature:
+                return index
+
+            index = KeywordIndex.load(kb_id, self._index_path(kb_id))
+            if index is None or index.signature != signature:
+                index = KeywordIndex(kb_id)
+                self._load_chunks(index, db)
+                index.signature = signature
+                self._persist(index)
+                logger.info(f"✅ 知识库 {kb_id} 关键词索引构建完成: {index.size} 个文本块, {len(index.postings)} 个词项")
+
+            with self._lock:
+                self._indexes[kb_id] = index
+            return index
+        finally:
+            lock.release()
+
+    def search(self, query: str, kb_ids: List[int], top_k: int, db: Session) -> List[Tuple[int, float]]:
+        """
+        在多个知识库中按 BM25 检索
+
+        Args:
+            query: 查询文本
+            kb_ids: 知识库ID列表
+            top_k: 返回数量
+            db: 数据库会话
+
+        Returns:
+            List[Tuple[int, float]]: (chunk_id, BM25得分) 列表，按得分降序
+        """
+        terms = tokenize(query)
+        if not terms or not kb_ids:
+            return []
+
+        results = []
+        signatures = chunk_signatures(kb_ids, db)
+        for kb_id in kb_ids:
+            signature = signatures.get(kb_id)
+            if signature is None:
+                continue
+            results.extend(self._get_index(kb_id, signature, db).search(terms, top_k))
+
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results[:top_k]
+
+    async def search_async(self, query: str, kb_ids: List[int], top_k: int) -> List[Tuple[int, float]]:
+        """在线程中执行 search()，线程内使用独立的数据库会话（同 VectorIndexManager.search_async）"""
+        def run():
+            from app.core.database import SessionLocal
+            db = SessionLocal()
+            try:
+                return self.search(query, kb_ids, top_k, db)
+            finally:
+                db.close()
+
+        return await asyncio.to_thread(run)
+
+    def refresh_document(self, kb_id: int, document_id: int, db: Session):
+        """
+        按数据库中的最新数据增量更新单个文档（需在事务提交后调用）
+
+        内存和磁盘上都没有索引时跳过，首次检索时会全量构建。
+        """
+        with self._kb_lock(kb_id), index_file_lock(self._lock_path(kb_id)):
+            with self._lock:
+                cached = self._indexes.get(kb_id)
+            index = KeywordIndex.load(kb_id, self._index_path(kb_id)) or cached
+            if index is None:
+                return
+
+            index.remove_document(document_id)
+            self._load_chunks(index, db, document_id=document_id)
+            index.signature = chunk_signatures([kb_id], db).get(kb_id, (0, 0))
+            with self._lock:
+                self._indexes[kb_id] = index
+            self._persist(index)
+            logger.info(f"✅ 知识库 {kb_id} 关键词索引增量更新: 文档 {document_id}, 当前 {index.size} 个文本块")
+
+    def invalidate(self, kb_id: int):
+        """丢弃知识库索引（内存和磁盘）"""
+        with self._lock:
+            self._indexes.pop(kb_id, None)
+        try:
+            self._index_path(kb_id).unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"⚠️ 删除知识库 {kb_id} 关键词索引文件失败: {e}")
+
+
+# 全局关键词索引管理器
+keyword_index_manager = KeywordIndexManager()
@@ -0,0 +1,189 @@
+"""
+知识库检索公共逻辑
+- 检索引擎（向量索引、BM25关键词索引）只返回排好序的 (chunk_id, score)，
+  本模块在排序完成后一次性加载文本块和文档，知识库元数据使用进程内TTL缓存
+- 混合检索的得分融合
+- 文档/知识库变更后统一维护各检索索引
+"""
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, defer
+
+from app.core.config import settings
+from app.models.knowledge_base import KnowledgeBase
+from app.models.document import Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class KnowledgeBaseInfo:
+    """检索结果中使用的知识库元数据（与数据库会话无关，可安全缓存）"""
+    id: int
+    uuid: str
+    name: str
+
+
+class KnowledgeBaseMetaCache:
+    """知识库元数据TTL缓存"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._items: Dict[int, Tuple[float, KnowledgeBaseInfo]] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, kb_ids: Iterable[int], db: Session) -> Dict[int, KnowledgeBaseInfo]:
+        """批量获取知识库元数据，未命中或过期的一次性从数据库加载"""
+        now = time.monotonic()
+        found: Dict[int, KnowledgeBaseInfo] = {}
+        missing = []
+
+        with self._lock:
+            for kb_id in set(kb_ids):
+                item = self._items.get(kb_id)
+                if item and item[0] > now:
+                    found[kb_id] = item[1]
+                else:
+                    missing.append(kb_id)
+
+        if missing:
+            rows = db.query(KnowledgeBase.id, KnowledgeBase.uuid, KnowledgeBase.name).filter(
+                KnowledgeBase.id.in_(missing),
+                KnowledgeBase.deleted_at.is_(None)
+            ).all()
+            expires_at = now + self.ttl
+            with self._lock:
+                for kb_id, kb_uuid, name in rows:
+                    info = KnowledgeBaseInfo(id=kb_id, uuid=kb_uuid, name=name)
+                    self._items[kb_id] = (expires_at, info)
+                    found[kb_id] = info
+
+        return found
+
+    def invalidate(self, kb_id: Optional[int] = None):
+        """知识库更新/删除后失效缓存（不传ID则清空）"""
+        with self._lock:
+            if kb_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(kb_id, None)
+
+
+# 全局知识库元数据缓存
+kb_meta_cache = KnowledgeBaseMetaCache(ttl=settings.cache_kb_metadata_ttl)
+
+
+def normalize_keyword_scores(scored_chunks: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+    """BM25得分没有上界，按本次结果的最高分归一化到0-1，便于与向量相似度一起展示和融合"""
+    if not scored_chunks:
+        return []
+    max_score = max(score for _, score in scored_chunks)
+    if max_score <= 0:
+        return [(chunk_id, 0.0) for chunk_id, _ in scored_chunks]
+    return [(chunk_id, score / max_score) for chunk_id, score in scored_chunks]
+
+
+def fuse_hybrid_scores(
+    vector_scores: List[Tuple[int, float]],
+    keyword_scores: List[Tuple[int, float]],
+    vector_weight: float
+) -> List[Tuple[int, float]]:
+    """
+    混合检索得分融合：score = w * 向量相似度 + (1 - w) * 归一化BM25得分
+
+    只被一路召回的文本块，另一路得分按0计算。
+
+    Args:
+        vector_scores: 向量检索 (chunk_id, 0-1相似度)
+        keyword_scores: 关键词检索 (chunk_id, 0-1归一化得分)
+        vector_weight: 向量得分权重（0-1）
+
+    Returns:
+        List[Tuple[int, float]]: 融合后的 (chunk_id, score)，按得分降序
+    """
+    fused: Dict[int, float] = {}
+    for chunk_id, score in vector_scores:
+        fused[chunk_id] = vector_weight * score
+    for chunk_id, score in keyword_scores:
+        fused[chunk_id] = fused.get(chunk_id, 0.0) + (1 - vector_weight) * score
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+def refresh_document_indexes(kb_id: int, document_id: int, db: Session):
+    """
+    文档文本块变更（向量化完成、重新向量化、删除）并提交后，增量更新向量索引和关键词索引
+
+    索引更新失败不影响业务流程，下次检索时会根据签名自动重建。
+    """
+    from app.services.vector_index import vector_index_manager
+    from app.services.keyword_index import keyword_index_manager
+
+    for name, manager in (('向量', vector_index_manager), ('关键词', keyword_index_manager)):
+        try:
+            manager.refresh_document(kb_id, document_id, db)
+        except Exception as e:
+            logger.warning(f"⚠️ 文档 {document_id} {name}索引更新失败: {e}")
+
+
+def invalidate_kb_indexes(kb_id: int):
+    """知识库删除后释放其全部检索索引和元数据缓存"""
+    from app.services.vector_index import vector_index_manager
+    from app.services.keyword_index import keyword_index_manager
+
+    vector_index_manager.invalidate(kb_id)
+    keyword_index_manager.invalidate(kb_id)
+    kb_meta_cache.invalidate(kb_id)
+
+
+def hydrate_chunks(scored_chunks: List[Tuple[int, float]], db: Session) -> List[dict]:
+    """
+    按排序结果批量加载文本块、文档和知识库信息
+
+    文本块与文档通过一次联表查询加载，知识库元数据走缓存，查询次数与结果数量无关。
+    向量列和文档全文不读取（访问时才按需加载）。
+    已删除或禁用的文档会被过滤掉，返回顺序与输入一致。
+
+    Args:
+        scored_chunks: 已排序的 (chunk_id, score) 列表
+        db: 数据库会话
+
+    Returns:
+        List[dict]: [{'chunk', 'document', 'knowledge_base', 'similarity_score'}, ...]
+    """
+    if not scored_chunks:
+        return []
+
+    rows = db.query(DocumentChunk, Document).options(
+        defer(DocumentChunk.embedding_blob),
+        defer(DocumentChunk.embedding_vector),
+        defer(Document.content)
+    ).join(
+        Document, DocumentChunk.document_id == Document.id
+    ).filter(
+        DocumentChunk.id.in_([chunk_id for chunk_id, _ in scored_chunks]),
+        Document.deleted_at.is_(None),
+        Document.is_active == 1
+    ).all()
+
+    loaded = {chunk.id: (chunk, doc) for chunk, doc in rows}
+    kbs = kb_meta_cache.get_many((chunk.knowledge_base_id for chunk, _ in loaded.values()), db)
+
+    results = []
+    for chunk_id, score in scored_chunks:
+        if chunk_id not in loaded:
+            continue
+        chunk, doc = loaded[chunk_id]
+        kb = kbs.get(chunk.knowledge_base_id)
+        if kb is None:
+            continue
+        results.append({
+            'chunk': chunk,
+            'document': doc,
+            'knowledge_base': kb,
+            'similarity_score': score
+        })
+    return results
@@ -1,16 +1,44 @@
 """
 大模型调用服务
 支持多种国产和国际大模型
+所有请求均为异步，复用按服务地址共享的 HTTP 长连接池，并按提供商限制并发请求数
 """
 
 import json
-import requests
+import asyncio
+import httpx
 import logging
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from app.core.config import settings
+from app.core.http_client import get_http_client
 from app.models.llm_model import LLMModel
 
 logger = logging.getLogger(__name__)
 
+# (事件循环ID, 提供商) -> (事件循环, 并发信号量)
+_provider_semaphores: Dict[Tuple[int, str], Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+
+
+def get_provider_semaphore(provider: str) -> asyncio.Semaphore:
+    """
+    获取提供商的并发信号量（必须在事件循环中调用）
+
+    上限取 LLM_PROVIDER_CONCURRENCY 中该提供商的配置，未配置时使用 LLM_MAX_CONCURRENCY。
+    信号量绑定事件循环，与共享HTTP客户端一样按事件循环分别创建。
+    """
+    loop = asyncio.get_running_loop()
+
+    for key in [key for key, (owner, _) in _provider_semaphores.items() if owner.is_closed()]:
+        del _provider_semaphores[key]
+
+    key = (id(loop), provider)
+    entry = _provider_semaphores.get(key)
+    if entry is None:
+        limit = settings.llm_provider_concurrency.get(provider, settings.llm_max_concurrency)
+        entry = (loop, asyncio.Semaphore(max(1, limit)))
+        _provider_semaphores[key] = entry
+    return entry[1]
+
 
 class LLMService:
     """大模型调用服务基类"""
@@ -95,7 +123,32 @@ class LLMService:
         
         logger.info("=" * 80)
     
-    def chat(
+    @staticmethod
+    def _set_tool_calls(output: Dict[str, Any], tool_calls: List[Dict[str, Any]]):
+        """
+        将模型返回的工具调用转换为标准格式
+        
+        function_calls 保存同一轮返回的全部调用（可并行执行），function_call 保留第一个以兼容旧调用方
+        """
+        calls = []
+        for tool_call in tool_calls:
+            arguments = tool_call["function"].get("arguments") or ""
+            calls.append({
+                "name": tool_call["function"]["name"],
+                "arguments": json.loads(arguments) if arguments.strip() else {}
+            })
+            logger.info(f"🔧 Tool Call: {tool_call['function']['name']}")
+            logger.info(f"📝 Arguments: {json.dumps(calls[-1]['arguments'], ensure_ascii=False)}")
+        if calls:
+            output["function_call"] = calls[0]
+            output["function_calls"] = calls
+    
+    async def _post(self, url: str, **kwargs) -> httpx.Response:
+        """通过共享连接池发送请求（排队等待提供商并发名额）"""
+        async with get_provider_semaphore(self.model.provider.lower()):
+            return await get_http_client(url).post(url, timeout=settings.llm_request_timeout, **kwargs)
+    
+    async def chat(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -110,30 +163,174 @@ class LLMService:
             function_call: 是否强制调用函数 ("auto", "none", {"name": "function_name"})
         
         Returns:
-            {"response": "回复内容", "function_call": {...}}
+            {"response": "回复内容", "function_call": {...}, "function_calls": [{...}, ...]}
         """
         provider = self.model.provider.lower()
         
         if provider == 'openai':
-            return self._call_openai_api(messages, functions, function_call)
+            return await self._call_openai_api(messages, functions, function_call)
         elif provider == 'qwen':
-            return self._call_qwen_api(messages, functions, function_call)
+            return await self._call_qwen_api(messages, functions, function_call)
         elif provider == 'wenxin':
-            return self._call_wenxin_api(messages, functions, function_call)
+            return await self._call_wenxin_api(messages, functions, function_call)
         elif provider == 'spark':
-            return self._call_spark_api(messages, functions, function_call)
+            return await self._call_spark_api(messages, functions, function_call)
         elif provider == 'zhipu':
-            return self._call_zhipu_api(messages, functions, function_call)
+            return await self._call_zhipu_api(messages, functions, function_call)
         elif provider == 'moonshot':
-            return self._call_moonshot_api(messages, functions, function_call)
+            return await self._call_moonshot_api(messages, functions, function_call)
         elif provider == 'deepseek':
-            return self._call_deepseek_api(messages, functions, function_call)
+            return await self._call_deepseek_api(messages, functions, function_call)
         elif provider == 'doubao':
-            return self._call_doubao_api(messages, functions, function_call)
+            return await self._call_doubao_api(messages, functions, function_call)
         else:
             raise ValueError(f"不支持的模型提供商: {provider}")
     
-    def _call_openai_api(
+    def _stream_request(
+        self,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[Dict[str, Any]]] = None,
+        function_call: Optional[str] = None
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        构建 OpenAI 兼容流式接口的 (url, payload)，参数与各提供商的非流式调用一致
+        
+        Returns:
+            不支持流式输出的提供商返回None
+        """
+        provider = self.model.provider.lower()
+        default_bases = {
+            'qwen': 'https://dashscope.aliyuncs.com/compatible-mode/v1',
+            'zhipu': 'https://open.bigmodel.cn/api/paas/v4',
+            'doubao': 'https://ark.cn-beijing.volces.com/api/v3',
+        }
+        if provider in ('openai', 'moonshot', 'deepseek'):
+            api_base = self.api_base
+        elif provider in default_bases:
+            api_base = self.api_base or default_bases[provider]
+        else:
+            return None
+        
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": float(self.temperature) if self.temperature else 0.7,
+            "max_tokens": int(self.max_tokens) if self.max_tokens else 2000,
+            "top_p": float(self.top_p) if self.top_p else 0.9,
+            "stream": True
+        }
+        # 智谱默认在最后一个数据块返回 usage，其他提供商需要显式开启
+        if provider != 'zhipu':
+            payload["stream_options"] = {"include_usage": True}
+        
+        if functions:
+            if provider in ('openai', 'moonshot', 'deepseek'):
+                payload["functions"] = functions
+                payload["function_call"] = function_call or "auto"
+            else:
+                payload["tools"] = [{"type": "function", "function": func} for func in functions]
+                if function_call and function_call != "none":
+                    payload["tool_choice"] = "auto"
+        
+        return f"{api_base.rstrip('/')}/chat/completions", payload
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[Dict[str, Any]]] = None,
+        function_call: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式聊天：模型输出的文本片段到达后立即产出
+        
+        Yields:
+            {"type": "delta", "content": "文本片段"}
+            ...
+            {"type": "done", "response": "完整回复", "function_call": {...} 或 None,
+             "function_calls": [{...}, ...] 或 None, "usage": {...} 或 None}
+        
+        不支持流式输出的提供商（文心、星火）退化为一次性返回完整回复。
+        """
+        spec = self._stream_request(messages, functions, function_call)
+        if spec is None:
+            result = await self.chat(messages, functions, function_call)
+            if result.get("response"):
+                yield {"type": "delta", "content": result["response"]}
+            yield {
+                "type": "done",
+                "response": result.get("response", ""),
+                "function_call": result.get("function_call"),
+                "function_calls": result.get("function_calls"),
+                "usage": result.get("usage")
+            }
+            return
+        
+        url, payload = spec
+        self._log_request_details(f"{self.model.provider} (stream)", url, payload, functions)
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        content_parts = []
+        # 工具调用序号 -> {"function": {"name": ..., "arguments": ...}}，参数分多个数据块到达
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        usage = None
+        
+        async with get_provider_semaphore(self.model.provider.lower()):
+            client = get_http_client(url)
+            async with client.stream("POST", url, json=payload, headers=headers, timeout=settings.llm_request_timeout) as response:
+                logger.info(f"📡 响应状态码: {response.status_code}")
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error(f"❌ API 调用失败: {response.text}")
+                response.raise_for_status()
+                
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        logger.warning(f"⚠️ 无法解析的流式数据: {data[:200]}")
+                        continue
+                    
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    
+                    for choice in chunk.get("choices") or []:
+                        delta = choice.get("delta") or {}
+                        if delta.get("content"):
+                            content_parts.append(delta["content"])
+                            yield {"type": "delta", "content": delta["content"]}
+                        
+                        # 函数调用参数分多个数据块到达，按工具调用序号拼接完整后再解析
+                        call_deltas = [(0, delta["function_call"])] if delta.get("function_call") else [
+                            (tool_call.get("index", 0), tool_call.get("function") or {})
+                            for tool_call in delta.get("tool_calls") or []
+                        ]
+                        for index, call_delta in call_deltas:
+                            function = tool_calls.setdefault(index, {"function": {"name": "", "arguments": ""}})["function"]
+                            function["name"] += call_delta.get("name") or ""
+                            function["arguments"] += call_delta.get("arguments") or ""
+        
+        output = {}
+        self._set_tool_calls(output, [tool_calls[index] for index in sorted(tool_calls) if tool_calls[index]["function"]["name"]])
+        if usage:
+            logger.info(f"📊 Token使用: {json.dumps(usage, ensure_ascii=False)}")
+        
+        yield {
+            "type": "done",
+            "response": "".join(content_parts),
+            "function_call": output.get("function_call"),
+            "function_calls": output.get("function_calls"),
+            "usage": usage
+        }
+    
+    async def _call_openai_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -162,7 +359,7 @@ class LLMService:
             "Content-Type": "application/json"
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        response = await self._post(url, json=payload, headers=headers)
         
         # 打印响应状态
         logger.info(f"📡 响应状态码: {response.status_code}")
@@ -189,7 +386,7 @@ class LLMService:
         
         return output
     
-    def _call_qwen_api(
+    async def _call_qwen_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -222,7 +419,7 @@ class LLMService:
             "Content-Type": "application/json"
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        response = await self._post(url, json=payload, headers=headers)
         
         # 打印响应状态
         logger.info(f"📡 响应状态码: {response.status_code}")
@@ -246,18 +443,11 @@ class LLMService:
             logger.info(f"📊 Token使用: {json.dumps(result['usage'], ensure_ascii=False)}")
         
         if message.get("tool_calls"):
-            # 转换为标准格式
-            tool_call = message["tool_calls"][0]
-            output["function_call"] = {
-                "name": tool_call["function"]["name"],
-                "arguments": json.loads(tool_call["function"]["arguments"])
-            }
-            logger.info(f"🔧 Tool Call: {tool_call['function']['name']}")
-            logger.info(f"📝 Arguments: {json.dumps(output['function_call']['arguments'], ensure_ascii=False)}")
+            self._set_tool_calls(output, message["tool_calls"])
         
         return output
     
-    def _call_wenxin_api(
+    async def _call_wenxin_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -279,7 +469,7 @@ class LLMService:
         
         params = {"access_token": self.api_key}
         
-        response = requests.post(url, json=payload, params=params, timeout=60)
+        response = await self._post(url, json=payload, params=params)
         response.raise_for_status()
         
         result = response.json()
@@ -294,7 +484,7 @@ class LLMService:
         
         return output
     
-    def _call_spark_api(
+    async def _call_spark_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -305,7 +495,7 @@ class LLMService:
         # 实际使用应该使用官方 SDK
         raise NotImplementedError("讯飞星火 API 需要使用 WebSocket，请使用官方 SDK")
     
-    def _call_zhipu_api(
+    async def _call_zhipu_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -332,7 +522,7 @@ class LLMService:
             "Content-Type": "application/json"
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        response = await self._post(url, json=payload, headers=headers)
         response.raise_for_status()
         
         result = response.json()
@@ -343,33 +533,29 @@ class LLMService:
         if message.get("content"):
             output["response"] = message["content"]
         if message.get("tool_calls"):
-            tool_call = message["tool_calls"][0]
-            output["function_call"] = {
-                "name": tool_call["function"]["name"],
-                "arguments": json.loads(tool_call["function"]["arguments"])
-            }
+            self._set_tool_calls(output, message["tool_calls"])
         
         return output
     
-    def _call_moonshot_api(
+    async def _call_moonshot_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
         function_call: Optional[str] = None
     ) -> Dict[str, Any]:
         """调用月之暗面 Kimi API（兼容 OpenAI 格式）"""
-        return self._call_openai_api(messages, functions, function_call)
+        return await self._call_openai_api(messages, functions, function_call)
     
-    def _call_deepseek_api(
+    async def _call_deepseek_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
         function_call: Optional[str] = None
     ) -> Dict[str, Any]:
         """调用 DeepSeek API（兼容 OpenAI 格式）"""
-        return self._call_openai_api(messages, functions, function_call)
+        return await self._call_openai_api(messages, functions, function_call)
     
-    def _call_doubao_api(
+    async def _call_doubao_api(
         self,
         messages: List[Dict[str, str]],
         functions: Optional[List[Dict[str, Any]]] = None,
@@ -391,9 +577,9 @@ class LLMService:
         payload = {
             "model": self.model.name,
             "messages": messages,
-            "temperature": float(self.model.temperature) if self.model.temperature else 0.7,
-            "max_tokens": int(self.model.max_tokens) if self.model.max_tokens else 2000,
-            "top_p": float(self.model.top_p) if self.model.top_p else 0.9
+            "temperature": float(self.temperature) if self.temperature else 0.7,
+            "max_tokens": int(self.max_tokens) if self.max_tokens else 2000,
+            "top_p": float(self.top_p) if self.top_p else 0.9
         }
         
         if functions:
@@ -411,7 +597,7 @@ class LLMService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=60)
+            response = await self._post(url, json=payload, headers=headers)
             
             # 打印响应状态
             logger.info(f"📡 响应状态码: {response.status_code}")
@@ -438,18 +624,11 @@ class LLMService:
                 logger.info(f"📊 Token使用: {json.dumps(result['usage'], ensure_ascii=False)}")
             
             if message.get("tool_calls"):
-                # 转换为标准格式
-                tool_call = message["tool_calls"][0]
-                output["function_call"] = {
-                    "name": tool_call["function"]["name"],
-                    "arguments": json.loads(tool_call["function"]["arguments"])
-                }
-                logger.info(f"🔧 Tool Call: {tool_call['function']['name']}")
-                logger.info(f"📝 Arguments: {json.dumps(output['function_call']['arguments'], ensure_ascii=False)}")
+                self._set_tool_calls(output, message["tool_calls"])
             
             return output
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"❌ 请求异常:")
             logger.error(f"  Error: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
@@ -184,16 +184,22 @@ class MQTTService:
         try:
             db = SessionLocal()
             
-            # 查找设备 - 使用uuid字段，并预加载产品信息
+            # 查找设备 - 未注册设备由注册表缓存直接过滤，已知设备按主键加载并预加载产品信息
             from sqlalchemy.orm import joinedload
-            device = db.query(Device).options(joinedload(Device.product)).filter(Device.uuid == device_uuid).first()
+            from app.core.device_registry import device_registry
+            entry = device_registry.get_by_uuid(db, device_uuid)
+            device = None
+            if entry:
+                device = db.query(Device).options(joinedload(Device.product)).filter(Device.id == entry.id).first()
             if not device:
                 logger.warning(f"⚠️ 未找到设备: {device_uuid}")
                 return
             
             logger.info(f"🔧 找到设备: {device.device_id}, 准备处理消息类型: {message_type}")
             
-            # 更新设备最后在线时间和在线状态（北京时间）
+            # 更新设备最后在线时间和在线状态（北京时间），丢弃心跳接口尚未写入的心跳
+            from app.services.device_heartbeat import heartbeat_write_behind
+            heartbeat_write_behind.discard(device_uuid)
             device.last_seen = get_beijing_now()
             device.is_online = True  # 收到任何消息都表示设备在线
             
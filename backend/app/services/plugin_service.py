@@ -4,10 +4,46 @@
 """
 
 import json
-import requests
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.core.http_client import get_http_client
 from app.models.plugin import Plugin
 
+logger = logging.getLogger(__name__)
+
+# (事件循环ID, 插件ID) -> (事件循环, 信号量)
+_plugin_semaphores: Dict[Tuple[int, Any, int], Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+
+
+def get_plugin_semaphore(plugin_id: Any, limit: int) -> asyncio.Semaphore:
+    """
+    获取插件的并发信号量（必须在事件循环中调用）
+    
+    上限由插件 OpenAPI 规范的 x-max-concurrency 指定，未指定时使用 PLUGIN_MAX_CONCURRENCY。
+    信号量绑定事件循环，与共享HTTP客户端一样按事件循环分别创建；
+    上限也是键的一部分，修改插件的 x-max-concurrency 后使用新的信号量。
+    """
+    loop = asyncio.get_running_loop()
+    
+    for key in [key for key, (owner, _) in _plugin_semaphores.items() if owner.is_closed()]:
+        del _plugin_semaphores[key]
+    
+    limit = max(1, int(limit))
+    key = (id(loop), plugin_id, limit)
+    entry = _plugin_semaphores.get(key)
+    if entry is None:
+        # 移除该插件旧上限的信号量（正在使用的调用持有引用，不受影响）
+        for stale in [k for k in _plugin_semaphores if k[:2] == key[:2]]:
+            del _plugin_semaphores[stale]
+        entry = (loop, asyncio.Semaphore(limit))
+        _plugin_semaphores[key] = entry
+    return entry[1]
+
 
 class PluginService:
     """插件服务"""
@@ -33,6 +69,9 @@ class PluginService:
             paths = spec.get("paths", {})
             servers = spec.get("servers", [])
             base_url = servers[0]["url"] if servers else ""
+            # 插件级调用限制（OpenAPI 扩展字段），接口级 x-timeout 可覆盖
+            plugin_timeout = spec.get("x-timeout", settings.plugin_request_timeout)
+            max_concurrency = spec.get("x-max-concurrency", settings.plugin_max_concurrency)
             
             for path, methods in paths.items():
                 for method, details in methods.items():
@@ -52,7 +91,9 @@ class PluginService:
                             "plugin_name": plugin.name,
                             "method": method.upper(),
                             "path": path,
-                            "base_url": base_url
+                            "base_url": base_url,
+                            "timeout": details.get("x-timeout", plugin_timeout),
+                            "max_concurrency": max_concurrency
                         }
                     }
                     
@@ -88,13 +129,13 @@ class PluginService:
         return functions
     
     @staticmethod
-    def call_function(
+    async def call_function(
         function_name: str,
         arguments: Dict[str, Any],
         functions: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """
-        调用插件函数
+        调用插件函数（通过共享连接池异步发送请求，受插件超时和并发上限约束）
         
         Args:
             function_name: 函数名称
@@ -118,6 +159,10 @@ class PluginService:
         method = metadata["method"]
         path = metadata["path"]
         base_url = metadata["base_url"]
+        timeout = float(metadata.get("timeout") or settings.plugin_request_timeout)
+        
+        if method not in ["GET", "POST", "PUT", "DELETE", "PATCH"]:
+            return {"error": f"不支持的 HTTP 方法: {method}"}
         
         # 构建完整 URL
         url = f"{base_url}{path}"
@@ -143,18 +188,23 @@ class PluginService:
         
         try:
             # 发送请求
-            if method == "GET":
-                response = requests.get(url, params=query_params, timeout=30)
-            elif method == "POST":
-                response = requests.post(url, json=body_params, timeout=30)
-            elif method == "PUT":
-                response = requests.put(url, json=body_params, timeout=30)
-            elif method == "DELETE":
-                response = requests.delete(url, params=query_params, timeout=30)
-            elif method == "PATCH":
-                response = requests.patch(url, json=body_params, timeout=30)
+            semaphore = get_plugin_semaphore(
+                metadata.get("plugin_id"),
+                metadata.get("max_concurrency") or settings.plugin_max_concurrency
+            )
+            if method in ["GET", "DELETE"]:
+                request_kwargs = {"params": query_params}
             else:
-                return {"error": f"不支持的 HTTP 方法: {method}"}
+                request_kwargs = {"json": body_params}
+            async with semaphore:
+                # httpx 的超时按单次读写计算，外层再限制整个请求的总耗时；
+                # httpx 默认不跟随重定向，与原 requests 行为保持一致需显式开启
+                response = await asyncio.wait_for(
+                    get_http_client(url).request(
+                        method, url, timeout=timeout, follow_redirects=True, **request_kwargs
+                    ),
+                    timeout
+                )
             
             response.raise_for_status()
             
@@ -172,7 +222,13 @@ class PluginService:
                     "status_code": response.status_code
                 }
         
-        except requests.exceptions.RequestException as e:
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            logger.warning(f"⏱️ 插件调用超时: {function_name} ({timeout}秒)")
+            return {
+                "success": False,
+                "error": f"插件调用超时（{timeout}秒）"
+            }
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
             return {
                 "success": False,
                 "error": str(e)
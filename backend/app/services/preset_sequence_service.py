@@ -3,12 +3,10 @@
 支持多指令配合执行，如LED打开后延迟5秒再关闭
 """
 import asyncio
-import json
 import logging
 import time
 from typing import List, Dict, Any, Optional
-import paho.mqtt.client as mqtt
-from app.core.config import settings
+from app.core.mqtt_publisher import get_mqtt_publisher, MQTTPublishError
 
 logger = logging.getLogger(__name__)
 
@@ -44,8 +42,7 @@ class PresetSequenceService:
         if not steps:
             raise ValueError("指令序列不能为空")
         
-        if not mqtt_service.client or not mqtt_service.is_connected:
-            raise RuntimeError("MQTT服务未连接")
+        publisher = get_mqtt_publisher()
         
         control_topic = f"devices/{device_uuid}/control"
         executed_steps = []
@@ -93,42 +90,41 @@ class PresetSequenceService:
                     # 移除 device_type
                     converted_command.pop("device_type", None)
                 
-                # 发送MQTT消息
+                # 发送MQTT消息（等待Broker确认）
                 try:
-                    message = json.dumps(converted_command)
-                    result = mqtt_service.client.publish(control_topic, message, qos=1)
+                    await publisher.publish_async(control_topic, converted_command, qos=1)
                     
-                    if result.rc == 0:
-                        logger.info(
-                            f"✅ 步骤 {index}/{len(steps)} 执行成功 - "
-                            f"设备: {device_uuid}, 命令: {converted_command}"
-                        )
-                        
-                        # 获取延迟时间（秒）- 执行完当前步骤后等待的时间
-                        delay = step.get("delay", 0)
-                        
-                        executed_steps.append({
-                            "step": index,
-                            "command": converted_command,
-                            "delay": delay,
-                            "status": "success"
-                        })
-                        
-                        # 如果不是最后一步，执行延迟（执行完当前步骤后等待）
-                        if index < len(steps) and delay > 0:
-                            logger.info(f"⏳ 步骤 {index} 执行完成，等待 {delay} 秒后执行下一步...")
-                            await asyncio.sleep(delay)
-                    else:
-                        error_msg = f"步骤 {index} MQTT消息发送失败"
-                        logger.error(error_msg)
-                        errors.append({"step": index, "error": error_msg})
-                        executed_steps.append({
-                            "step": index,
-                            "command": converted_command,
-                            "delay": step.get("delay", 0),
-                            "status": "failed",
-                            "error": error_msg
-                        })
+                    logger.info(
+                        f"✅ 步骤 {index}/{len(steps)} 执行成功 - "
+                        f"设备: {device_uuid}, 命令: {converted_command}"
+                    )
+                    
+                    # 获取延迟时间（秒）- 执行完当前步骤后等待的时间
+                    delay = step.get("delay", 0)
+                    
+                    executed_steps.append({
+                        "step": index,
+                        "command": converted_command,
+                        "delay": delay,
+                        "status": "success"
+                    })
+                    
+                    # 如果不是最后一步，执行延迟（执行完当前步骤后等待）
+                    if index < len(steps) and delay > 0:
+                        logger.info(f"⏳ 步骤 {index} 执行完成，等待 {delay} 秒后执行下一步...")
+                        await asyncio.sleep(delay)
+                
+                except MQTTPublishError as e:
+                    error_msg = f"步骤 {index} MQTT消息发送失败: {str(e)}"
+                    logger.error(error_msg)
+                    errors.append({"step": index, "error": error_msg})
+                    executed_steps.append({
+                        "step": index,
+                        "command": converted_command,
+                        "delay": step.get("delay", 0),
+                        "status": "failed",
+                        "error": error_msg
+                    })
                         
                 except Exception as e:
                     error_msg = f"步骤 {index} 执行失败: {str(e)}"
@@ -0,0 +1,174 @@
+"""
+传感器历史数据查询
+数据由 mqtt-service 写入（原始分段 + 分钟/小时聚合），按时间范围选择数据来源：
+- raw：解码原始分段，返回每个数据点
+- 1m / 1h：读取预聚合表，返回每个时间桶的最小/最大/平均值和点数
+- auto：2 小时以内用原始数据，2 天以内用分钟聚合，更长用小时聚合
+
+所有时间均为北京时间（不带时区）。mqtt-service 在内存中攒满一段（默认 5 分钟）后才写入，
+最近几分钟的数据可能尚未出现在历史中，最新值请使用 sensor-data 接口或实时推送。
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.device_sensor_history import DeviceSensorSegment, DeviceSensorRollup1m, DeviceSensorRollup1h
+from app.utils.timeseries_codec import datetime_to_ms, decode_timestamps, decode_values, ms_to_datetime
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = ("auto", "raw", "1m", "1h")
+
+ROLLUP_MODELS = {
+    "1m": DeviceSensorRollup1m,
+    "1h": DeviceSensorRollup1h,
+}
+
+# auto 模式下各数据来源适用的最长时间范围
+AUTO_RAW_MAX_RANGE = timedelta(hours=2)
+AUTO_1M_MAX_RANGE = timedelta(days=2)
+# 显式查询原始数据的最长时间范围（原始分段需全部解码后才能截断，范围过大时占用大量内存）
+RAW_MAX_RANGE = AUTO_1M_MAX_RANGE
+
+
+def choose_resolution(start: datetime, end: datetime) -> str:
+    span = end - start
+    if span <= AUTO_RAW_MAX_RANGE:
+        return "raw"
+    if span <= AUTO_1M_MAX_RANGE:
+        return "1m"
+    return "1h"
+
+
+def _query_raw(
+    db: Session,
+    device_uuid: str,
+    sensor_names: Optional[List[str]],
+    start: datetime,
+    end: datetime
+) -> Dict[str, List[Dict[str, Any]]]:
+    query = db.query(DeviceSensorSegment).filter(
+        DeviceSensorSegment.device_uuid == device_uuid,
+        # day 是分区键，限定日期范围以便只扫描相关分区
+        DeviceSensorSegment.day >= start.date(),
+        DeviceSensorSegment.day <= end.date(),
+        DeviceSensorSegment.start_time <= end,
+        DeviceSensorSegment.end_time >= start
+    )
+    if sensor_names:
+        query = query.filter(DeviceSensorSegment.sensor_name.in_(sensor_names))
+
+    start_ms = datetime_to_ms(start)
+    end_ms = datetime_to_ms(end)
+    series: Dict[str, List[tuple]] = {}
+    for segment in query.order_by(DeviceSensorSegment.start_time):
+        try:
+            timestamps = decode_timestamps(segment.ts_blob)
+            values = decode_values(segment.value_blob)
+        except (ValueError, IndexError) as e:
+            logger.warning(f"⚠️ 跳过无法解码的历史数据分段 {segment.id}: {e}")
+            continue
+        points = series.setdefault(segment.sensor_name, [])
+        points.extend(
+            (timestamp, value) for timestamp, value in zip(timestamps, values)
+            if start_ms <= timestamp <= end_ms
+        )
+
+    # 分段之间可能有时间重叠（设备时间戳乱序），按时间排序
+    return {
+        sensor_name: [
+            {"time": ms_to_datetime(timestamp).isoformat(), "value": value}
+            for timestamp, value in sorted(points)
+        ]
+        for sensor_name, points in series.items()
+    }
+
+
+def _query_rollups(
+    db: Session,
+    resolution: str,
+    device_uuid: str,
+    sensor_names: Optional[List[str]],
+    start: datetime,
+    end: datetime
+) -> Dict[str, List[Dict[str, Any]]]:
+    model = ROLLUP_MODELS[resolution]
+    # 包含 start 所在的时间桶
+    if resolution == "1m":
+        bucket_from = start.replace(second=0, microsecond=0)
+    else:
+        bucket_from = start.replace(minute=0, second=0, microsecond=0)
+
+    query = db.query(model).filter(
+        model.device_uuid == device_uuid,
+        model.day >= bucket_from.date(),
+        model.day <= end.date(),
+        model.bucket_start >= bucket_from,
+        model.bucket_start <= end
+    )
+    if sensor_names:
+        query = query.filter(model.sensor_name.in_(sensor_names))
+
+    series: Dict[str, List[Dict[str, Any]]] = {}
+    for row in query.order_by(model.sensor_name, model.bucket_start):
+        series.setdefault(row.sensor_name, []).append({
+            "time": row.bucket_start.isoformat(),
+            "min": row.min_value,
+            "max": row.max_value,
+            "avg": row.sum_value / row.point_count if row.point_count else None,
+            "count": row.point_count,
+        })
+    return series
+
+
+def query_sensor_history(
+    db: Session,
+    device_uuid: str,
+    start: datetime,
+    end: datetime,
+    sensor_names: Optional[List[str]] = None,
+    resolution: str = "auto",
+    max_points: int = 10000
+) -> Dict[str, Any]:
+    """
+    查询设备传感器历史数据
+
+    Args:
+        db: 数据库会话
+        device_uuid: 设备UUID
+        start: 开始时间（北京时间，不带时区）
+        end: 结束时间（北京时间，不带时区）
+        sensor_names: 传感器名称列表（为空则返回全部传感器）
+        resolution: auto / raw / 1m / 1h
+        max_points: 每个传感器最多返回的点数（超出部分截断，保留最新的数据）
+
+    Returns:
+        Dict: {"resolution", "start", "end", "sensors": {传感器名: [数据点]}, "truncated"}
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"不支持的数据精度: {resolution}")
+    if resolution == "auto":
+        resolution = choose_resolution(start, end)
+    if resolution == "raw" and end - start > RAW_MAX_RANGE:
+        raise ValueError(f"原始数据查询的时间范围不能超过 {RAW_MAX_RANGE.days} 天，请使用 1m / 1h 聚合数据")
+
+    if resolution == "raw":
+        sensors = _query_raw(db, device_uuid, sensor_names, start, end)
+    else:
+        sensors = _query_rollups(db, resolution, device_uuid, sensor_names, start, end)
+
+    truncated = False
+    for sensor_name, points in sensors.items():
+        if len(points) > max_points:
+            sensors[sensor_name] = points[-max_points:]
+            truncated = True
+
+    return {
+        "resolution": resolution,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "sensors": sensors,
+        "truncated": truncated,
+    }
@@ -0,0 +1,237 @@
+"""
+设备数据实时推送
+mqtt-service 每个写入批次提交后把设备增量发布到 Redis 频道，本模块订阅该频道并分发给
+WebSocket/SSE 连接，替代前端和插件服务对 realtime-data / sensor-data 的轮询：
+- 每个进程只有一个 Redis 订阅连接（首个订阅者出现时建立），按设备索引分发给订阅者
+- 服务端合并：同一订阅者在推送间隔内收到的多次更新按设备合并，每个间隔最多推送一帧
+- 进程内也可直接调用 publish() 分发（不经过 Redis）
+"""
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Optional, Set
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis 订阅断开后的重连间隔（秒）
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+
+def parse_sensor_value(value: Any) -> Any:
+    """数据库中的传感器值为字符串，尽量还原为数字/布尔"""
+    if not isinstance(value, str):
+        return value
+    v = value.strip()
+    if v.lower() in ["true", "false"]:
+        return v.lower() == "true"
+    try:
+        if "." in v:
+            return float(v)
+        return int(v)
+    except ValueError:
+        return value
+
+
+def merge_update(target: Dict[str, Any], update: Dict[str, Any]):
+    """把一次设备更新合并到待推送数据（传感器和状态按键合并，其余字段覆盖）"""
+    for key, value in update.items():
+        if key in ("sensors", "status") and isinstance(value, dict):
+            target.setdefault(key, {}).update(value)
+        else:
+            target[key] = value
+
+
+class SensorSubscription:
+    """一个 WebSocket/SSE 连接的订阅（设备集合 + 待推送的合并数据）"""
+
+    def __init__(self, hub: "SensorPushHub", interval: float):
+        self.hub = hub
+        self.interval = interval
+        self.device_uuids: Set[str] = set()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._event = asyncio.Event()
+        self._last_frame = 0.0
+        self.updates = 0
+        self.frames = 0
+
+    def push(self, device_uuid: str, update: Dict[str, Any]):
+        merge_update(self._pending.setdefault(device_uuid, {}), update)
+        self.updates += 1
+        self._event.set()
+
+    async def next_frame(self, timeout: Optional[float] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        等待下一帧（距上一帧不足推送间隔时先等待，期间的更新合并到同一帧）
+
+        Args:
+            timeout: 最长等待时间（秒），超时无更新返回None（调用方用于发送心跳）
+
+        Returns:
+            Optional[Dict[str, Dict[str, Any]]]: 设备UUID -> 合并后的增量
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        delay = self._last_frame + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        frame, self._pending = self._pending, {}
+        self._event.clear()
+        self._last_frame = time.monotonic()
+        if not frame:
+            return None
+        self.frames += 1
+        return frame
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class SensorPushHub:
+    """设备数据推送中心（每个进程一个实例，在事件循环中使用）"""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        # 设备UUID -> 订阅者
+        self._subscribers: Dict[str, Set[SensorSubscription]] = {}
+        self._subscriptions: Set[SensorSubscription] = set()
+        self._listener: Optional[asyncio.Task] = None
+        self._redis = None
+        self.stats = {
+            'messages': 0,
+            'device_updates': 0,
+            'deliveries': 0,
+            'redis_errors': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # 订阅管理
+    # ------------------------------------------------------------------
+
+    def subscribe(self, interval: Optional[float] = None) -> SensorSubscription:
+        """创建订阅（首个订阅者出现时启动 Redis 监听）"""
+        interval = settings.sensor_push_interval if interval is None else interval
+        interval = min(max(interval, settings.sensor_push_min_interval), settings.sensor_push_max_interval)
+        subscription = SensorSubscription(self, interval)
+        self._subscriptions.add(subscription)
+        self._ensure_listener()
+        return subscription
+
+    def add_devices(self, subscription: SensorSubscription, device_uuids: Iterable[str]):
+        for device_uuid in device_uuids:
+            subscription.device_uuids.add(device_uuid)
+            self._subscribers.setdefault(device_uuid, set()).add(subscription)
+
+    def remove_devices(self, subscription: SensorSubscription, device_uuids: Iterable[str]):
+        for device_uuid in device_uuids:
+            subscription.device_uuids.discard(device_uuid)
+            subscribers = self._subscribers.get(device_uuid)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[device_uuid]
+
+    def unsubscribe(self, subscription: SensorSubscription):
+        self.remove_devices(subscription, list(subscription.device_uuids))
+        self._subscriptions.discard(subscription)
+
+    # ------------------------------------------------------------------
+    # 分发
+    # ------------------------------------------------------------------
+
+    def publish(self, updates: Dict[str, Dict[str, Any]]):
+        """把一批设备更新分发给订阅了这些设备的连接"""
+        self.stats['device_updates'] += len(updates)
+        for device_uuid, update in updates.items():
+            for subscription in self._subscribers.get(device_uuid, ()):
+                subscription.push(device_uuid, update)
+                self.stats['deliveries'] += 1
+
+    def _handle_message(self, data: Any):
+        try:
+            message = json.loads(data)
+            updates = message.get("devices") or {}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"⚠️ 忽略无法解析的设备推送消息: {e}")
+            return
+        self.stats['messages'] += 1
+        if isinstance(updates, dict):
+            self.publish(updates)
+
+    # ------------------------------------------------------------------
+    # Redis 订阅
+    # ------------------------------------------------------------------
+
+    def _ensure_listener(self):
+        if not settings.sensor_push_redis_enabled:
+            return
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        """订阅 Redis 频道，断开后按退避间隔重连"""
+        import redis.asyncio as aioredis
+
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            pubsub = None
+            try:
+                if self._redis is None:
+                    # 独立连接：订阅连接长时间阻塞读取，不能使用带短读超时的共享客户端
+                    self._redis = aioredis.from_url(
+                        settings.redis_url,
+                        socket_connect_timeout=3,
+                        health_check_interval=30
+                    )
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                logger.info(f"📡 已订阅设备推送频道: {self.channel}")
+                delay = RECONNECT_MIN_DELAY
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._handle_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['redis_errors'] += 1
+                logger.warning(f"⚠️ 设备推送频道订阅中断，{delay}秒后重连: {e}")
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def stop(self):
+        """停止 Redis 订阅（应用关闭时调用）"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+        if self._redis is not None:
+            try:
+                await self._redis.close()
+            except Exception as e:
+                logger.warning(f"⚠️ 关闭设备推送Redis连接失败: {e}")
+            self._redis = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'listening': self._listener is not None and not self._listener.done(),
+            'subscriptions': len(self._subscriptions),
+            'devices': len(self._subscribers),
+        }
+
+
+# 全局设备数据推送中心
+sensor_push_hub = SensorPushHub(channel=settings.sensor_push_channel)
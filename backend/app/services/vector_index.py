@@ -0,0 +1,580 @@
+"""
+知识库向量索引服务
+为每个知识库维护一个 IVF（倒排聚类）近似最近邻索引：
+- 从 kb_document_chunks 中已存储的向量构建，持久化到磁盘，进程重启后直接加载
+- 文档向量化完成后增量更新，无需全量重建
+- 文本块较少或显式要求时回退到精确检索
+"""
+import os
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.document import DocumentChunk
+from app.utils.embedding_codec import decode_embeddings, embedding_dimension
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境无文件锁，仅依赖进程内锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 索引持久化目录（默认放在知识库存储目录下，便于 backend 与 celery worker 共享）
+INDEX_DIR = Path(os.getenv(
+    'VECTOR_INDEX_STORAGE',
+    str(Path(os.getenv('KNOWLEDGE_BASE_STORAGE', 'data/knowledge-bases')) / '_vector_index')
+))
+if not INDEX_DIR.is_absolute():
+    backend_dir = Path(__file__).parent.parent.parent  # 从 app/services/vector_index.py 到 backend/
+    INDEX_DIR = backend_dir / INDEX_DIR
+
+# K-Means 训练参数
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+
+
+def chunk_signatures(kb_ids: List[int], db: Session) -> Dict[int, Tuple[int, int]]:
+    """
+    查询各知识库文本块的 (数量, 最大ID)
+
+    索引构建时记录该签名，检索前比对，不一致说明有文本块新增或删除（包括其他进程写入），需要重新加载。
+    """
+    rows = db.query(
+        DocumentChunk.knowledge_base_id,
+        func.count(DocumentChunk.id),
+        func.max(DocumentChunk.id)
+    ).filter(
+        DocumentChunk.knowledge_base_id.in_(kb_ids)
+    ).group_by(DocumentChunk.knowledge_base_id).all()
+    return {kb_id: (int(count), int(max_id or 0)) for kb_id, count, max_id in rows}
+
+
+@contextmanager
+def index_file_lock(lock_path: Path):
+    """跨进程文件锁，避免多个 worker 同时增量更新同一索引文件时互相覆盖"""
+    if fcntl is None:
+        yield
+        return
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行L2归一化（零向量保持为零）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回最大的k个元素下标（降序）：argpartition O(n) 选出候选后只对k个元素排序"""
+    if k >= scores.shape[0]:
+        return np.argsort(scores)[::-1]
+    candidates = np.argpartition(scores, -k)[-k:]
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def _to_similarity(cosine: np.ndarray) -> np.ndarray:
+    """余弦相似度映射到0-1，与 EmbeddingService.calculate_similarity 保持一致"""
+    return (cosine + 1.0) / 2.0
+
+
+class KnowledgeBaseIndex:
+    """
+    单个知识库的向量索引
+
+    向量按行存储为L2归一化的 float32 矩阵，chunk_ids / document_ids 为平行数组。
+    训练后每个向量被分配到最近的聚类中心，检索时只扫描与查询最接近的 nprobe 个聚类。
+    """
+
+    def __init__(self, kb_id: int, dimension: int):
+        self.kb_id = kb_id
+        self.dimension = dimension
+        self.chunk_ids = np.empty(0, dtype=np.int64)
+        self.document_ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        # 构建时数据库中该知识库文本块的 (数量, 最大ID)，用于判断索引是否过期
+        self.signature: Tuple[int, int] = (0, 0)
+        self._lists: Optional[List[np.ndarray]] = None
+
+    @property
+    def size(self) -> int:
+        return int(self.chunk_ids.shape[0])
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def copy(self) -> 'KnowledgeBaseIndex':
+        """
+        浅拷贝索引
+
+        写入方法（add / remove_documents / train）都替换数组而不原地修改，
+        修改拷贝不会影响正在检索原索引的其他线程。
+        """
+        clone = KnowledgeBaseIndex.__new__(KnowledgeBaseIndex)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def add(self, chunk_ids: np.ndarray, document_ids: np.ndarray, vectors: np.ndarray):
+        """追加向量（如已训练则直接分配到最近的聚类）"""
+        if chunk_ids.size == 0:
+            return
+        vectors = _normalize_rows(vectors)
+        self.vectors = np.concatenate([self.vectors, vectors]) if self.size else vectors
+        self.chunk_ids = np.concatenate([self.chunk_ids, chunk_ids.astype(np.int64)])
+        self.document_ids = np.concatenate([self.document_ids, document_ids.astype(np.int64)])
+        if self.is_trained:
+            self.assignments = np.concatenate([self.assignments, self._assign(vectors)])
+        self._lists = None
+
+    def remove_documents(self, document_ids: List[int]) -> int:
+        """移除指定文档的全部向量，返回移除数量"""
+        if self.size == 0 or not document_ids:
+            return 0
+        keep = ~np.isin(self.document_ids, np.asarray(document_ids, dtype=np.int64))
+        removed = int(self.size - keep.sum())
+        if removed:
+            self.chunk_ids = self.chunk_ids[keep]
+            self.document_ids = self.document_ids[keep]
+            self.vectors = self.vectors[keep]
+            if self.is_trained:
+                self.assignments = self.assignments[keep]
+            self._lists = None
+        return removed
+
+    # ------------------------------------------------------------------
+    # 训练
+    # ------------------------------------------------------------------
+
+    def needs_training(self, min_ann_size: int) -> bool:
+        """数据量达到阈值且未训练，或相对上次训练增长一倍以上时需要（重新）训练"""
+        if self.size < min_ann_size:
+            return False
+        return not self.is_trained or self.size >= self.trained_size * 2
+
+    def train(self):
+        """球面 K-Means 训练聚类中心，并重新分配全部向量"""
+        n = self.size
+        nlist = int(min(1024, max(16, np.sqrt(n))))
+        rng = np.random.default_rng(self.kb_id)
+
+        sample_size = min(n, nlist * KMEANS_SAMPLES_PER_LIST)
+        sample = self.vectors[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # 空聚类保留原中心，避免中心退化
+            sums[empty] = centroids[empty]
+            centroids = _normalize_rows(sums)
+
+        self.centroids = centroids
+        self.assignments = self._assign(self.vectors)
+        self.trained_size = n
+        self._lists = None
+        logger.info(f"🔧 知识库 {self.kb_id} 向量索引训练完成: {n} 个向量, {nlist} 个聚类")
+
+    def _assign(self, vectors: np.ndarray, batch: int = 8192) -> np.ndarray:
+        """将向量分配到最近的聚类中心（分批计算，限制内存峰值）"""
+        out = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], batch):
+            out[start:start + batch] = np.argmax(vectors[start:start + batch] @ self.centroids.T, axis=1)
+        return out
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        """聚类ID -> 行号数组（惰性构建，写入后失效）"""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            bounds = np.searchsorted(self.assignments[order], np.arange(self.centroids.shape[0] + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.centroids.shape[0])]
+        return self._lists
+
+    # ------------------------------------------------------------------
+    # 检索
+    # ------------------------------------------------------------------
+
+    def search(self, query: np.ndarray, top_k: int, nprobe: int, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        检索最相似的 top_k 个文本块
+
+        Args:
+            query: 已L2归一化的查询向量
+            top_k: 返回数量
+            nprobe: 探查的聚类数
+            exact: 是否强制精确检索
+
+        Returns:
+            (chunk_ids, scores): 按相似度降序排列，scores 为0-1相似度
+        """
+        if self.size == 0 or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if exact or not self.is_trained:
+            rows = None
+            cosine = self.vectors @ query
+        else:
+            probe = _top_k_indices(self.centroids @ query, nprobe)
+            lists = self._inverted_lists()
+            rows = np.concatenate([lists[i] for i in probe])
+            cosine = self.vectors[rows] @ query
+
+        k = min(top_k, cosine.shape[0])
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        order = _top_k_indices(cosine, k)
+        picked = order if rows is None else rows[order]
+        return self.chunk_ids[picked], _to_similarity(cosine[order])
+
+    # ------------------------------------------------------------------
+    # 持久化
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path):
+        """原子写入磁盘（先写临时文件再替换）"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                dimension=np.int64(self.dimension),
+                chunk_ids=self.chunk_ids,
+                document_ids=self.document_ids,
+                vectors=self.vectors,
+                centroids=self.centroids if self.is_trained else np.empty((0, self.dimension), dtype=np.float32),
+                assignments=self.assignments,
+                trained_size=np.int64(self.trained_size),
+                signature=np.asarray(self.signature, dtype=np.int64),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, kb_id: int, path: Path) -> Optional['KnowledgeBaseIndex']:
+        """从磁盘加载索引（文件不存在或损坏时返回None）"""
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                index = cls(kb_id, int(data['dimension']))
+                index.chunk_ids = data['chunk_ids']
+                index.document_ids = data['document_ids']
+                index.vectors = data['vectors']
+                centroids = data['centroids']
+                index.centroids = centroids if centroids.shape[0] > 0 else None
+                index.assignments = data['assignments']
+                index.trained_size = int(data['trained_size'])
+                index.signature = tuple(int(x) for x in data['signature'])
+            return index
+        except Exception as e:
+            logger.warning(f"⚠️ 知识库 {kb_id} 向量索引文件损坏，将重新构建: {e}")
+            return None
+
+
+class VectorIndexManager:
+    """
+    知识库向量索引管理器
+
+    每次检索前用一条聚合查询比对数据库中的文本块签名（见 chunk_signatures），
+    与索引构建时的签名不一致时（其他进程写入、删除文档等）依次尝试从磁盘加载、从数据库重建。
+    重建按知识库加锁，不影响其他知识库的检索；重建期间同一知识库的检索继续使用旧索引。
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR):
+        self.index_dir = index_dir
+        self._indexes: Dict[int, KnowledgeBaseIndex] = {}
+        # 全局锁只保护 _indexes / _kb_locks 的读写，不在构建索引期间持有
+        self._lock = threading.Lock()
+        self._kb_locks: Dict[int, threading.Lock] = {}
+
+    def _index_path(self, kb_id: int) -> Path:
+        return self.index_dir / f"kb_{kb_id}.npz"
+
+    def _kb_lock(self, kb_id: int) -> threading.Lock:
+        """知识库级别的锁（加载、重建、增量更新时持有）"""
+        with self._lock:
+            lock = self._kb_locks.get(kb_id)
+            if lock is None:
+                lock = self._kb_locks[kb_id] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _load_vectors(kb_id: int, db: Session, document_id: Optional[int] = None):
+        """
+        从数据库读取向量，返回 (chunk_ids, document_ids, vectors)
+
+        优先读取二进制存储（直接解码为矩阵），再兼容读取尚未迁移的 JSON 向量；
+        维度与第一个向量不一致的文本块会被跳过。
+        """
+        filters = [DocumentChunk.knowledge_base_id == kb_id]
+        if document_id is not None:
+            filters.append(DocumentChunk.document_id == document_id)
+
+        chunk_ids, document_ids = [], []
+        dimension = None
+
+        # 二进制存储
+        blob_rows = []
+        for chunk_id, doc_id, blob, dtype, scale in db.query(
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.embedding_blob,
+            DocumentChunk.embedding_dtype,
+            DocumentChunk.embedding_scale
+        ).filter(*filters, DocumentChunk.embedding_blob.isnot(None)).yield_per(1000):
+            dim = embedding_dimension(blob, dtype)
+            if dimension is None:
+                dimension = dim
+            elif dim != dimension:
+                logger.warning(f"⚠️ 文本块 {chunk_id} 向量维度 {dim} 与 {dimension} 不一致，跳过")
+                continue
+            chunk_ids.append(chunk_id)
+            document_ids.append(doc_id)
+            blob_rows.append((blob, dtype, scale))
+
+        matrices = [decode_embeddings(blob_rows)] if blob_rows else []
+
+        # 旧版 JSON 存储（未迁移的数据）
+        json_vectors = []
+        for chunk_id, doc_id, embedding in db.query(
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.embedding_vector
+        ).filter(
+            *filters,
+            DocumentChunk.embedding_blob.is_(None),
+            DocumentChunk.embedding_vector.isnot(None)
+        ).yield_per(1000):
+            if not embedding:
+                continue
+            if dimension is None:
+                dimension = len(embedding)
+            elif len(embedding) != dimension:
+                logger.warning(f"⚠️ 文本块 {chunk_id} 向量维度 {len(embedding)} 与 {dimension} 不一致，跳过")
+                continue
+            chunk_ids.append(chunk_id)
+            document_ids.append(doc_id)
+            json_vectors.append(embedding)
+
+        if json_vectors:
+            matrices.append(np.asarray(json_vectors, dtype=np.float32))
+
+        if not matrices:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), None
+        return (
+            np.asarray(chunk_ids, dtype=np.int64),
+            np.asarray(document_ids, dtype=np.int64),
+            np.concatenate(matrices) if len(matrices) > 1 else matrices[0],
+        )
+
+    def _build(self, kb_id: int, signature: Tuple[int, int], db: Session) -> Optional[KnowledgeBaseIndex]:
+        """从数据库全量构建索引并持久化"""
+        chunk_ids, document_ids, vectors = self._load_vectors(kb_id, db)
+        if vectors is None:
+            return None
+
+        index = KnowledgeBaseIndex(kb_id, vectors.shape[1])
+        index.add(chunk_ids, document_ids, vectors)
+        if index.needs_training(settings.vector_index_min_ann_size):
+            index.train()
+        index.signature = signature
+        self._persist(index)
+        logger.info(f"✅ 知识库 {kb_id} 向量索引构建完成: {index.size} 个向量")
+        return index
+
+    def _persist(self, index: KnowledgeBaseIndex):
+        try:
+            index.save(self._index_path(index.kb_id))
+        except Exception as e:
+            logger.warning(f"⚠️ 知识库 {index.kb_id} 向量索引持久化失败: {e}")
+
+    def _get_index(self, kb_id: int, signature: Tuple[int, int], db: Session) -> Optional[KnowledgeBaseIndex]:
+        """获取与数据库签名一致的索引：内存 -> 磁盘 -> 重建"""
+        with self._lock:
+            current = self._indexes.get(kb_id)
+        if current is not None and current.signature == signature:
+            return current
+
+        lock = self._kb_lock(kb_id)
+        # 其他线程正在重建时先使用旧索引；没有旧索引才等待
+        if not lock.acquire(blocking=current is None):
+            return current
+        try:
+            with self._lock:
+                index = self._indexes.get(kb_id)
+            # 等待期间可能已由其他线程重建
+            if index is not None and index.signature == signature:
+                return index
+
+            index = KnowledgeBaseIndex.load(kb_id, self._index_path(kb_id))
+            if index is None or index.signature != signature:
+                index = self._build(kb_id, signature, db)
+
+            with self._lock:
+                if index is None:
+                    self._indexes.pop(kb_id, None)
+                else:
+                    self._indexes[kb_id] = index
+            return index
+        finally:
+            lock.release()
+
+    def search(
+        self,
+        query_embedding: List[float],
+        kb_ids: List[int],
+        top_k: int,
+        similarity_threshold: float,
+        db: Session,
+        exact: bool = False
+    ) -> List[Tuple[int, float]]:
+        """
+        在多个知识库中检索最相似的文本块
+
+        Args:
+            query_embedding: 查询向量
+            kb_ids: 知识库ID列表
+            top_k: 返回数量
+            similarity_threshold: 相似度阈值（0-1）
+            db: 数据库会话
+            exact: 是否强制精确检索
+
+        Returns:
+            List[Tuple[int, float]]: (chunk_id, similarity) 列表，按相似度降序
+        """
+        if not kb_ids or not query_embedding:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        exact = exact or not settings.vector_index_enabled
+        signatures = chunk_signatures(kb_ids, db)
+
+        all_ids, all_scores = [], []
+        for kb_id in kb_ids:
+            signature = signatures.get(kb_id)
+            if signature is None:
+                continue
+            index = self._get_index(kb_id, signature, db)
+            if index is None:
+                continue
+            if index.dimension != query.shape[0]:
+                logger.warning(f"⚠️ 知识库 {kb_id} 向量维度 {index.dimension} 与查询向量 {query.shape[0]} 不一致，跳过")
+                continue
+            ids, scores = index.search(query, top_k, settings.vector_index_nprobe, exact=exact)
+            all_ids.append(ids)
+            all_scores.append(scores)
+
+        if not all_ids:
+            return []
+
+        ids = np.concatenate(all_ids)
+        scores = np.concatenate(all_scores)
+        order = _top_k_indices(scores, top_k)
+        return [
+            (int(ids[i]), float(scores[i]))
+            for i in order
+            if scores[i] >= similarity_threshold
+        ]
+
+    async def search_async(
+        self,
+        query_embedding: List[float],
+        kb_ids: List[int],
+        top_k: int,
+        similarity_threshold: float,
+        exact: bool = False
+    ) -> List[Tuple[int, float]]:
+        """
+        在线程中执行 search()（索引加载、重建不阻塞事件循环），参数同 search()
+
+        数据库会话不能跨线程共享（工作流并行节点共用同一个会话），
+        因此不接收调用方的会话，在线程内使用独立的会话。
+        """
+        def run():
+            from app.core.database import SessionLocal
+            db = SessionLocal()
+            try:
+                return self.search(query_embedding, kb_ids, top_k, similarity_threshold, db, exact=exact)
+            finally:
+                db.close()
+
+        return await asyncio.to_thread(run)
+
+    def refresh_document(self, kb_id: int, document_id: int, db: Session):
+        """
+        按数据库中的最新数据增量更新单个文档的向量（需在事务提交后调用）
+
+        先移除该文档在索引中的旧向量，再读取其当前文本块写入，
+        因此同时适用于文档向量化完成、重新向量化和删除文档。
+        以磁盘上的最新版本为准（其他进程可能已更新），内存和磁盘上都没有索引时跳过，
+        首次检索时会全量构建。内存中的索引可能正被其他线程检索，只修改其拷贝，完成后再替换。
+        """
+        with self._kb_lock(kb_id), index_file_lock(self.index_dir / f"kb_{kb_id}.lock"):
+            index = KnowledgeBaseIndex.load(kb_id, self._index_path(kb_id))
+            if index is None:
+                with self._lock:
+                    cached = self._indexes.get(kb_id)
+                if cached is None:
+                    return
+                index = cached.copy()
+
+            chunk_ids, document_ids, vectors = self._load_vectors(kb_id, db, document_id=document_id)
+            if vectors is not None and vectors.shape[1] != index.dimension:
+                # 向量模型变更，丢弃旧索引，下次检索时重建
+                logger.warning(f"⚠️ 知识库 {kb_id} 向量维度变化，丢弃旧索引")
+                self.invalidate(kb_id)
+                return
+
+            index.remove_documents([document_id])
+            if vectors is not None:
+                index.add(chunk_ids, document_ids, vectors)
+
+            if index.needs_training(settings.vector_index_min_ann_size):
+                index.train()
+            index.signature = chunk_signatures([kb_id], db).get(kb_id, (0, 0))
+            with self._lock:
+                self._indexes[kb_id] = index
+            self._persist(index)
+            logger.info(f"✅ 知识库 {kb_id} 向量索引增量更新: 文档 {document_id}, 当前 {index.size} 个向量")
+
+    def invalidate(self, kb_id: int):
+        """丢弃知识库索引（内存和磁盘）"""
+        with self._lock:
+            self._indexes.pop(kb_id, None)
+        try:
+            self._index_path(kb_id).unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"⚠️ 删除知识库 {kb_id} 向量索引文件失败: {e}")
+
+
+# 全局向量索引管理器
+vector_index_manager = VectorIndexManager()
@@ -1,13 +1,18 @@
 """
 工作流执行引擎
-实现工作流的串行执行逻辑
+按依赖关系调度节点：节点的所有前驱结束后立即执行，相互独立的分支并行运行
+每个节点的执行记录带有追踪信息（排队等待、输入/输出字节数、重试次数，见 workflow_trace）
 """
+import asyncio
 import logging
-import re
 import time
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from app.core.config import settings
 from app.schemas.workflow import WorkflowNode, WorkflowEdge, NodeExecutionResult
+from app.services.workflow_plan import WorkflowPlan, compile_workflow_plan
+from app.services.workflow_template import WorkflowTemplatePlan
+from app.services.workflow_trace import start_span, payload_size
 from app.utils.timezone import get_beijing_time_naive
 
 logger = logging.getLogger(__name__)
@@ -20,6 +25,8 @@ class WorkflowExecutor:
         self.execution_context: Dict[str, Any] = {}
         self.node_results: Dict[str, NodeExecutionResult] = {}
         self.start_time: Optional[datetime] = None
+        self.plan: Optional[WorkflowPlan] = None
+        self.template_plan: Optional[WorkflowTemplatePlan] = None
     
     async def execute(
         self,
@@ -27,7 +34,8 @@ class WorkflowExecutor:
         edges: List[WorkflowEdge],
         input_data: Dict[str, Any],
         config: Optional[Dict[str, Any]] = None,
-        db_session=None
+        db_session=None,
+        plan: Optional[WorkflowPlan] = None
     ) -> Dict[str, Any]:
         """
         执行工作流
@@ -38,6 +46,7 @@ class WorkflowExecutor:
             input_data: 工作流输入参数
             config: 工作流配置
             db_session: 数据库会话
+            plan: 预编译的执行计划（见 workflow_plan，未提供时按节点和边编译）
             
         Returns:
             Dict[str, Any]: 执行结果，包含output和node_executions
@@ -45,84 +54,88 @@ class WorkflowExecutor:
         self.start_time = get_beijing_time_naive()
         self.execution_context = {"input": input_data}
         self.node_results = {}
+        self.plan = plan or compile_workflow_plan(nodes, edges)
+        self.template_plan = self.plan.template_plan
+        
+        config = config or {}
+        continue_on_error = config.get("continue_on_error", False)
+        max_parallelism = max(1, int(config.get("max_parallelism") or settings.workflow_max_parallelism))
         
         try:
             # 1. 初始化执行上下文（包含输入参数）
             logger.info(f"开始执行工作流，输入参数: {input_data}")
             
-            # 2. 计算节点执行顺序（使用拓扑排序）
-            execution_order = self._get_execution_order(nodes, edges)
-            logger.info(f"节点执行顺序: {[node.id for node in execution_order]}")
+            # 2. 拓扑顺序和后继表来自执行计划（用于就绪节点的启动顺序和执行记录排序）
+            execution_order = self.plan.execution_order
+            logger.info(f"节点拓扑顺序: {[node.id for node in execution_order]}")
+            
+            node_dict = self.plan.node_dict
+            position = self.plan.position
+            successors = self.plan.successors
+            pending_inputs = dict(self.plan.in_degree)
+            
+            # 3. 就绪队列调度：前驱全部结束（成功、失败或跳过）的节点进入队列，最多同时执行 max_parallelism 个
+            ready = [node.id for node in execution_order if pending_inputs[node.id] == 0]
+            ready_at = {node_id: time.monotonic() for node_id in ready}
+            running: Dict[asyncio.Task, WorkflowNode] = {}
+            stopped = False
             
-            # 3. 串行执行每个节点（支持条件分支）
-            for node in execution_order:
-                # 检查节点是否应该执行（条件路由）
-                if not self._should_execute_node(node, edges):
-                    logger.info(f"跳过节点: {node.id} ({node.type}) - 条件不满足")
+            def release(node_id: str):
+                for target in successors[node_id]:
+                    pending_inputs[target] -= 1
+                    if pending_inputs[target] == 0:
+                        ready.append(target)
+                        ready_at[target] = time.monotonic()
+                ready.sort(key=position.get)
+            
+            while ready or running:
+                while ready and len(running) < max_parallelism:
+                    node = node_dict[ready.pop(0)]
+                    
+                    # 检查节点是否应该执行（条件路由），前驱都已结束，条件判断结果是确定的
+                    if not self._should_execute_node(node):
+                        logger.info(f"跳过节点: {node.id} ({node.type}) - 条件不满足")
+                        
+                        # 记录跳过的节点
+                        self.node_results[node.id] = NodeExecutionResult(
+                            node_id=node.id,
+                            node_type=node.type,
+                            status="skipped",
+                            output=None,
+                            execution_time=0,
+                            started_at=get_beijing_time_naive(),
+                            completed_at=get_beijing_time_naive()
+                        )
+                        release(node.id)
+                        continue
                     
-                    # 记录跳过的节点
-                    self.node_results[node.id] = NodeExecutionResult(
-                        node_id=node.id,
-                        node_type=node.type,
-                        status="skipped",
-                        output=None,
-                        execution_time=0,
-                        started_at=get_beijing_time_naive(),
-                        completed_at=get_beijing_time_naive()
+                    queue_wait = int((time.monotonic() - ready_at[node.id]) * 1000)
+                    task = asyncio.create_task(
+                        self._run_node(node, db_session, self._get_node_timeout(node, config), queue_wait)
                     )
-                    continue
+                    running[task] = node
                 
-                logger.info(f"执行节点: {node.id} ({node.type})")
-                node_start_time = get_beijing_time_naive()
+                if not running:
+                    break
                 
-                try:
-                    # 执行节点
-                    node_output = await self._execute_node(node, db_session)
-                    
-                    # 保存节点输出到上下文
-                    self.execution_context[node.id] = node_output
-                    
-                    # 记录节点执行结果
-                    node_end_time = get_beijing_time_naive()
-                    execution_time = int((node_end_time - node_start_time).total_seconds() * 1000)
-                    
-                    self.node_results[node.id] = NodeExecutionResult(
-                        node_id=node.id,
-                        node_type=node.type,
-                        status="success",
-                        output=node_output,
-                        execution_time=execution_time,
-                        started_at=node_start_time,
-                        completed_at=node_end_time
-                    )
-                    
-                    logger.info(f"节点 {node.id} 执行成功，耗时 {execution_time}ms")
-                    
-                except Exception as e:
-                    # 节点执行失败
-                    logger.error(f"节点 {node.id} 执行失败: {str(e)}", exc_info=True)
-                    
-                    node_end_time = get_beijing_time_naive()
-                    execution_time = int((node_end_time - node_start_time).total_seconds() * 1000)
-                    
-                    self.node_results[node.id] = NodeExecutionResult(
-                        node_id=node.id,
-                        node_type=node.type,
-                        status="failed",
-                        error_message=str(e),
-                        execution_time=execution_time,
-                        started_at=node_start_time,
-                        completed_at=node_end_time
-                    )
-                    
-                    # 根据配置决定是否继续执行
-                    continue_on_error = config.get("continue_on_error", False) if config else False
-                    if not continue_on_error:
-                        logger.error(f"节点执行失败，停止工作流执行")
-                        break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node = running.pop(task)
+                    if task.result() or continue_on_error:
+                        release(node.id)
+                    else:
+                        stopped = True
+                
+                if stopped:
+                    # 根据配置停止工作流：取消仍在执行的节点，不再启动新节点
+                    logger.error(f"节点执行失败，停止工作流执行")
+                    await self._cancel_running(running)
+                    break
+            
+            self.node_results = dict(sorted(self.node_results.items(), key=lambda item: position[item[0]]))
             
             # 4. 收集最终输出（结束节点的输出）
-            end_node = next((node for node in nodes if node.type == "end"), None)
+            end_node = self.plan.end_node
             if end_node and end_node.id in self.execution_context:
                 final_output = self.execution_context[end_node.id]
             else:
@@ -143,107 +156,127 @@ class WorkflowExecutor:
             logger.error(f"工作流执行异常: {str(e)}", exc_info=True)
             raise
     
-    def _replace_variables(self, text: str) -> str:
+    def _get_node_timeout(self, node: WorkflowNode, config: Dict[str, Any]) -> float:
+        """节点执行超时（秒）：节点配置 node_timeout > 工作流配置 node_timeout > 全局默认值"""
+        node_data = node.data or {}
+        return float(node_data.get("node_timeout") or config.get("node_timeout") or settings.workflow_node_timeout)
+    
+    def _get_node_input_size(self, node: WorkflowNode) -> int:
+        """节点输入字节数：前驱节点的输出之和，开始节点为工作流输入"""
+        incoming_edges = self.plan.incoming_edges.get(node.id)
+        if not incoming_edges:
+            return payload_size(self.execution_context.get("input"))
+        sources = {edge.source for edge, _ in incoming_edges}
+        return sum(payload_size(self.execution_context.get(source)) for source in sources)
+    
+    async def _run_node(self, node: WorkflowNode, db_session, timeout: float, queue_wait: int = 0) -> bool:
         """
-        变量替换，支持以下格式：
-        - {node_id} - 引用节点输出
-        - {node_id.field} - 引用节点输出的特定字段
-        - {input.param} - 引用工作流输入参数
+        执行单个节点并记录结果（含追踪信息）
         
-        Args:
-            text: 待替换的文本
-            
         Returns:
-            str: 替换后的文本
+            bool: 节点是否执行成功
         """
-        if not isinstance(text, str):
-            return text
-        
-        # 匹配变量：{node_id} 或 {node_id.field} 或 {input.param}
-        pattern = r'\{([^}]+)\}'
+        logger.info(f"执行节点: {node.id} ({node.type})")
+        node_start_time = get_beijing_time_naive()
+        span = start_span()
+        span["queue_wait_time"] = queue_wait
+        span["bytes_in"] = self._get_node_input_size(node)
         
-        def replace_match(match):
-            var_path = match.group(1)
+        try:
+            # 执行节点
+            deadline_start = time.monotonic()
+            try:
+                node_output = await asyncio.wait_for(self._execute_node(node, db_session), timeout)
+            except asyncio.TimeoutError:
+                # 节点自身抛出的超时（如LLM节点的请求超时）保留原始错误信息
+                if time.monotonic() - deadline_start < timeout:
+                    raise
+                raise TimeoutError(f"节点执行超时（{timeout:g}秒）")
             
-            # 处理 {input.param} 格式
-            if var_path.startswith("input."):
-                param_name = var_path[6:]  # 去掉 "input."
-                value = self.execution_context.get("input", {}).get(param_name)
-                if value is not None:
-                    return str(value)
+            # 保存节点输出到上下文
+            self.execution_context[node.id] = node_output
             
-            # 处理 {node_id} 或 {node_id.field} 格式
-            parts = var_path.split(".", 1)
-            node_id = parts[0]
+            # 记录节点执行结果
+            node_end_time = get_beijing_time_naive()
+            execution_time = int((node_end_time - node_start_time).total_seconds() * 1000)
             
-            if node_id in self.execution_context:
-                node_output = self.execution_context[node_id]
-                
-                # 如果是 {node_id.field} 格式
-                if len(parts) > 1:
-                    field_path = parts[1]
-                    # 支持嵌套字段访问，如 node_id.data.result
-                    value = node_output
-                    for field in field_path.split("."):
-                        if isinstance(value, dict):
-                            value = value.get(field)
-                        else:
-                            return match.group(0)  # 无法访问，返回原文本
-                    if value is not None:
-                        return str(value)
-                else:
-                    # {node_id} 格式，返回整个输出（如果是字符串）
-                    if isinstance(node_output, str):
-                        return node_output
-                    elif isinstance(node_output, dict):
-                        # 如果是字典，尝试转换为JSON字符串
-                        import json
-                        return json.dumps(node_output, ensure_ascii=False)
+            self.node_results[node.id] = NodeExecutionResult(
+                node_id=node.id,
+                node_type=node.type,
+                status="success",
+                output=node_output,
+                execution_time=execution_time,
+                bytes_out=payload_size(node_output),
+                **span,
+                started_at=node_start_time,
+                completed_at=node_end_time
+            )
             
-            # 变量未找到，返回原文本
-            return match.group(0)
+            logger.info(f"节点 {node.id} 执行成功，耗时 {execution_time}ms")
+            return True
         
-        result = re.sub(pattern, replace_match, text)
-        return result
+        except asyncio.CancelledError:
+            # 其他节点失败导致工作流停止
+            node_end_time = get_beijing_time_naive()
+            self.node_results[node.id] = NodeExecutionResult(
+                node_id=node.id,
+                node_type=node.type,
+                status="cancelled",
+                error_message="工作流已停止，节点被取消",
+                execution_time=int((node_end_time - node_start_time).total_seconds() * 1000),
+                **span,
+                started_at=node_start_time,
+                completed_at=node_end_time
+            )
+            raise
+            
+        except Exception as e:
+            # 节点执行失败
+            logger.error(f"节点 {node.id} 执行失败: {str(e)}", exc_info=True)
+            
+            node_end_time = get_beijing_time_naive()
+            execution_time = int((node_end_time - node_start_time).total_seconds() * 1000)
+            
+            self.node_results[node.id] = NodeExecutionResult(
+                node_id=node.id,
+                node_type=node.type,
+                status="failed",
+                error_message=str(e),
+                execution_time=execution_time,
+                **span,
+                started_at=node_start_time,
+                completed_at=node_end_time
+            )
+            return False
+    
+    @staticmethod
+    async def _cancel_running(running: Dict[asyncio.Task, WorkflowNode]):
+        """取消仍在执行的节点并等待其结束"""
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        running.clear()
     
-    def _get_execution_order(self, nodes: List[WorkflowNode], edges: List[WorkflowEdge]) -> List[WorkflowNode]:
+    def _replace_variables(self, text: str) -> str:
         """
-        使用拓扑排序计算节点执行顺序
+        变量替换，支持以下格式：
+        - {node_id} - 引用节点输出
+        - {node_id.field} - 引用节点输出的特定字段
+        - {input.param} - 引用工作流输入参数
+        
+        模板在工作流加载时已预编译（见 workflow_template），这里只做查找和拼接
         
         Args:
-            nodes: 节点列表
-            edges: 边列表
+            text: 待替换的文本
             
         Returns:
-            List[WorkflowNode]: 按执行顺序排列的节点列表
+            str: 替换后的文本
         """
-        # 构建邻接表和入度
-        node_dict = {node.id: node for node in nodes}
-        in_degree = {node.id: 0 for node in nodes}
-        graph: Dict[str, List[str]] = {node.id: [] for node in nodes}
-        
-        for edge in edges:
-            if edge.source in graph and edge.target in in_degree:
-                graph[edge.source].append(edge.target)
-                in_degree[edge.target] += 1
-        
-        # 拓扑排序
-        queue = [node_id for node_id, degree in in_degree.items() if degree == 0]
-        result = []
-        
-        while queue:
-            current = queue.pop(0)
-            if current in node_dict:
-                result.append(node_dict[current])
-            
-            for neighbor in graph.get(current, []):
-                in_degree[neighbor] -= 1
-                if in_degree[neighbor] == 0:
-                    queue.append(neighbor)
-        
-        return result
+        if self.template_plan is None:
+            self.template_plan = WorkflowTemplatePlan([])
+        return self.template_plan.replace(text, self.execution_context)
     
-    def _should_execute_node(self, node: WorkflowNode, edges: List[WorkflowEdge]) -> bool:
+    def _should_execute_node(self, node: WorkflowNode) -> bool:
         """
         判断节点是否应该被执行（条件路由）
         
@@ -252,24 +285,23 @@ class WorkflowExecutor:
         
         Args:
             node: 待判断的节点
-            edges: 所有边
             
         Returns:
             bool: 是否应该执行该节点
         """
-        # 找到所有指向该节点的边
-        incoming_edges = [edge for edge in edges if edge.target == node.id]
+        # 指向该节点的边及其条件判断函数（执行计划中预先建立的入边索引）
+        incoming_edges = self.plan.incoming_edges.get(node.id, [])
         
         # 如果没有入边，说明是开始节点，总是执行
         if not incoming_edges:
             return True
         
         # 如果所有入边都没有条件，总是执行
-        if all(not edge.condition for edge in incoming_edges):
+        if all(evaluator is None for _, evaluator in incoming_edges):
             return True
         
         # 检查至少有一条入边满足条件
-        for edge in incoming_edges:
+        for edge, evaluator in incoming_edges:
             source_id = edge.source
             
             # 如果源节点还没执行，暂时认为应该执行
@@ -279,7 +311,7 @@ class WorkflowExecutor:
             source_output = self.execution_context[source_id]
             
             # 如果边没有条件，或条件满足，则执行
-            if not edge.condition or self._check_edge_condition(edge, source_output):
+            if evaluator is None or evaluator(source_output):
                 logger.info(f"节点 {node.id} 的入边 {edge.id} 条件满足，将执行该节点")
                 return True
         
@@ -287,58 +319,6 @@ class WorkflowExecutor:
         logger.info(f"节点 {node.id} 的所有条件入边都不满足，跳过执行")
         return False
     
-    def _check_edge_condition(self, edge: WorkflowEdge, source_output: Dict[str, Any]) -> bool:
-        """
-        检查边的条件是否满足
-        
-        Args:
-            edge: 边对象
-            source_output: 源节点的输出
-            
-        Returns:
-            bool: 条件是否满足
-        """
-        # 如果边没有条件，默认满足
-        if not edge.condition:
-            return True
-        
-        condition = edge.condition
-        condition_type = condition.get("type")
-        
-        if condition_type == "intent_match":
-            # 意图匹配条件
-            field = condition.get("field", "intent")
-            expected_value = condition.get("value")
-            actual_value = source_output.get(field)
-            
-            match = (actual_value == expected_value)
-            logger.info(f"条件判断 [{edge.id}]: {field}={actual_value} == {expected_value} => {match}")
-            return match
-            
-        elif condition_type == "field_equals":
-            # 字段值相等条件
-            field = condition.get("field")
-            expected_value = condition.get("value")
-            actual_value = source_output.get(field)
-            
-            return actual_value == expected_value
-            
-        elif condition_type == "field_contains":
-            # 字段包含条件
-            field = condition.get("field")
-            search_value = condition.get("value")
-            actual_value = str(source_output.get(field, ""))
-            
-            return search_value in actual_value
-        
-        elif condition_type == "always":
-            # 总是执行（默认分支）
-            return True
-        
-        # 未知条件类型，默认满足
-        logger.warning(f"未知的条件类型: {condition_type}，默认执行")
-        return True
-    
     async def _execute_node(self, node: WorkflowNode, db_session) -> Dict[str, Any]:
         """
         根据节点类型调用对应的执行器
@@ -369,7 +349,12 @@ class WorkflowExecutor:
         elif node_type == "llm":
             return await execute_llm_node(node_data, self.execution_context, self._replace_variables, db_session)
         elif node_type == "http":
-            return await execute_http_node(node_data, self.execution_context, self._replace_variables)
+            return await execute_http_node(
+                node_data,
+                self.execution_context,
+                self._replace_variables,
+                compiled_body=self.template_plan.bodies.get(node.id)
+            )
         elif node_type == "knowledge":
             return await execute_knowledge_node(node_data, self.execution_context, self._replace_variables, db_session)
         elif node_type == "intent":
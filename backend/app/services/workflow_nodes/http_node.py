@@ -6,16 +6,20 @@ import logging
 import asyncio
 import json
 import ssl
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, Optional
 import aiohttp
 
+from app.services.workflow_template import CompiledValue
+from app.services.workflow_trace import record_retry
+
 logger = logging.getLogger(__name__)
 
 
 async def execute_http_node(
     node_data: Dict[str, Any],
     execution_context: Dict[str, Any],
-    replace_variables: Callable[[str], str]
+    replace_variables: Callable[[str], str],
+    compiled_body: Optional[CompiledValue] = None
 ) -> Dict[str, Any]:
     """
     执行HTTP请求节点
@@ -32,6 +36,7 @@ async def execute_http_node(
             - followRedirect: 是否跟随重定向（默认True）
         execution_context: 执行上下文
         replace_variables: 变量替换函数
+        compiled_body: 预编译的字典请求体（由工作流模板计划提供，未提供时逐层替换）
         
     Returns:
         Dict[str, Any]: 节点输出，包含：
@@ -76,7 +81,10 @@ async def execute_http_node(
                 pass
         elif isinstance(body, dict):
             # 如果是字典，递归替换其中的字符串值
-            processed_body = _replace_dict_variables(body, replace_variables)
+            if compiled_body is not None:
+                processed_body = compiled_body.render(execution_context)
+            else:
+                processed_body = _replace_dict_variables(body, replace_variables)
         else:
             processed_body = body
     
@@ -131,6 +139,7 @@ async def execute_http_node(
             last_error = TimeoutError(f"HTTP请求超时（{timeout}秒）")
             if attempt < retry_count:
                 logger.warning(f"HTTP请求超时，正在重试 ({attempt + 1}/{retry_count})")
+                record_retry()
                 await asyncio.sleep(1)  # 重试前等待1秒
             else:
                 raise last_error
@@ -138,6 +147,7 @@ async def execute_http_node(
             last_error = e
             if attempt < retry_count:
                 logger.warning(f"HTTP请求失败: {str(e)}，正在重试 ({attempt + 1}/{retry_count})")
+                record_retry()
                 await asyncio.sleep(1)  # 重试前等待1秒
             else:
                 logger.error(f"HTTP节点执行失败（已重试{retry_count}次）: {str(e)}", exc_info=True)
@@ -164,7 +164,7 @@ async def _recognize_by_llm(
     try:
         # 调用LLM
         result = await asyncio.wait_for(
-            asyncio.to_thread(llm_service.chat, messages),
+            llm_service.chat(messages),
             timeout=30
         )
         
@@ -6,8 +6,9 @@ import logging
 from typing import Dict, Any, Callable, Optional
 from sqlalchemy.orm import Session
 from app.models.knowledge_base import KnowledgeBase
-from app.models.document import Document, DocumentChunk
 from app.services.embedding_service import get_embedding_service
+from app.services.vector_index import vector_index_manager
+from app.services.knowledge_retrieval import hydrate_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -63,47 +64,36 @@ async def execute_knowledge_node(
     embedding_service = get_embedding_service()
     
     # 对查询文本进行向量化
-    query_vector = await embedding_service.embed_text(query)
+    query_vector = await embedding_service.embed_query(query)
     if not query_vector:
         raise ValueError("查询文本向量化失败")
     
-    # 获取所有已向量化的文档块
-    chunks = db_session.query(DocumentChunk).filter(
-        DocumentChunk.knowledge_base_id == kb.id,
-        DocumentChunk.embedding_vector.isnot(None)
-    ).all()
+    # 使用知识库向量索引检索
+    matches = await vector_index_manager.search_async(
+        query_vector,
+        [kb.id],
+        top_k,
+        similarity_threshold
+    )
     
-    if not chunks:
-        logger.warning(f"知识库 {kb.name} 中没有已向量化的文档块")
+    if not matches:
+        logger.warning(f"知识库 {kb.name} 中没有超过阈值 {similarity_threshold} 的文档块")
         return {
             "results": [],
             "total": 0
         }
     
-    # 计算相似度
-    results = []
-    for chunk in chunks:
-        if chunk.embedding_vector:
-            similarity = embedding_service.calculate_similarity(
-                query_vector,
-                chunk.embedding_vector
-            )
-            
-            if similarity >= similarity_threshold:
-                # 获取文档信息
-                doc = db_session.query(Document).filter(Document.id == chunk.document_id).first()
-                
-                results.append({
-                    "chunk_id": chunk.id,
-                    "content": chunk.content,
-                    "similarity": similarity,
-                    "document_title": doc.title if doc else None,
-                    "document_id": chunk.document_id
-                })
-    
-    # 按相似度排序并取top_k
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    results = results[:top_k]
+    # 一次性加载文本块和文档信息（保持相似度排序）
+    results = [
+        {
+            "chunk_id": r["chunk"].id,
+            "content": r["chunk"].content,
+            "similarity": r["similarity_score"],
+            "document_title": r["document"].title,
+            "document_id": r["document"].id
+        }
+        for r in hydrate_chunks(matches, db_session)
+    ]
     
     logger.info(f"知识库检索完成，找到 {len(results)} 个结果")
     
@@ -93,21 +93,23 @@ async def execute_llm_node(
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": user_prompt})
     
-    # 4. 准备调用参数 (覆盖模型默认参数)
+    # 4. 创建服务并准备调用参数 (覆盖模型默认参数)
     # 优先使用节点配置的参数，其次使用模型默认参数
+    # 只修改服务实例：并行节点共享同一个 ORM 模型对象，且修改模型会在提交时写回数据库
+    llm_service = LLMService(llm_model)
+    
     temp_temperature = node_data.get("temperature")
     temp_max_tokens = node_data.get("maxTokens")
     temp_top_p = node_data.get("topP")
     
     if temp_temperature is not None:
-        llm_model.temperature = float(temp_temperature)
+        llm_service.temperature = float(temp_temperature)
     if temp_max_tokens is not None:
-        llm_model.max_tokens = int(temp_max_tokens)
+        llm_service.max_tokens = int(temp_max_tokens)
     if temp_top_p is not None:
-        llm_model.top_p = float(temp_top_p)
-        
-    # 5. 创建服务并调用
-    llm_service = LLMService(llm_model)
+        llm_service.top_p = float(temp_top_p)
+    
+    # 5. 调用模型
     
     # 设置超时时间（默认60秒）
     timeout = node_data.get("timeout", 60)
@@ -115,9 +117,9 @@ async def execute_llm_node(
     try:
         logger.info(f"正在执行LLM节点，使用模型: {llm_model.name}, Prompt长度: {len(user_prompt)}")
         
-        # 调用LLM（使用asyncio.to_thread在异步环境中运行同步函数）
+        # 调用LLM
         result = await asyncio.wait_for(
-            asyncio.to_thread(llm_service.chat, messages),
+            llm_service.chat(messages),
             timeout=timeout
         )
         
@@ -0,0 +1,203 @@
+"""
+工作流执行计划
+工作流定义在加载时编译一次：验证结果、拓扑顺序、入边索引、条件判断函数和变量模板，
+按 (工作流UUID, updated_at) 缓存在进程内，执行时直接复用：
+- 编辑/删除工作流时主动失效；其他 worker 编辑后 updated_at 变化，同样不会命中旧计划
+- 计划对象只读，可被并发执行共享
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.schemas.workflow import WorkflowNode, WorkflowEdge, ValidationResult
+from app.services.workflow_template import WorkflowTemplatePlan
+from app.services.workflow_validator import WorkflowValidator
+
+logger = logging.getLogger(__name__)
+
+ConditionEvaluator = Callable[[Dict[str, Any]], bool]
+
+
+def compile_condition(edge: WorkflowEdge) -> Optional[ConditionEvaluator]:
+    """
+    将边的条件配置编译为判断函数
+
+    Returns:
+        Optional[ConditionEvaluator]: 边没有条件时返回None
+    """
+    condition = edge.condition
+    if not condition:
+        return None
+
+    condition_type = condition.get("type")
+    field = condition.get("field")
+    value = condition.get("value")
+
+    if condition_type == "intent_match":
+        # 意图匹配条件
+        field = field or "intent"
+
+        def intent_match(source_output: Dict[str, Any]) -> bool:
+            actual_value = source_output.get(field)
+            match = (actual_value == value)
+            logger.info(f"条件判断 [{edge.id}]: {field}={actual_value} == {value} => {match}")
+            return match
+        return intent_match
+
+    if condition_type == "field_equals":
+        # 字段值相等条件
+        return lambda source_output: source_output.get(field) == value
+
+    if condition_type == "field_contains":
+        # 字段包含条件
+        return lambda source_output: value in str(source_output.get(field, ""))
+
+    if condition_type != "always":
+        # 未知条件类型，默认满足
+        logger.warning(f"未知的条件类型: {condition_type}，默认执行")
+    return lambda source_output: True
+
+
+def topological_order(nodes: List[WorkflowNode], edges: List[WorkflowEdge]) -> List[WorkflowNode]:
+    """
+    使用拓扑排序计算节点执行顺序（存在环时，环上的节点不在结果中）
+
+    Args:
+        nodes: 节点列表
+        edges: 边列表
+
+    Returns:
+        List[WorkflowNode]: 按执行顺序排列的节点列表
+    """
+    # 构建邻接表和入度
+    node_dict = {node.id: node for node in nodes}
+    in_degree = {node.id: 0 for node in nodes}
+    graph: Dict[str, List[str]] = {node.id: [] for node in nodes}
+
+    for edge in edges:
+        if edge.source in graph and edge.target in in_degree:
+            graph[edge.source].append(edge.target)
+            in_degree[edge.target] += 1
+
+    # 拓扑排序
+    queue = [node_id for node_id, degree in in_degree.items() if degree == 0]
+    result = []
+
+    while queue:
+        current = queue.pop(0)
+        if current in node_dict:
+            result.append(node_dict[current])
+
+        for neighbor in graph.get(current, []):
+            in_degree[neighbor] -= 1
+            if in_degree[neighbor] == 0:
+                queue.append(neighbor)
+
+    return result
+
+
+class WorkflowPlan:
+    """编译后的工作流（只读）"""
+
+    def __init__(self, nodes: List[WorkflowNode], edges: List[WorkflowEdge]):
+        self.nodes = nodes
+        self.edges = edges
+        self.validation: ValidationResult = WorkflowValidator.validate(nodes, edges)
+
+        self.execution_order = topological_order(nodes, edges)
+        self.node_dict = {node.id: node for node in self.execution_order}
+        self.position = {node.id: index for index, node in enumerate(self.execution_order)}
+        self.end_node = next((node for node in nodes if node.type == "end"), None)
+
+        # 调度用的后继表和入度（执行时复制入度）
+        self.successors: Dict[str, List[str]] = {node_id: [] for node_id in self.node_dict}
+        self.in_degree: Dict[str, int] = {node_id: 0 for node_id in self.node_dict}
+        for edge in edges:
+            if edge.source in self.node_dict and edge.target in self.node_dict:
+                self.successors[edge.source].append(edge.target)
+                self.in_degree[edge.target] += 1
+
+        # 条件路由用的入边索引：节点ID -> [(边, 条件判断函数)]
+        self.incoming_edges: Dict[str, List[Tuple[WorkflowEdge, Optional[ConditionEvaluator]]]] = {}
+        for edge in edges:
+            self.incoming_edges.setdefault(edge.target, []).append((edge, compile_condition(edge)))
+
+        self.template_plan = WorkflowTemplatePlan(nodes)
+
+
+def compile_workflow_plan(nodes_data: List[Any], edges_data: List[Any]) -> WorkflowPlan:
+    """将工作流的节点/边（JSON字典或模型对象）编译为执行计划"""
+    nodes = [WorkflowNode(**node) if isinstance(node, dict) else node for node in nodes_data or []]
+    edges = [WorkflowEdge(**edge) if isinstance(edge, dict) else edge for edge in edges_data or []]
+    return WorkflowPlan(nodes, edges)
+
+
+class WorkflowPlanCache:
+    """工作流执行计划的进程内 LRU 缓存"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # 工作流UUID -> (updated_at, 执行计划)
+        self._items: "OrderedDict[str, Tuple[Optional[datetime], WorkflowPlan]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+        }
+
+    def get_plan(self, workflow) -> WorkflowPlan:
+        """
+        获取工作流的执行计划（未命中或版本变化时编译并缓存）
+
+        Args:
+            workflow: Workflow 模型对象
+        """
+        key = workflow.uuid
+        version = workflow.updated_at
+
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == version:
+                self._items.move_to_end(key)
+                self.stats['hits'] += 1
+                return item[1]
+            self.stats['misses'] += 1
+
+        plan = compile_workflow_plan(workflow.nodes, workflow.edges)
+        if self.max_size <= 0:
+            return plan
+
+        with self._lock:
+            self._items[key] = (version, plan)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return plan
+
+    def invalidate(self, workflow_uuid: str):
+        """工作流被编辑或删除后移除缓存的执行计划"""
+        with self._lock:
+            if self._items.pop(workflow_uuid, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> dict:
+        """缓存命中统计"""
+        total = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hit_rate': round(self.stats['hits'] / total, 4) if total else None,
+        }
+
+
+# 全局工作流执行计划缓存
+workflow_plan_cache = WorkflowPlanCache(max_size=settings.workflow_plan_cache_size)
@@ -0,0 +1,173 @@
+"""
+工作流变量模板预编译
+节点配置中的 {node_id}、{node_id.field.path}、{input.param} 引用在加载工作流时解析一次：
+- 模板拆分为文本片段和变量引用，字段路径预先切分
+- 执行时只做字典查找和字符串拼接，不再对每个字符串跑正则
+- 编译结果按模板文本缓存（内容相同即可复用，与工作流版本无关）
+"""
+import re
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.schemas.workflow import WorkflowNode
+
+# 匹配变量：{node_id} 或 {node_id.field} 或 {input.param}
+VARIABLE_PATTERN = re.compile(r'\{([^}]+)\}')
+
+# 模板编译缓存条目数
+TEMPLATE_CACHE_SIZE = 4096
+
+
+class VariableRef:
+    """模板中的一个变量引用（字段路径已预先切分）"""
+
+    __slots__ = ("raw", "input_param", "node_id", "fields")
+
+    def __init__(self, raw: str, var_path: str):
+        self.raw = raw
+        self.input_param = var_path[6:] if var_path.startswith("input.") else None
+        parts = var_path.split(".", 1)
+        self.node_id = parts[0]
+        self.fields: Optional[Tuple[str, ...]] = tuple(parts[1].split(".")) if len(parts) > 1 else None
+
+    def resolve(self, context: Dict[str, Any]) -> str:
+        """在执行上下文中取值，无法解析时保留原文本"""
+        # {input.param} 优先按输入参数名整体查找
+        if self.input_param is not None:
+            inputs = context.get("input")
+            value = inputs.get(self.input_param) if isinstance(inputs, dict) else None
+            if value is not None:
+                return str(value)
+
+        if self.node_id in context:
+            node_output = context[self.node_id]
+
+            if self.fields is not None:
+                # 嵌套字段访问，如 node_id.data.result
+                value = node_output
+                for field in self.fields:
+                    if not isinstance(value, dict):
+                        return self.raw
+                    value = value.get(field)
+                if value is not None:
+                    return str(value)
+            elif isinstance(node_output, str):
+                return node_output
+            elif isinstance(node_output, dict):
+                return json.dumps(node_output, ensure_ascii=False)
+
+        return self.raw
+
+
+class CompiledTemplate:
+    """预编译的字符串模板"""
+
+    __slots__ = ("source", "segments")
+
+    def __init__(self, source: str):
+        self.source = source
+        segments: List[Union[str, VariableRef]] = []
+        position = 0
+        for match in VARIABLE_PATTERN.finditer(source):
+            if match.start() > position:
+                segments.append(source[position:match.start()])
+            segments.append(VariableRef(match.group(0), match.group(1)))
+            position = match.end()
+        if position < len(source):
+            segments.append(source[position:])
+        self.segments = tuple(segments)
+
+    @property
+    def has_variables(self) -> bool:
+        return any(isinstance(segment, VariableRef) for segment in self.segments)
+
+    def render(self, context: Dict[str, Any]) -> str:
+        if len(self.segments) == 1 and isinstance(self.segments[0], str):
+            return self.source
+        return "".join(
+            segment if isinstance(segment, str) else segment.resolve(context)
+            for segment in self.segments
+        )
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text: str) -> CompiledTemplate:
+    """编译模板（按文本缓存）"""
+    return CompiledTemplate(text)
+
+
+class CompiledValue:
+    """
+    预编译的嵌套结构（如HTTP节点的请求体）
+
+    字典递归编译；列表只替换其中的字符串元素；不含变量的部分原样复用
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, data: Dict[str, Any]):
+        self.items: List[Tuple[str, str, Any]] = []
+        for key, value in data.items():
+            if isinstance(value, str):
+                template = compile_template(value)
+                if template.has_variables:
+                    self.items.append((key, "template", template))
+                    continue
+            elif isinstance(value, dict):
+                self.items.append((key, "dict", CompiledValue(value)))
+                continue
+            elif isinstance(value, list):
+                self.items.append((key, "list", [
+                    compile_template(item) if isinstance(item, str) else item
+                    for item in value
+                ]))
+                continue
+            self.items.append((key, "const", value))
+
+    def render(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        result = {}
+        for key, kind, payload in self.items:
+            if kind == "template" or kind == "dict":
+                result[key] = payload.render(context)
+            elif kind == "list":
+                result[key] = [
+                    item.render(context) if isinstance(item, CompiledTemplate) else item
+                    for item in payload
+                ]
+            else:
+                result[key] = payload
+        return result
+
+
+class WorkflowTemplatePlan:
+    """工作流的模板执行计划：节点配置中全部字符串的编译结果，以及HTTP节点的请求体结构"""
+
+    def __init__(self, nodes: List[WorkflowNode]):
+        self.templates: Dict[str, CompiledTemplate] = {}
+        self.bodies: Dict[str, CompiledValue] = {}
+        for node in nodes:
+            data = node.data or {}
+            self._collect(data)
+            if node.type == "http" and isinstance(data.get("body"), dict):
+                self.bodies[node.id] = CompiledValue(data["body"])
+
+    def _collect(self, value: Any):
+        if isinstance(value, str):
+            if value not in self.templates:
+                self.templates[value] = compile_template(value)
+        elif isinstance(value, dict):
+            for item in value.values():
+                self._collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                self._collect(item)
+
+    def replace(self, text: str, context: Dict[str, Any]) -> str:
+        """替换文本中的变量（执行时动态拼出的文本按需编译）"""
+        if not isinstance(text, str):
+            return text
+        template = self.templates.get(text)
+        if template is None:
+            template = compile_template(text)
+        return template.render(context)
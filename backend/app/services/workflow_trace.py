@@ -0,0 +1,139 @@
+"""
+工作流节点追踪
+每个节点执行时记录一个 span（排队等待、执行耗时、输入/输出字节数、重试次数），
+随执行记录的 node_executions 持久化，并可按工作流汇总为 p50/p95/p99 延迟分布：
+- 节点执行器通过 record_retry() 上报重试，无需修改返回值
+- 字节数按 JSON 序列化后的 UTF-8 长度计算
+"""
+import json
+import math
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional
+
+# 当前节点的 span（每个节点在独立的 Task 中执行，互不干扰）
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("workflow_node_span", default=None)
+
+# 汇总的分位数
+PERCENTILES = (50, 95, 99)
+
+
+def start_span() -> Dict[str, Any]:
+    """为当前节点开启 span（在节点 Task 内调用）"""
+    span = {"retries": 0}
+    _current_span.set(span)
+    return span
+
+
+def record_retry(count: int = 1):
+    """节点执行器上报重试次数（不在工作流中执行时忽略）"""
+    span = _current_span.get()
+    if span is not None:
+        span["retries"] += count
+
+
+def payload_size(value: Any) -> int:
+    """数据按 JSON 序列化后的字节数"""
+    if value is None:
+        return 0
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return len(str(value).encode("utf-8"))
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """最近秩法计算分位数（输入须已排序）"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _distribution(values: List[float]) -> Dict[str, Any]:
+    values = sorted(values)
+    result: Dict[str, Any] = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+    result["max"] = values[-1] if values else None
+    result["avg"] = round(sum(values) / len(values), 2) if values else None
+    return result
+
+
+class _NodeRollup:
+    """单个节点（或节点类型）的汇总数据"""
+
+    def __init__(self, node_type: str):
+        self.node_type = node_type
+        self.count = 0
+        self.status_counts: Dict[str, int] = {}
+        self.execution_times: List[float] = []
+        self.queue_waits: List[float] = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+
+    def add(self, span: Dict[str, Any]):
+        status = span.get("status") or "unknown"
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if status == "skipped":
+            return
+        self.count += 1
+        if span.get("execution_time") is not None:
+            self.execution_times.append(span["execution_time"])
+        if span.get("queue_wait_time") is not None:
+            self.queue_waits.append(span["queue_wait_time"])
+        self.bytes_in += span.get("bytes_in") or 0
+        self.bytes_out += span.get("bytes_out") or 0
+        self.retries += span.get("retries") or 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "node_type": self.node_type,
+            "count": self.count,
+            "status_counts": self.status_counts,
+            "execution_time_ms": _distribution(self.execution_times),
+            "queue_wait_ms": _distribution(self.queue_waits),
+            "avg_bytes_in": round(self.bytes_in / self.count) if self.count else None,
+            "avg_bytes_out": round(self.bytes_out / self.count) if self.count else None,
+            "retries": self.retries,
+        }
+
+
+def summarize_executions(executions: Iterable[Any]) -> Dict[str, Any]:
+    """
+    汇总执行记录中的节点 span
+
+    Args:
+        executions: 包含 execution_time 和 node_executions 属性的执行记录
+
+    Returns:
+        Dict[str, Any]: 工作流整体、按节点、按节点类型的延迟分布（毫秒）
+    """
+    total_times: List[float] = []
+    by_node: Dict[str, _NodeRollup] = {}
+    by_type: Dict[str, _NodeRollup] = {}
+    count = 0
+
+    for execution in executions:
+        count += 1
+        if execution.execution_time is not None:
+            total_times.append(execution.execution_time)
+        for span in execution.node_executions or []:
+            if not isinstance(span, dict) or not span.get("node_id"):
+                continue
+            node_type = span.get("node_type") or "unknown"
+            by_node.setdefault(span["node_id"], _NodeRollup(node_type)).add(span)
+            by_type.setdefault(node_type, _NodeRollup(node_type)).add(span)
+
+    nodes = [{"node_id": node_id, **rollup.to_dict()} for node_id, rollup in by_node.items()]
+    # 按 p95 执行耗时降序，最慢的节点排在前面
+    nodes.sort(key=lambda item: item["execution_time_ms"]["p95"] or 0, reverse=True)
+
+    return {
+        "execution_count": count,
+        "execution_time_ms": _distribution(total_times),
+        "nodes": nodes,
+        "node_types": {node_type: rollup.to_dict() for node_type, rollup in by_type.items()},
+    }
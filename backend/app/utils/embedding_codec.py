@@ -0,0 +1,115 @@
+"""
+向量二进制编解码工具
+将 embedding 以紧凑的二进制格式存入 kb_document_chunks.embedding_blob，读取时直接解码为 NumPy 数组：
+- float32: 原始 4 字节浮点（无损）
+- float16: 半精度（体积减半，余弦相似度误差约 1e-3）
+- int8:    按向量对称量化，配合 embedding_scale 还原（体积为 float32 的 1/4）
+另提供文本块内容哈希，用于复用相同内容的已有向量
+"""
+import hashlib
+import unicodedata
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SUPPORTED_DTYPES = ('float32', 'float16', 'int8')
+
+# 固定使用小端序，保证不同平台写入的数据可以互相读取
+_NUMPY_DTYPES = {
+    'float32': np.dtype('<f4'),
+    'float16': np.dtype('<f2'),
+    'int8': np.dtype('i1'),
+}
+
+
+def encode_embedding(vector: Sequence[float], dtype: str = 'float32') -> Tuple[bytes, Optional[float]]:
+    """
+    将向量编码为二进制
+
+    Args:
+        vector: 向量（列表或NumPy数组）
+        dtype: 存储格式 float32/float16/int8
+
+    Returns:
+        (blob, scale): 二进制数据和量化比例（仅 int8 有值）
+    """
+    if dtype not in _NUMPY_DTYPES:
+        raise ValueError(f"不支持的向量存储格式: {dtype}，可选: {', '.join(SUPPORTED_DTYPES)}")
+
+    array = np.asarray(vector, dtype=np.float32)
+
+    if dtype == 'int8':
+        max_abs = float(np.abs(array).max()) if array.size else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        quantized = np.clip(np.rint(array / scale), -127, 127).astype(_NUMPY_DTYPES['int8'])
+        return quantized.tobytes(), scale
+
+    return array.astype(_NUMPY_DTYPES[dtype]).tobytes(), None
+
+
+def embedding_dimension(blob: bytes, dtype: Optional[str] = 'float32') -> int:
+    """根据二进制长度和存储格式计算向量维度"""
+    return len(blob) // _NUMPY_DTYPES[dtype or 'float32'].itemsize
+
+
+def decode_embedding(blob: bytes, dtype: Optional[str] = 'float32', scale: Optional[float] = None) -> np.ndarray:
+    """
+    将二进制数据解码为 float32 NumPy 数组（不经过 Python 列表）
+
+    Args:
+        blob: 二进制数据
+        dtype: 存储格式（为空时按 float32 处理）
+        scale: int8 量化比例
+
+    Returns:
+        np.ndarray: float32 向量
+    """
+    dtype = dtype or 'float32'
+    if dtype not in _NUMPY_DTYPES:
+        raise ValueError(f"不支持的向量存储格式: {dtype}")
+
+    array = np.frombuffer(blob, dtype=_NUMPY_DTYPES[dtype])
+    if dtype == 'int8':
+        return array.astype(np.float32) * np.float32(scale if scale else 1.0)
+    return array.astype(np.float32, copy=dtype != 'float32')
+
+
+def decode_embeddings(rows: List[Tuple[bytes, Optional[str], Optional[float]]]) -> np.ndarray:
+    """
+    批量解码为 (n, dim) 的 float32 矩阵
+
+    同一格式的连续行会先拼接字节再一次性解码，避免逐行分配。
+
+    Args:
+        rows: (blob, dtype, scale) 列表，所有向量维度必须一致
+
+    Returns:
+        np.ndarray: (n, dim) float32 矩阵
+    """
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32)
+
+    dtypes = {dtype or 'float32' for _, dtype, _ in rows}
+    if len(dtypes) == 1 and 'int8' not in dtypes:
+        dtype = dtypes.pop()
+        flat = np.frombuffer(b''.join(blob for blob, _, _ in rows), dtype=_NUMPY_DTYPES[dtype])
+        return flat.reshape(len(rows), -1).astype(np.float32, copy=dtype != 'float32')
+
+    return np.vstack([decode_embedding(blob, dtype, scale) for blob, dtype, scale in rows])
+
+
+def chunk_content_hash(content: str, model: Optional[str]) -> str:
+    """
+    计算文本块内容哈希（规范化内容 + 向量模型名称）
+
+    规范化：全角转半角、合并空白，仅排版不同的文本块视为相同内容。
+
+    Args:
+        content: 文本块内容
+        model: 向量模型名称（不同模型的向量不能复用）
+
+    Returns:
+        str: SHA-256 十六进制字符串
+    """
+    normalized = ' '.join(unicodedata.normalize('NFKC', content or '').split())
+    return hashlib.sha256(f"{model or ''}\n{normalized}".encode('utf-8')).hexdigest()
@@ -0,0 +1,146 @@
+"""
+传感器时序数据列式编解码
+传感器历史按 (设备, 传感器) 分段存储，每段的时间戳列和数值列分别编码为紧凑的二进制：
+- 时间戳（毫秒）：首值 + 差值的差值（delta-of-delta），zigzag 后按 varint 写入。
+  固定上报周期的数据每个点只占 1 字节
+- 数值（float64）：与前一个值按位异或，只写出非零的中间字节（按字节对齐的 Gorilla 压缩）。
+  数值不变时每个点只占 1 字节
+
+本文件是规范版本（读取端）。mqtt-service（写入端）单独构建镜像、无法导入 backend 代码，
+service/mqtt-service/timeseries_codec.py 是本文件的原样复制：修改时只改本文件，再整体复制过去，
+两份文件必须逐字节一致（cmp 两个文件即可检查）。
+"""
+import struct
+from array import array
+from datetime import datetime, timedelta
+from typing import List, Sequence, Tuple
+
+# 编码格式版本（写在每列数据的第一个字节）
+CODEC_VERSION = 1
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_ms(value: datetime) -> int:
+    """无时区时间（北京时间）转毫秒数（按UTC计算，只用于存储，不做时区换算）"""
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def ms_to_datetime(value: int) -> datetime:
+    return _EPOCH + timedelta(milliseconds=value)
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def encode_timestamps(timestamps: Sequence[int]) -> bytes:
+    """编码毫秒时间戳列（delta-of-delta + zigzag varint）"""
+    out = bytearray([CODEC_VERSION])
+    _write_varint(out, len(timestamps))
+    previous = 0
+    previous_delta = 0
+    for index, timestamp in enumerate(timestamps):
+        if index == 0:
+            _write_varint(out, _zigzag(timestamp))
+        else:
+            delta = timestamp - previous
+            _write_varint(out, _zigzag(delta - previous_delta))
+            previous_delta = delta
+        previous = timestamp
+    return bytes(out)
+
+
+def decode_timestamps(data: bytes) -> List[int]:
+    """解码毫秒时间戳列"""
+    if not data or data[0] != CODEC_VERSION:
+        raise ValueError("不支持的时间戳编码格式")
+    count, pos = _read_varint(data, 1)
+    result = array('q')
+    previous = 0
+    previous_delta = 0
+    for index in range(count):
+        value, pos = _read_varint(data, pos)
+        value = _unzigzag(value)
+        if index == 0:
+            previous = value
+        else:
+            previous_delta += value
+            previous += previous_delta
+        result.append(previous)
+    return result.tolist()
+
+
+def encode_values(values: Sequence[float]) -> bytes:
+    """
+    编码浮点数值列（按字节对齐的异或压缩）
+
+    每个值与前一个值的 64 位表示异或：
+    - 异或结果为 0：写 1 字节 0x00
+    - 否则写 1 字节头 0x80 | 前导零字节数 << 3 | 末尾零字节数，再写中间的非零字节
+    """
+    out = bytearray([CODEC_VERSION])
+    _write_varint(out, len(values))
+    previous = 0
+    for value in values:
+        bits = struct.unpack('<Q', struct.pack('<d', float(value)))[0]
+        xor = bits ^ previous
+        previous = bits
+        if xor == 0:
+            out.append(0)
+            continue
+        raw = xor.to_bytes(8, 'big')
+        leading = 0
+        while raw[leading] == 0:
+            leading += 1
+        trailing = 0
+        while raw[7 - trailing] == 0:
+            trailing += 1
+        out.append(0x80 | (leading << 3) | trailing)
+        out += raw[leading:8 - trailing]
+    return bytes(out)
+
+
+def decode_values(data: bytes) -> List[float]:
+    """解码浮点数值列"""
+    if not data or data[0] != CODEC_VERSION:
+        raise ValueError("不支持的数值编码格式")
+    count, pos = _read_varint(data, 1)
+    result = array('d')
+    previous = 0
+    for _ in range(count):
+        header = data[pos]
+        pos += 1
+        if header:
+            leading = (header >> 3) & 0x07
+            trailing = header & 0x07
+            size = 8 - leading - trailing
+            xor = int.from_bytes(data[pos:pos + size], 'big') << (trailing * 8)
+            pos += size
+            previous ^= xor
+        result.append(struct.unpack('<d', struct.pack('<Q', previous))[0])
+    return result.tolist()
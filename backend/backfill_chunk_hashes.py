@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+为已有文本块计算内容哈希，使其向量可被复用（需先执行 SQL/update/04_add_chunk_content_hash.sql）
+使用方法: python backfill_chunk_hashes.py --model text-embedding-v4 [--batch-size 500]
+"""
+import sys
+import argparse
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.models.document import DocumentChunk
+from app.utils.embedding_codec import chunk_content_hash
+
+
+def backfill_hashes(model: str, batch_size: int) -> bool:
+    """分批为 content_hash 为空的文本块计算哈希"""
+    db: Session = SessionLocal()
+
+    try:
+        total = db.query(DocumentChunk.id).filter(DocumentChunk.content_hash.is_(None)).count()
+
+        print(f"📋 待计算哈希文本块: {total} 个，向量模型: {model}")
+        if total == 0:
+            print("✅ 没有需要处理的数据")
+            return True
+
+        processed = 0
+        last_id = 0
+        while True:
+            # 按主键分页，避免 OFFSET 越翻越慢
+            rows = db.query(DocumentChunk.id, DocumentChunk.content).filter(
+                DocumentChunk.id > last_id,
+                DocumentChunk.content_hash.is_(None)
+            ).order_by(DocumentChunk.id).limit(batch_size).all()
+
+            if not rows:
+                break
+
+            db.bulk_update_mappings(DocumentChunk, [
+                {'id': chunk_id, 'content_hash': chunk_content_hash(content, model)}
+                for chunk_id, content in rows
+            ])
+            db.commit()
+
+            last_id = rows[-1][0]
+            processed += len(rows)
+            print(f"   已处理 {processed}/{total}")
+
+        print(f"")
+        print(f"✅ 处理完成，共 {processed} 个文本块")
+        return True
+
+    except Exception as e:
+        print(f"❌ 处理失败: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文本块内容哈希回填工具")
+    parser.add_argument("--model", required=True, help="生成已有向量的模型名称（如 text-embedding-v4）")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批处理数量")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  CodeHubot - 文本块内容哈希回填工具")
+    print("=" * 60)
+
+    success = backfill_hashes(args.model, args.batch_size)
+    sys.exit(0 if success else 1)
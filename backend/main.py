@@ -2,49 +2,21 @@ from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError, HTTPException
 from contextlib import asynccontextmanager
 from app.api import api_router
 from app.core.config import settings
 from app.core.database import engine
-from app.core.response import StandardResponse, ErrorResponse, success_response, error_response, error_response_dict
+from app.core.response import error_response_dict, EnvelopeJSONResponse, FastJSONResponse
 from app.models import user, device, product, firmware
 # from app.services.mqtt_service import mqtt_service  # MQTT服务已独立部署
 import logging
 import os
-from datetime import datetime
-from typing import Any
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 自定义JSONResponse类，确保datetime带有UTC标识
-class CustomJSONResponse(JSONResponse):
-    def render(self, content: Any) -> bytes:
-        """重写render方法，自定义datetime序列化"""
-        def custom_encoder(obj):
-            if isinstance(obj, datetime):
-                # 添加Z后缀表示UTC时间
-                iso_str = obj.isoformat()
-                return iso_str + 'Z' if not iso_str.endswith('Z') and '+' not in iso_str else iso_str
-            return obj
-        
-        # 递归处理所有datetime对象
-        def process_content(data):
-            if isinstance(data, dict):
-                return {k: process_content(v) for k, v in data.items()}
-            elif isinstance(data, list):
-                return [process_content(item) for item in data]
-            elif isinstance(data, datetime):
-                return custom_encoder(data)
-            else:
-                return data
-        
-        processed_content = process_content(content)
-        return super().render(processed_content)
-
 # 创建数据库表（已禁用，直接在数据库中初始化）
 # 注意：需要先导入所有模型，SQLAlchemy会自动处理外键依赖关系
 from app.models import team, course_model, device_group, knowledge_base, document, kb_analytics  # 导入所有模型
@@ -75,18 +47,38 @@ async def lifespan(app: FastAPI):
     # MQTT服务已独立部署，不再在backend启动
     # mqtt_service.start()
     
+    # 启动共享MQTT发布客户端（设备控制指令复用长连接）
+    from app.core.mqtt_publisher import get_mqtt_publisher
+    get_mqtt_publisher()
+    
     yield
     
     # 应用关闭时
     logger.info("🛑 关闭 CodeHubot AIoT 智能体平台")
     # mqtt_service.stop()
+    
+    from app.core.mqtt_publisher import stop_mqtt_publisher
+    stop_mqtt_publisher()
+    
+    from app.services.sensor_push import sensor_push_hub
+    await sensor_push_hub.stop()
+    
+    # 写入尚未落库的设备心跳
+    from app.services.device_heartbeat import heartbeat_write_behind
+    await heartbeat_write_behind.stop()
+    
+    from app.core.redis_client import close_async_redis
+    await close_async_redis()
+    
+    from app.core.http_client import close_http_clients
+    await close_http_clients()
 
 app = FastAPI(
     title="CodeHubot - AIoT智能体平台",
     description="开源的AIoT智能体开发与管理平台，支持AI Agent与IoT设备的深度融合",
     version="1.0.0",
     lifespan=lifespan,
-    default_response_class=CustomJSONResponse  # 使用自定义JSONResponse
+    default_response_class=EnvelopeJSONResponse  # 序列化时一次性包装统一响应格式
     # 注意：FastAPI默认会自动处理尾部斜杠重定向
 )
 
@@ -99,68 +91,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 统一响应格式中间件
-from starlette.responses import StreamingResponse
-import json
-
-@app.middleware("http")
-async def response_middleware(request: Request, call_next):
-    """统一响应格式中间件，自动包装所有响应"""
-    # 跳过静态文件、文档和健康检查端点
-    skip_paths = ["/static", "/docs", "/openapi.json", "/redoc"]
-    if any(request.url.path.startswith(path) for path in skip_paths) or request.url.path in ["/", "/health"]:
-        response = await call_next(request)
-        return response
-    
-    response = await call_next(request)
-    
-    # 204 No Content 直接返回，不需要包装
-    if response.status_code == 204:
-        return response
-    
-    # 只处理成功的 JSON 响应（200-299）
-    if 200 <= response.status_code < 300:
-        # 检查 content-type 是否为 JSON
-        content_type = response.headers.get("content-type", "")
-        is_json = "application/json" in content_type or isinstance(response, JSONResponse)
-        
-        if is_json:
-            # 读取响应体
-            body = b""
-            async for chunk in response.body_iterator:
-                body += chunk
-            
-            try:
-                # 解析 JSON
-                data = json.loads(body.decode('utf-8'))
-                
-                # 准备新的响应头（移除 Content-Length，让 FastAPI 自动计算）
-                new_headers = dict(response.headers)
-                new_headers.pop("content-length", None)  # 移除旧的 Content-Length
-                
-                # 如果响应已经是标准格式（有 code 字段），直接返回
-                if isinstance(data, dict) and "code" in data:
-                    # 重新创建响应
-                    return CustomJSONResponse(
-                        content=data,
-                        status_code=response.status_code,
-                        headers=new_headers
-                    )
-                
-                # 包装为标准格式
-                wrapped_data = success_response(data=data, message="操作成功")
-                return CustomJSONResponse(
-                    content=wrapped_data,  # wrapped_data 已经是字典
-                    status_code=response.status_code,
-                    headers=new_headers
-                )
-            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError) as e:
-                # 如果不是 JSON 或解析失败，返回原响应
-                logger.warning(f"响应解析失败: {e}, 路径: {request.url.path}")
-                return response
-    
-    return response
-
 # 全局异常处理器
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -204,11 +134,11 @@ static_dir = os.path.join(os.path.dirname(__file__), "static")
 if os.path.exists(static_dir):
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
-@app.get("/")
+@app.get("/", response_class=FastJSONResponse)
 async def root():
     return {"message": "物联网设备服务系统 API"}
 
-@app.get("/health")
+@app.get("/health", response_class=FastJSONResponse)
 async def health_check():
     return {"status": "healthy"}
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+将文本块的 JSON 向量迁移为二进制存储（需先执行 SQL/update/03_add_chunk_embedding_blob.sql）
+使用方法: python migrate_embedding_storage.py [--dtype float32|float16|int8] [--batch-size 500] [--clear-json]
+"""
+import sys
+import argparse
+from sqlalchemy import null
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.document import DocumentChunk
+from app.utils.embedding_codec import encode_embedding, SUPPORTED_DTYPES
+
+
+def migrate_embeddings(dtype: str, batch_size: int, clear_json: bool) -> bool:
+    """分批将 embedding_vector 转换为 embedding_blob"""
+    db: Session = SessionLocal()
+
+    # 清空JSON时，已迁移过的文本块也需要处理
+    filters = [DocumentChunk.embedding_vector.isnot(None)]
+    if not clear_json:
+        filters.append(DocumentChunk.embedding_blob.is_(None))
+
+    try:
+        total = db.query(DocumentChunk.id).filter(*filters).count()
+
+        print(f"📋 待迁移文本块: {total} 个，存储格式: {dtype}")
+        if total == 0:
+            print("✅ 没有需要迁移的数据")
+            return True
+
+        migrated = 0
+        last_id = 0
+        while True:
+            # 按主键分页，避免 OFFSET 越翻越慢
+            rows = db.query(
+                DocumentChunk.id,
+                DocumentChunk.embedding_vector,
+                DocumentChunk.embedding_blob.isnot(None)
+            ).filter(
+                DocumentChunk.id > last_id,
+                *filters
+            ).order_by(DocumentChunk.id).limit(batch_size).all()
+
+            if not rows:
+                break
+
+            mappings = []
+            for chunk_id, embedding, has_blob in rows:
+                last_id = chunk_id
+                if has_blob or not embedding:
+                    continue
+                blob, scale = encode_embedding(embedding, dtype)
+                mappings.append({
+                    'id': chunk_id,
+                    'embedding_blob': blob,
+                    'embedding_dtype': dtype,
+                    'embedding_scale': scale
+                })
+
+            if mappings:
+                db.bulk_update_mappings(DocumentChunk, mappings)
+            if clear_json:
+                # 使用SQL NULL（JSON字段的Python None会被写成JSON null）
+                db.query(DocumentChunk).filter(
+                    DocumentChunk.id.in_([row[0] for row in rows])
+                ).update({DocumentChunk.embedding_vector: null()}, synchronize_session=False)
+            db.commit()
+
+            migrated += len(rows)
+            print(f"   已迁移 {migrated}/{total}")
+
+        print(f"")
+        print(f"✅ 迁移完成，共 {migrated} 个文本块")
+        if not clear_json:
+            print(f"💡 确认检索正常后，可使用 --clear-json 重新执行以清空旧的 JSON 向量")
+        return True
+
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文本块向量存储迁移工具")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default=settings.embedding_storage_dtype, help="存储格式")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批处理数量")
+    parser.add_argument("--clear-json", action="store_true", help="迁移后清空 embedding_vector 字段")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("  CodeHubot - 文本块向量存储迁移工具")
+    print("=" * 60)
+
+    success = migrate_embeddings(args.dtype, args.batch_size, args.clear_json)
+    sys.exit(0 if success else 1)
@@ -5,18 +5,25 @@
 import sys
 from pathlib import Path
 import time
-import json
 import logging
 
 # 确保可以导入backend模块
 backend_dir = Path(__file__).parent.parent.parent / 'backend'
 sys.path.insert(0, str(backend_dir))
 
+from celery.signals import worker_process_shutdown
 from celery_app import celery_app
 
 logger = logging.getLogger(__name__)
 
 
+@worker_process_shutdown.connect
+def _stop_mqtt_publisher(**kwargs):
+    """worker子进程退出时关闭共享MQTT发布客户端"""
+    from app.core.mqtt_publisher import stop_mqtt_publisher
+    stop_mqtt_publisher()
+
+
 @celery_app.task(
     name='execute_preset_sequence',
     bind=True,
@@ -44,34 +51,12 @@ def execute_preset_sequence_task(self, device_uuid: str, steps: list):
     """
     logger.info(f"开始执行预设序列任务: device={device_uuid}, task_id={self.request.id}, steps={len(steps)}")
     
-    # 导入MQTT服务（延迟导入，确保环境加载）
+    # 使用当前worker进程的共享MQTT发布客户端（延迟导入，确保环境加载）
     try:
-        from app.services.mqtt_service import mqtt_service
-    except ImportError as e:
-        logger.error(f"无法导入mqtt_service: {e}")
-        # 尝试创建本地MQTT客户端
-        mqtt_service = None
-    
-    if not mqtt_service:
-        error_msg = "MQTT服务未初始化"
-        logger.error(error_msg)
-        return {
-            "success": False,
-            "error": error_msg,
-            "device_uuid": device_uuid
-        }
-    
-    # 检查MQTT连接
-    if not mqtt_service.client or not mqtt_service.is_connected:
-        # 尝试连接
-        try:
-            mqtt_service.start()
-            time.sleep(2)  # 等待连接
-        except Exception as e:
-            logger.error(f"MQTT连接失败: {e}")
-    
-    if not mqtt_service.client or not mqtt_service.is_connected:
-        error_msg = "MQTT服务未连接"
+        from app.core.mqtt_publisher import get_mqtt_publisher, MQTTPublishError
+        publisher = get_mqtt_publisher()
+    except Exception as e:
+        error_msg = f"MQTT发布客户端初始化失败: {e}"
         logger.error(error_msg)
         return {
             "success": False,
@@ -134,42 +119,41 @@ def execute_preset_sequence_task(self, device_uuid: str, steps: list):
                     converted_command["duty_cycle"] = converted_command.pop("duty")
                 converted_command.pop("device_type", None)
             
-            # 发送MQTT消息
+            # 发送MQTT消息（等待Broker确认）
             try:
-                message = json.dumps(converted_command)
-                result = mqtt_service.client.publish(control_topic, message, qos=1)
+                publisher.publish(control_topic, converted_command, qos=1)
                 
-                if result.rc == 0:
-                    logger.info(
-                        f"✅ 步骤 {index}/{len(steps)} 执行成功 - "
-                        f"设备: {device_uuid}, 命令: {converted_command}"
-                    )
-                    
-                    # 获取延迟时间
-                    delay = step.get("delay", 0)
-                    
-                    executed_steps.append({
-                        "step": index,
-                        "command": converted_command,
-                        "delay": delay,
-                        "status": "success"
-                    })
-                    
-                    # 如果不是最后一步，执行延迟
-                    if index < len(steps) and delay > 0:
-                        logger.info(f"⏳ 步骤 {index} 执行完成，等待 {delay} 秒...")
-                        time.sleep(delay)  # 在Celery Worker中可以安全使用time.sleep
-                else:
-                    error_msg = f"MQTT消息发送失败，rc={result.rc}"
-                    logger.error(f"❌ 步骤 {index} {error_msg}")
-                    errors.append({"step": index, "error": error_msg})
-                    executed_steps.append({
-                        "step": index,
-                        "command": converted_command,
-                        "delay": step.get("delay", 0),
-                        "status": "failed",
-                        "error": error_msg
-                    })
+                logger.info(
+                    f"✅ 步骤 {index}/{len(steps)} 执行成功 - "
+                    f"设备: {device_uuid}, 命令: {converted_command}"
+                )
+                
+                # 获取延迟时间
+                delay = step.get("delay", 0)
+                
+                executed_steps.append({
+                    "step": index,
+                    "command": converted_command,
+                    "delay": delay,
+                    "status": "success"
+                })
+                
+                # 如果不是最后一步，执行延迟
+                if index < len(steps) and delay > 0:
+                    logger.info(f"⏳ 步骤 {index} 执行完成，等待 {delay} 秒...")
+                    time.sleep(delay)  # 在Celery Worker中可以安全使用time.sleep
+            
+            except MQTTPublishError as e:
+                error_msg = f"MQTT消息发送失败: {str(e)}"
+                logger.error(f"❌ 步骤 {index} {error_msg}")
+                errors.append({"step": index, "error": error_msg})
+                executed_steps.append({
+                    "step": index,
+                    "command": converted_command,
+                    "delay": step.get("delay", 0),
+                    "status": "failed",
+                    "error": error_msg
+                })
                     
             except Exception as e:
                 error_msg = f"执行失败: {str(e)}"
@@ -25,6 +25,37 @@ class Settings:
     DB_USER: str = os.getenv("DB_USER", "root")
     DB_PASSWORD: str = os.getenv("DB_PASSWORD", "")
     
+    # 数据写入流水线配置
+    INGEST_QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))  # 写入队列容量（消息数）
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "1000"))  # 每批最多合并的消息数
+    INGEST_FLUSH_INTERVAL: float = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # 攒批等待时间（秒）
+    INGEST_ENQUEUE_TIMEOUT: float = float(os.getenv("INGEST_ENQUEUE_TIMEOUT", "5"))  # 队列满时最多阻塞时间（秒），超时丢弃
+    INGEST_LAG_WARNING_SECONDS: float = float(os.getenv("INGEST_LAG_WARNING_SECONDS", "10"))  # 写入延迟告警阈值（秒）
+    INGEST_SEEN_FLUSH_INTERVAL: float = float(os.getenv("INGEST_SEEN_FLUSH_INTERVAL", "5"))  # 设备在线时间合并写入间隔（秒），0表示每批次写入
+    # 实时推送配置（批次提交后把设备增量发布到 Redis，由 backend 推送给 WebSocket/SSE 客户端）
+    SENSOR_PUSH_ENABLED: bool = os.getenv("SENSOR_PUSH_ENABLED", "true").lower() == "true"
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379")
+    SENSOR_PUSH_CHANNEL: str = os.getenv("SENSOR_PUSH_CHANNEL", "device:sensor_updates")  # 需与backend一致
+    # 设备注册表缓存（已知设备不再每批次查询 device_main）
+    DEVICE_REGISTRY_CACHE_SIZE: int = int(os.getenv("DEVICE_REGISTRY_CACHE_SIZE", "100000"))  # 最多缓存的设备数（0表示禁用）
+    DEVICE_REGISTRY_TTL: float = float(os.getenv("DEVICE_REGISTRY_TTL", "300"))  # 已知设备缓存有效期（秒）
+    DEVICE_REGISTRY_NEGATIVE_TTL: float = float(os.getenv("DEVICE_REGISTRY_NEGATIVE_TTL", "60"))  # 不存在设备的缓存有效期（秒），新注册设备最长在此时间后开始接收
+    # 设备在线检测（超时未收到消息的设备由检测线程批量置为离线）
+    DEVICE_OFFLINE_TIMEOUT_MINUTES: int = int(os.getenv("DEVICE_OFFLINE_TIMEOUT_MINUTES", "5"))  # 离线超时（分钟），需与backend一致
+    LIVENESS_SWEEP_INTERVAL: float = float(os.getenv("LIVENESS_SWEEP_INTERVAL", "10"))  # 检测间隔（秒）
+    LIVENESS_RELOAD_INTERVAL: float = float(os.getenv("LIVENESS_RELOAD_INTERVAL", "300"))  # 从数据库重新加载在线设备的间隔（秒）
+    # 历史数据配置（原始读数分段压缩存储 + 分钟/小时聚合，按天分区）
+    HISTORY_ENABLED: bool = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+    HISTORY_SEGMENT_SECONDS: float = float(os.getenv("HISTORY_SEGMENT_SECONDS", "300"))  # 原始数据分段时长（秒）
+    HISTORY_SEGMENT_MAX_POINTS: int = int(os.getenv("HISTORY_SEGMENT_MAX_POINTS", "1000"))  # 单段最多数据点数
+    HISTORY_ROLLUP_INTERVAL: float = float(os.getenv("HISTORY_ROLLUP_INTERVAL", "60"))  # 聚合数据写入间隔（秒）
+    HISTORY_RAW_RETENTION_DAYS: int = int(os.getenv("HISTORY_RAW_RETENTION_DAYS", "7"))  # 原始数据保留天数
+    HISTORY_1M_RETENTION_DAYS: int = int(os.getenv("HISTORY_1M_RETENTION_DAYS", "30"))  # 分钟聚合保留天数
+    HISTORY_1H_RETENTION_DAYS: int = int(os.getenv("HISTORY_1H_RETENTION_DAYS", "365"))  # 小时聚合保留天数
+    HISTORY_PARTITION_CHECK_INTERVAL: int = int(os.getenv("HISTORY_PARTITION_CHECK_INTERVAL", "3600"))  # 分区维护间隔（秒）
+    
+    STATS_INTERVAL: int = int(os.getenv("STATS_INTERVAL", "300"))  # 统计信息打印间隔（秒）
+    
     # 数据库URL
     @property
     def DATABASE_URL(self) -> str:
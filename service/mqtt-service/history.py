@@ -0,0 +1,405 @@
+"""
+传感器历史数据写入
+device_sensors 只保留每个传感器的最新值，本模块把每个原始读数追加到历史存储：
+- 原始数据：按 (设备, 传感器) 在内存中用数组缓冲，满一段（时长或点数）后编码为
+  时间戳列 + 数值列两个二进制块，写入 device_sensor_segments 一行
+- 预聚合：同时累计 1 分钟 / 1 小时的最小/最大/总和/点数，定期 UPSERT 到聚合表
+- 分区维护：三张表按 day 分区，定期创建未来分区、整体删除超过保留期的分区
+
+写入方法只在写入线程中调用（与 SensorIngestPipeline 同一线程），不需要加锁。
+内存中未落库的数据最多滞后一个分段/聚合周期，进程异常退出时会丢失。
+"""
+import logging
+import math
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from timeseries_codec import datetime_to_ms, encode_timestamps, encode_values, ms_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# 历史数据统一使用不带时区的北京时间（与 device_sensors、last_seen 一致）
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+SEGMENTS_TABLE = "device_sensor_segments"
+ROLLUP_TABLES = {
+    "1m": "device_sensor_rollups_1m",
+    "1h": "device_sensor_rollups_1h",
+}
+# 聚合粒度（毫秒）
+ROLLUP_BUCKET_MS = {
+    "1m": 60 * 1000,
+    "1h": 3600 * 1000,
+}
+
+INSERT_SEGMENT_SQL = text(f"""
+    INSERT INTO {SEGMENTS_TABLE}
+    (day, device_uuid, sensor_name, start_time, end_time, point_count, ts_blob, value_blob)
+    VALUES (:day, :device_uuid, :sensor_name, :start_time, :end_time, :point_count, :ts_blob, :value_blob)
+""")
+
+
+def _upsert_rollup_sql(table: str):
+    return text(f"""
+        INSERT INTO {table}
+        (day, device_uuid, sensor_name, bucket_start, min_value, max_value, sum_value, point_count)
+        VALUES (:day, :device_uuid, :sensor_name, :bucket_start, :min_value, :max_value, :sum_value, :point_count)
+        ON DUPLICATE KEY UPDATE
+            min_value = LEAST(min_value, VALUES(min_value)),
+            max_value = GREATEST(max_value, VALUES(max_value)),
+            sum_value = sum_value + VALUES(sum_value),
+            point_count = point_count + VALUES(point_count)
+    """)
+
+
+UPSERT_ROLLUP_SQL = {resolution: _upsert_rollup_sql(table) for resolution, table in ROLLUP_TABLES.items()}
+
+# 单条 SQL 最多包含的行数
+SQL_CHUNK_SIZE = 500
+
+
+def to_history_value(value: Any) -> Optional[float]:
+    """只记录数值/布尔读数（布尔记为 0/1），其余类型和 NaN/Inf 忽略"""
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    return None
+
+
+class _SeriesBuffer:
+    """单个传感器尚未落库的原始数据"""
+
+    __slots__ = ("timestamps", "values", "opened_at")
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.values = array('d')
+        self.opened_at = time.monotonic()
+
+
+class TimeSeriesWriter:
+    """传感器历史数据写入（原始分段 + 分钟/小时聚合）"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        segment_seconds: float = 300,
+        segment_max_points: int = 1000,
+        rollup_interval: float = 60
+    ):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            segment_seconds: 原始数据分段时长（秒），到期后写入一段
+            segment_max_points: 单段最多数据点数，达到后立即写入
+            rollup_interval: 聚合数据写入间隔（秒）
+        """
+        self.session_factory = session_factory
+        self.segment_seconds = segment_seconds
+        self.segment_max_points = segment_max_points
+        self.rollup_interval = rollup_interval
+
+        self._series: Dict[Tuple[str, str], _SeriesBuffer] = {}
+        # 粒度 -> (设备, 传感器, 桶起始毫秒) -> [最小值, 最大值, 总和, 点数]
+        self._rollups: Dict[str, Dict[Tuple[str, str, int], List[float]]] = {
+            resolution: {} for resolution in ROLLUP_TABLES
+        }
+        self._last_rollup_flush = time.monotonic()
+
+        self.stats = {
+            "points": 0,             # 追加的数据点数
+            "skipped_values": 0,     # 非数值被忽略的读数
+            "segments": 0,           # 已写入的分段数
+            "segment_points": 0,     # 已写入分段的数据点数
+            "segment_bytes": 0,      # 已写入分段的编码字节数
+            "rollup_rows": 0,        # 已写入的聚合行数（UPSERT）
+            "failed_points": 0,      # 写入失败丢失的数据点数
+        }
+
+    # ------------------------------------------------------------------
+    # 追加（写入线程，批次提交后调用）
+    # ------------------------------------------------------------------
+
+    def append(self, device_uuid: str, sensor_name: str, timestamp: datetime, value: Any):
+        number = to_history_value(value)
+        if number is None:
+            self.stats["skipped_values"] += 1
+            return
+        if timestamp.tzinfo is not None:
+            # 带时区的时间（如 UTC 的 ...Z）先换算为北京时间，否则会与其他数据相差 8 小时
+            timestamp = timestamp.astimezone(BEIJING_TZ).replace(tzinfo=None)
+        ts = datetime_to_ms(timestamp)
+
+        key = (device_uuid, sensor_name)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _SeriesBuffer()
+        series.timestamps.append(ts)
+        series.values.append(number)
+
+        for resolution, bucket_ms in ROLLUP_BUCKET_MS.items():
+            bucket_key = (device_uuid, sensor_name, ts - ts % bucket_ms)
+            aggregate = self._rollups[resolution].get(bucket_key)
+            if aggregate is None:
+                self._rollups[resolution][bucket_key] = [number, number, number, 1]
+            else:
+                if number < aggregate[0]:
+                    aggregate[0] = number
+                if number > aggregate[1]:
+                    aggregate[1] = number
+                aggregate[2] += number
+                aggregate[3] += 1
+
+        self.stats["points"] += 1
+
+    # ------------------------------------------------------------------
+    # 落库
+    # ------------------------------------------------------------------
+
+    def flush_due(self, force: bool = False):
+        """写入到期的分段和聚合数据（写入线程循环中调用，force=True 时全部写入）"""
+        now = time.monotonic()
+        due = [
+            key for key, series in self._series.items()
+            if force
+            or len(series.values) >= self.segment_max_points
+            or now - series.opened_at >= self.segment_seconds
+        ]
+        rollups_due = force or now - self._last_rollup_flush >= self.rollup_interval
+        if not due and not rollups_due:
+            return
+
+        segments = [(key, self._series.pop(key)) for key in due]
+        rollups = None
+        if rollups_due:
+            rollups = self._rollups
+            self._rollups = {resolution: {} for resolution in ROLLUP_TABLES}
+            self._last_rollup_flush = now
+
+        db = self.session_factory()
+        try:
+            segment_rows = []
+            for (device_uuid, sensor_name), series in segments:
+                segment_rows.extend(self._encode_segments(device_uuid, sensor_name, series))
+            for i in range(0, len(segment_rows), SQL_CHUNK_SIZE):
+                db.execute(INSERT_SEGMENT_SQL, segment_rows[i:i + SQL_CHUNK_SIZE])
+
+            rollup_count = 0
+            for resolution, aggregates in (rollups or {}).items():
+                rows = [
+                    {
+                        "day": ms_to_datetime(bucket).date(),
+                        "device_uuid": device_uuid,
+                        "sensor_name": sensor_name,
+                        "bucket_start": ms_to_datetime(bucket),
+                        "min_value": aggregate[0],
+                        "max_value": aggregate[1],
+                        "sum_value": aggregate[2],
+                        "point_count": aggregate[3],
+                    }
+                    for (device_uuid, sensor_name, bucket), aggregate in aggregates.items()
+                ]
+                for i in range(0, len(rows), SQL_CHUNK_SIZE):
+                    db.execute(UPSERT_ROLLUP_SQL[resolution], rows[i:i + SQL_CHUNK_SIZE])
+                rollup_count += len(rows)
+
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            lost = sum(len(series.values) for _, series in segments)
+            self.stats["failed_points"] += lost
+            restored = self._restore_rollups(rollups) if rollups else 0
+            logger.error(f"❌ 历史数据写入失败，丢弃 {len(segments)} 个分段（{lost} 个数据点），"
+                         f"{restored} 个聚合桶下次重试: {e}")
+            return
+        finally:
+            db.close()
+
+        self.stats["segments"] += len(segment_rows)
+        self.stats["segment_points"] += sum(row["point_count"] for row in segment_rows)
+        self.stats["segment_bytes"] += sum(len(row["ts_blob"]) + len(row["value_blob"]) for row in segment_rows)
+        self.stats["rollup_rows"] += rollup_count
+
+    def _restore_rollups(self, rollups: Dict[str, Dict[Tuple[str, str, int], List[float]]]) -> int:
+        """写入失败的聚合数据合并回内存（事务已回滚，下次写入时重试），返回聚合桶数"""
+        restored = 0
+        for resolution, aggregates in rollups.items():
+            current = self._rollups[resolution]
+            for bucket_key, aggregate in aggregates.items():
+                existing = current.get(bucket_key)
+                if existing is None:
+                    current[bucket_key] = aggregate
+                else:
+                    existing[0] = min(existing[0], aggregate[0])
+                    existing[1] = max(existing[1], aggregate[1])
+                    existing[2] += aggregate[2]
+                    existing[3] += aggregate[3]
+                restored += 1
+        return restored
+
+    @staticmethod
+    def _encode_segments(device_uuid: str, sensor_name: str, series: _SeriesBuffer) -> List[Dict[str, Any]]:
+        """按时间排序后编码，跨天的数据拆成多段（每段只属于一个日期分区）"""
+        points = sorted(zip(series.timestamps, series.values))
+        day_ms = 86400 * 1000
+        rows = []
+        start = 0
+        while start < len(points):
+            day_end = points[start][0] - points[start][0] % day_ms + day_ms
+            end = start
+            while end < len(points) and points[end][0] < day_end:
+                end += 1
+            timestamps = [point[0] for point in points[start:end]]
+            values = [point[1] for point in points[start:end]]
+            start_time = ms_to_datetime(timestamps[0])
+            rows.append({
+                "day": start_time.date(),
+                "device_uuid": device_uuid,
+                "sensor_name": sensor_name,
+                "start_time": start_time,
+                "end_time": ms_to_datetime(timestamps[-1]),
+                "point_count": len(timestamps),
+                "ts_blob": encode_timestamps(timestamps),
+                "value_blob": encode_values(values),
+            })
+            start = end
+        return rows
+
+    def get_metrics(self) -> Dict[str, Any]:
+        points = self.stats["segment_points"]
+        return {
+            **self.stats,
+            "buffered_series": len(self._series),
+            "buffered_points": sum(len(series.values) for series in self._series.values()),
+            "bytes_per_point": round(self.stats["segment_bytes"] / points, 2) if points else None,
+        }
+
+
+class PartitionManager:
+    """历史数据表分区维护（独立线程，定期执行）"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        retention_days: Dict[str, int],
+        check_interval: float = 3600
+    ):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            retention_days: 表名 -> 保留天数
+            check_interval: 检查间隔（秒）
+        """
+        self.session_factory = session_factory
+        self.retention_days = retention_days
+        self.check_interval = check_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sensor-history-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"❌ 历史数据分区维护失败: {e}", exc_info=True)
+            self._stop_event.wait(self.check_interval)
+
+    def maintain(self, today: Optional[date] = None):
+        """为每张表创建未来分区、删除过期分区"""
+        # day 分区键是北京时间的日期，不使用主机本地时区
+        today = today or datetime.now(BEIJING_TZ).date()
+        for table, retention in self.retention_days.items():
+            monthly = table == ROLLUP_TABLES["1h"]
+            cutoff = today - timedelta(days=retention)
+            db = self.session_factory()
+            try:
+                partitions = self._load_partitions(db, table)
+                if not partitions:
+                    # 未分区的表（手工建表时未加分区）：按日期删除
+                    result = db.execute(text(f"DELETE FROM {table} WHERE day < :cutoff"), {"cutoff": cutoff})
+                    db.commit()
+                    if result.rowcount:
+                        logger.info(f"🧹 {table} 未分区，已删除 {result.rowcount} 行过期数据")
+                    continue
+
+                created = self._create_future_partitions(db, table, partitions, today, monthly)
+                dropped = [name for name, bound in partitions.items() if bound is not None and bound <= cutoff]
+                if dropped:
+                    db.execute(text(f"ALTER TABLE {table} DROP PARTITION {', '.join(dropped)}"))
+                if created or dropped:
+                    logger.info(f"🗂️ {table} 分区维护完成：新建 {len(created)} 个，删除过期 {len(dropped)} 个")
+            finally:
+                db.close()
+        logger.info("✅ 历史数据分区维护完成")
+
+    @staticmethod
+    def _load_partitions(db: Session, table: str) -> Dict[str, Optional[date]]:
+        """分区名 -> 上界（不含），MAXVALUE 分区为 None"""
+        rows = db.execute(text("""
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+        """), {"table": table}).fetchall()
+        partitions: Dict[str, Optional[date]] = {}
+        for name, description in rows:
+            bound = (description or "").strip("'\"")
+            partitions[name] = None if bound.upper() == "MAXVALUE" else date.fromisoformat(bound)
+        return partitions
+
+    @staticmethod
+    def _create_future_partitions(
+        db: Session,
+        table: str,
+        partitions: Dict[str, Optional[date]],
+        today: date,
+        monthly: bool
+    ) -> List[str]:
+        """从 p_future 中拆出今天起的分区（按天分区提前 3 天，按月分区提前 2 个月）"""
+        if "p_future" not in partitions:
+            return []
+        highest = max((bound for bound in partitions.values() if bound is not None), default=None)
+
+        new_partitions = []
+        if monthly:
+            start = today.replace(day=1)
+            for _ in range(3):
+                end = (start + timedelta(days=32)).replace(day=1)
+                new_partitions.append((f"p{start:%Y%m}", end))
+                start = end
+        else:
+            for offset in range(4):
+                start = today + timedelta(days=offset)
+                new_partitions.append((f"p{start:%Y%m%d}", start + timedelta(days=1)))
+
+        # 新分区的上界必须大于已有分区
+        new_partitions = [
+            (name, end) for name, end in new_partitions
+            if name not in partitions and (highest is None or end > highest)
+        ]
+        if not new_partitions:
+            return []
+
+        definitions = ", ".join(f"PARTITION {name} VALUES LESS THAN ('{end.isoformat()}')" for name, end in new_partitions)
+        db.execute(text(
+            f"ALTER TABLE {table} REORGANIZE PARTITION p_future INTO "
+            f"({definitions}, PARTITION p_future VALUES LESS THAN (MAXVALUE))"
+        ))
+        return [name for name, _ in new_partitions]
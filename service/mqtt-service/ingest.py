@@ -0,0 +1,460 @@
+"""
+设备消息分级写入流水线
+MQTT 网络线程只负责解析消息并放入有界队列，由独立的写入线程批量落库：
+- 同一批次内按 (device_uuid, sensor_name) 合并，只写入最新值
+- 传感器数据使用多行 INSERT ... ON DUPLICATE KEY UPDATE
+- 设备 last_seen / is_online / last_heartbeat 延迟合并写入：内存中只保留每台设备的最新时间，
+  每 seen_flush_interval 秒按时间分组批量 UPDATE（同一批次的设备共用一条语句）
+- 队列满时回调线程阻塞等待（MQTT客户端暂停读取，形成背压），超时仍无空间则丢弃并计数
+- 批次提交后把合并后的设备增量交给 on_flushed 回调（用于实时推送）
+- 合并前的全部原始读数追加到历史存储（history），由写入线程定期分段落库
+- 设备是否存在由注册表缓存判断（registry），已知设备不查询数据库
+- 批次提交后刷新设备在线检测（liveness）中的最后在线时间，超时离线由检测线程批量处理
+- 批次写入失败时对半拆分重试，最终只丢弃无法写入的单条消息，个别设备的异常数据不影响其他设备
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from models import Device
+from history import TimeSeriesWriter
+from liveness import DeviceLivenessTracker
+from registry import DeviceRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class SensorReading(NamedTuple):
+    """单个传感器读数"""
+    sensor_name: str
+    sensor_value: Any
+    sensor_unit: str
+    sensor_type: str
+    timestamp: datetime
+
+
+class IngestMessage(NamedTuple):
+    """已解析的设备消息"""
+    device_uuid: str
+    message_type: str              # data / status / heartbeat
+    readings: List[SensorReading]  # 仅 data 消息
+    status: Optional[Dict[str, Any]]  # 仅 status 消息
+    received_time: datetime        # 接收时间（北京时间）
+    received_at: float             # 接收时刻（monotonic，用于计算延迟）
+
+
+UPSERT_SENSOR_SQL = text("""
+    INSERT INTO device_sensors
+    (device_uuid, sensor_name, sensor_value, sensor_unit, sensor_type, timestamp)
+    VALUES (:device_uuid, :sensor_name, :sensor_value, :sensor_unit, :sensor_type, :timestamp)
+    ON DUPLICATE KEY UPDATE
+        sensor_value = VALUES(sensor_value),
+        sensor_unit = VALUES(sensor_unit),
+        sensor_type = VALUES(sensor_type),
+        timestamp = VALUES(timestamp)
+""")
+
+UPDATE_SEEN_SQL = text("""
+    UPDATE device_main SET last_seen = :now, is_online = 1
+    WHERE uuid IN :uuids
+""").bindparams(bindparam("uuids", expanding=True))
+
+UPDATE_HEARTBEAT_SQL = text("""
+    UPDATE device_main SET last_heartbeat = :now
+    WHERE uuid IN :uuids
+""").bindparams(bindparam("uuids", expanding=True))
+
+# 单条 SQL 最多包含的行数 / IN 列表长度
+SQL_CHUNK_SIZE = 500
+
+
+def _chunks(items: List, size: int = SQL_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SensorIngestPipeline:
+    """设备消息批量写入流水线"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        queue_size: int = 10000,
+        batch_size: int = 1000,
+        flush_interval: float = 0.5,
+        enqueue_timeout: float = 5.0,
+        lag_warning_seconds: float = 10.0,
+        on_flushed: Optional[Callable[[Dict[str, Dict[str, Any]], datetime], None]] = None,
+        history: Optional[TimeSeriesWriter] = None,
+        liveness: Optional[DeviceLivenessTracker] = None,
+        registry: Optional[DeviceRegistry] = None,
+        seen_flush_interval: float = 5.0
+    ):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            queue_size: 队列容量（消息数）
+            batch_size: 每批最多合并的消息数
+            flush_interval: 攒批等待时间（秒），同一窗口内的重复上报只写最新值
+            enqueue_timeout: 队列满时回调线程最多阻塞的时间（秒），超时丢弃消息
+            lag_warning_seconds: 消息从接收到落库的延迟超过此值时告警
+            on_flushed: 批次提交后的回调，参数为 (设备UUID -> 增量数据, 批次时间)
+            history: 历史数据写入器（为空则不记录历史）
+            liveness: 设备在线检测（为空则不跟踪超时离线）
+            registry: 设备注册表缓存（为空则使用默认配置）
+            seen_flush_interval: 设备在线时间（last_seen/last_heartbeat）的合并写入间隔（秒），0 表示每批次写入
+        """
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.lag_warning_seconds = lag_warning_seconds
+        self.on_flushed = on_flushed
+        self.history = history
+        self.liveness = liveness
+        self.registry = registry or DeviceRegistry()
+        self.seen_flush_interval = seen_flush_interval
+        # 待写入的设备在线时间：设备UUID -> 最新时间（只在写入线程中访问）
+        self._pending_seen: Dict[str, datetime] = {}
+        self._pending_heartbeat: Dict[str, datetime] = {}
+        self._last_seen_flush = time.monotonic()
+        self.queue: "queue.Queue[IngestMessage]" = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计信息
+        self.stats = {
+            "enqueued": 0,              # 入队消息数
+            "dropped": 0,               # 队列持续满被丢弃的消息数
+            "backpressure_waits": 0,    # 入队时遇到队列已满的次数
+            "backpressure_seconds": 0.0,  # 回调线程因队列满累计阻塞时间
+            "queue_high_watermark": 0,  # 队列最高深度
+            "batches": 0,               # 已写入批次数
+            "written_messages": 0,      # 已落库消息数
+            "failed_messages": 0,       # 写入失败丢失的消息数（拆分到单条后仍失败）
+            "batch_splits": 0,          # 批次写入失败后拆分重试的次数
+            "unknown_device_messages": 0,  # 设备不存在被忽略的消息数
+            "seen_updates": 0,          # 收到的设备在线时间更新（每批次每设备一次）
+            "seen_rows": 0,             # 合并后实际写入的设备在线时间行数
+            "seen_flushes": 0,
+            "sensor_readings": 0,       # 收到的传感器读数
+            "sensor_rows": 0,           # 合并后实际写入的传感器行数
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "last_lag_seconds": 0.0,    # 最近一批最早消息的排队+写入延迟
+            "max_lag_seconds": 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """启动写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sensor-ingest-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"🚀 数据写入线程已启动（队列容量 {self.queue.maxsize}，批次 {self.batch_size}，"
+                    f"攒批 {self.flush_interval} 秒）")
+
+    def stop(self, timeout: float = 30.0):
+        """停止写入线程（先写完队列中剩余的消息）"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"⚠️ 数据写入线程未能在 {timeout} 秒内退出，剩余 {self.queue.qsize()} 条消息")
+            else:
+                logger.info("✅ 数据写入线程已停止")
+
+    # ------------------------------------------------------------------
+    # 生产者（MQTT 回调线程）
+    # ------------------------------------------------------------------
+
+    def submit(self, message: IngestMessage) -> bool:
+        """
+        放入写入队列
+
+        队列满时阻塞当前线程（MQTT 网络线程暂停读取，消息积压在 Broker 侧），
+        超过 enqueue_timeout 仍无空间则丢弃。
+
+        Returns:
+            bool: 是否成功入队
+        """
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.stats["backpressure_waits"] += 1
+            wait_start = time.monotonic()
+            try:
+                self.queue.put(message, timeout=self.enqueue_timeout)
+            except queue.Full:
+                self.stats["dropped"] += 1
+                logger.warning(f"⚠️ 写入队列已满 {self.enqueue_timeout} 秒，丢弃消息: "
+                               f"{message.device_uuid}/{message.message_type}")
+                return False
+            finally:
+                self.stats["backpressure_seconds"] += time.monotonic() - wait_start
+
+        self.stats["enqueued"] += 1
+        depth = self.queue.qsize()
+        if depth > self.stats["queue_high_watermark"]:
+            self.stats["queue_high_watermark"] = depth
+        return True
+
+    # ------------------------------------------------------------------
+    # 消费者（写入线程）
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            self._flush_seen()
+            if self.history is not None:
+                self.history.flush_due()
+        # 退出前写入内存中的在线时间和历史数据
+        self._flush_seen(force=True)
+        if self.history is not None:
+            self.history.flush_due(force=True)
+
+    def _next_batch(self) -> List[IngestMessage]:
+        """取一批消息：等待第一条后，在攒批窗口内继续收集，直到达到批次上限"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[IngestMessage]):
+        """合并并写入一批消息（单个事务，失败时对半拆分重试）"""
+        flush_start = time.monotonic()
+
+        # 按设备和传感器合并，后到的消息覆盖先到的
+        sensors: Dict[Tuple[str, str], SensorReading] = {}
+        statuses: Dict[str, List[Dict[str, Any]]] = {}
+        seen_uuids = set()
+        heartbeat_uuids = set()
+        latest_time = batch[0].received_time
+        reading_count = 0
+
+        for message in batch:
+            seen_uuids.add(message.device_uuid)
+            latest_time = max(latest_time, message.received_time)
+            if message.message_type == "data":
+                reading_count += len(message.readings)
+                for reading in message.readings:
+                    sensors[(message.device_uuid, reading.sensor_name)] = reading
+            elif message.message_type == "status":
+                statuses.setdefault(message.device_uuid, []).append(message.status or {})
+            elif message.message_type == "heartbeat":
+                heartbeat_uuids.add(message.device_uuid)
+
+        db = self.session_factory()
+        try:
+            known_uuids = set(self.registry.resolve(db, seen_uuids))
+
+            # 1. 传感器数据：多行 UPSERT（PyMySQL 会把 executemany 改写为单条多 VALUES 语句）
+            rows = [
+                {
+                    "device_uuid": device_uuid,
+                    "sensor_name": sensor_name,
+                    "sensor_value": str(reading.sensor_value),
+                    "sensor_unit": reading.sensor_unit or "",
+                    "sensor_type": reading.sensor_type or "",
+                    "timestamp": reading.timestamp
+                }
+                for (device_uuid, sensor_name), reading in sensors.items()
+                if device_uuid in known_uuids
+            ]
+            for chunk in _chunks(rows):
+                db.execute(UPSERT_SENSOR_SQL, chunk)
+
+            # 2. 设备状态：合并到 last_report_data.status（状态消息较少，按设备逐个处理）
+            status_uuids = [uuid for uuid in statuses if uuid in known_uuids]
+            for uuids in _chunks(status_uuids):
+                for device in db.query(Device).filter(Device.uuid.in_(uuids)):
+                    report = dict(device.last_report_data or {})
+                    merged_status = dict(report.get("status") or {})
+                    for status in statuses[device.uuid]:
+                        merged_status.update(status)
+                        if "status" in status:
+                            device.device_status = status["status"]
+                    report["status"] = merged_status
+                    # 重新赋值，确保 JSON 字段变更被检测到
+                    device.last_report_data = report
+
+            db.commit()
+
+            unknown_uuids = seen_uuids - known_uuids
+            if unknown_uuids:
+                unknown_count = sum(1 for m in batch if m.device_uuid in unknown_uuids)
+                self.stats["unknown_device_messages"] += unknown_count
+                logger.warning(f"⚠️ 设备不存在，忽略 {unknown_count} 条消息: {sorted(unknown_uuids)[:5]}")
+
+            now = time.monotonic()
+            lag = now - min(m.received_at for m in batch)
+            self.stats["batches"] += 1
+            self.stats["written_messages"] += len(batch)
+            self.stats["sensor_readings"] += reading_count
+            self.stats["sensor_rows"] += len(rows)
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_flush_ms"] = round((now - flush_start) * 1000, 2)
+            self.stats["last_lag_seconds"] = round(lag, 3)
+            self.stats["max_lag_seconds"] = max(self.stats["max_lag_seconds"], round(lag, 3))
+
+            logger.debug(f"✅ 批次写入完成: {len(batch)} 条消息，{len(rows)} 行传感器数据，"
+                         f"{len(known_uuids)} 台设备，耗时 {self.stats['last_flush_ms']}ms")
+            if lag > self.lag_warning_seconds:
+                logger.warning(f"⚠️ 数据写入延迟 {lag:.1f} 秒，队列积压 {self.queue.qsize()} 条")
+
+        except Exception as e:
+            db.rollback()
+            db.close()
+            if len(batch) > 1:
+                # 对半拆分重试（保持消息顺序，后半部分的数据仍覆盖前半部分）
+                self.stats["batch_splits"] += 1
+                logger.warning(f"⚠️ 批次写入失败，拆分 {len(batch)} 条消息重试: {e}")
+                middle = len(batch) // 2
+                self._flush(batch[:middle])
+                self._flush(batch[middle:])
+                return
+            self.stats["failed_messages"] += 1
+            logger.error(f"❌ 消息写入失败，丢弃设备 {batch[0].device_uuid} 的 1 条消息: {e}", exc_info=True)
+            return
+        finally:
+            db.close()
+
+        # 3. 在线状态：记录最新时间，由 _flush_seen 合并写入
+        for device_uuid in known_uuids:
+            self._pending_seen[device_uuid] = latest_time
+            if device_uuid in heartbeat_uuids:
+                self._pending_heartbeat[device_uuid] = latest_time
+        self.stats["seen_updates"] += len(known_uuids)
+
+        if self.liveness is not None:
+            self.liveness.touch(known_uuids, latest_time)
+
+        if self.history is not None:
+            # 历史数据记录每个原始读数（不按批次合并）
+            for message in batch:
+                if message.message_type == "data" and message.device_uuid in known_uuids:
+                    for reading in message.readings:
+                        self.history.append(message.device_uuid, reading.sensor_name,
+                                            reading.timestamp, reading.sensor_value)
+
+        if self.on_flushed is not None:
+            try:
+                self.on_flushed(self._build_updates(sensors, statuses, known_uuids, latest_time), latest_time)
+            except Exception as e:
+                logger.warning(f"⚠️ 批次提交回调失败: {e}")
+
+    def _flush_seen(self, force: bool = False):
+        """写入合并后的设备在线时间（按时间分组，每组一条 UPDATE ... WHERE uuid IN）"""
+        if not self._pending_seen:
+            return
+        if not force and time.monotonic() - self._last_seen_flush < self.seen_flush_interval:
+            return
+        self._last_seen_flush = time.monotonic()
+
+        pending_seen, self._pending_seen = self._pending_seen, {}
+        pending_heartbeat, self._pending_heartbeat = self._pending_heartbeat, {}
+
+        db = self.session_factory()
+        try:
+            for sql, pending in ((UPDATE_SEEN_SQL, pending_seen), (UPDATE_HEARTBEAT_SQL, pending_heartbeat)):
+                groups: Dict[datetime, List[str]] = {}
+                for device_uuid, seen_at in pending.items():
+                    groups.setdefault(seen_at, []).append(device_uuid)
+                for seen_at, device_uuids in groups.items():
+                    for uuids in _chunks(device_uuids):
+                        db.execute(sql, {"now": seen_at, "uuids": uuids})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # 放回待写入（保留较新的时间），下次重试
+            for pending, target in ((pending_seen, self._pending_seen), (pending_heartbeat, self._pending_heartbeat)):
+                for device_uuid, seen_at in pending.items():
+                    if device_uuid not in target or target[device_uuid] < seen_at:
+                        target[device_uuid] = seen_at
+            logger.error(f"❌ 设备在线时间写入失败，{len(pending_seen)} 台设备稍后重试: {e}")
+            return
+        finally:
+            db.close()
+
+        self.stats["seen_rows"] += len(pending_seen)
+        self.stats["seen_flushes"] += 1
+
+    @staticmethod
+    def _build_updates(
+        sensors: Dict[Tuple[str, str], SensorReading],
+        statuses: Dict[str, List[Dict[str, Any]]],
+        known_uuids: set,
+        latest_time: datetime
+    ) -> Dict[str, Dict[str, Any]]:
+        """已落库的设备增量：变化的传感器、状态，以及在线时间"""
+        last_seen = latest_time.isoformat()
+        updates: Dict[str, Dict[str, Any]] = {
+            device_uuid: {"online": True, "last_seen": last_seen}
+            for device_uuid in known_uuids
+        }
+        for (device_uuid, sensor_name), reading in sensors.items():
+            if device_uuid in updates:
+                updates[device_uuid].setdefault("sensors", {})[sensor_name] = {
+                    "value": reading.sensor_value,
+                    "unit": reading.sensor_unit or "",
+                    "type": reading.sensor_type or "",
+                    "timestamp": reading.timestamp.isoformat() if reading.timestamp else None
+                }
+        for device_uuid, device_statuses in statuses.items():
+            if device_uuid in updates:
+                merged_status: Dict[str, Any] = {}
+                for status in device_statuses:
+                    merged_status.update(status)
+                updates[device_uuid]["status"] = merged_status
+        return updates
+
+    # ------------------------------------------------------------------
+    # 监控
+    # ------------------------------------------------------------------
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """队列积压、背压和写入延迟指标"""
+        readings = self.stats["sensor_readings"]
+        return {
+            **self.stats,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "queue_usage": round(self.queue.qsize() / self.queue.maxsize, 4) if self.queue.maxsize else None,
+            "coalesce_ratio": round(1 - self.stats["sensor_rows"] / readings, 4) if readings else None,
+            "seen_coalesce_ratio": (
+                round(1 - self.stats["seen_rows"] / self.stats["seen_updates"], 4)
+                if self.stats["seen_updates"] else None
+            ),
+            "pending_seen": len(self._pending_seen),
+            "backpressure_seconds": round(self.stats["backpressure_seconds"], 3),
+        }
@@ -0,0 +1,217 @@
+"""
+设备在线状态检测
+写入线程每批次提交后把收到消息的设备交给 DeviceLivenessTracker（touch），
+检测线程按固定间隔取出超时的设备，每次用一条批量 UPDATE 置为离线并推送状态变化：
+- 按超时时刻组织的最小堆，每台设备只有一个条目；收到新消息只更新内存中的最后在线时间，
+  条目到期时若设备期间有新消息则按新的超时时刻重新入堆
+- 定期从数据库加载在线设备（服务重启、经 HTTP 接口上报的设备）
+- UPDATE 带 last_seen 条件，其他途径刚更新过的设备不会被误判离线
+"""
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+SELECT_ONLINE_SQL = text("""
+    SELECT uuid, last_seen FROM device_main
+    WHERE is_online = 1 AND last_seen IS NOT NULL
+""")
+
+SELECT_EXPIRED_SQL = text("""
+    SELECT uuid, last_seen FROM device_main
+    WHERE uuid IN :uuids AND is_online = 1 AND last_seen < :cutoff
+    FOR UPDATE
+""").bindparams(bindparam("uuids", expanding=True))
+
+UPDATE_OFFLINE_SQL = text("""
+    UPDATE device_main SET is_online = 0
+    WHERE uuid IN :uuids AND is_online = 1 AND last_seen < :cutoff
+""").bindparams(bindparam("uuids", expanding=True))
+
+# 单条 SQL 最多包含的 IN 列表长度
+SQL_CHUNK_SIZE = 500
+
+
+class DeviceLivenessTracker:
+    """设备在线状态检测（超时时刻索引 + 批量离线）"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        now_func: Callable[[], datetime],
+        timeout_seconds: float = 300,
+        sweep_interval: float = 10,
+        reload_interval: float = 300,
+        on_offline: Optional[Callable[[Dict[str, datetime]], None]] = None
+    ):
+        """
+        Args:
+            session_factory: 数据库会话工厂
+            now_func: 当前时间（与 last_seen 相同的北京时间，不带时区）
+            timeout_seconds: 超过此时间未收到消息判定为离线（需与 backend DEVICE_OFFLINE_TIMEOUT_MINUTES 一致）
+            sweep_interval: 检测间隔（秒）
+            reload_interval: 从数据库重新加载在线设备的间隔（秒）
+            on_offline: 设备离线后的回调，参数为 设备UUID -> 最后在线时间
+        """
+        self.session_factory = session_factory
+        self.now_func = now_func
+        self.timeout = timedelta(seconds=timeout_seconds)
+        self.sweep_interval = sweep_interval
+        self.reload_interval = reload_interval
+        self.on_offline = on_offline
+
+        self._lock = threading.Lock()
+        # 设备UUID -> 最后在线时间
+        self._last_seen: Dict[str, datetime] = {}
+        # (超时时刻, 设备UUID)，每台设备最多一个条目
+        self._deadlines: List[Tuple[datetime, str]] = []
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {
+            "sweeps": 0,
+            "expired_candidates": 0,  # 到期检查的设备数
+            "offline_transitions": 0,  # 实际置为离线的设备数
+            "reloads": 0,
+            "errors": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="device-liveness", daemon=True)
+        self._thread.start()
+        logger.info(f"🚀 设备在线检测已启动（超时 {int(self.timeout.total_seconds())} 秒，"
+                    f"检测间隔 {self.sweep_interval} 秒）")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        next_reload = 0.0
+        elapsed = 0.0
+        while not self._stop_event.is_set():
+            try:
+                if elapsed >= next_reload:
+                    self.reload()
+                    next_reload = elapsed + self.reload_interval
+                self.sweep()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"❌ 设备在线检测失败: {e}", exc_info=True)
+            self._stop_event.wait(self.sweep_interval)
+            elapsed += self.sweep_interval
+
+    # ------------------------------------------------------------------
+    # 索引维护
+    # ------------------------------------------------------------------
+
+    def touch(self, device_uuids: Iterable[str], seen_at: datetime):
+        """记录设备在线（写入线程在批次提交后调用）"""
+        with self._lock:
+            for device_uuid in device_uuids:
+                previous = self._last_seen.get(device_uuid)
+                if previous is None:
+                    heapq.heappush(self._deadlines, (seen_at + self.timeout, device_uuid))
+                elif previous >= seen_at:
+                    continue
+                self._last_seen[device_uuid] = seen_at
+
+    def reload(self):
+        """加载数据库中的在线设备（只补充内存中没有或更旧的记录）"""
+        db = self.session_factory()
+        try:
+            rows = db.execute(SELECT_ONLINE_SQL).fetchall()
+        finally:
+            db.close()
+        with self._lock:
+            for device_uuid, last_seen in rows:
+                previous = self._last_seen.get(device_uuid)
+                if previous is None:
+                    heapq.heappush(self._deadlines, (last_seen + self.timeout, device_uuid))
+                    self._last_seen[device_uuid] = last_seen
+                elif last_seen > previous:
+                    self._last_seen[device_uuid] = last_seen
+        self.stats["reloads"] += 1
+
+    def _pop_expired(self, now: datetime) -> List[str]:
+        """取出已超时的设备（到期前收到过新消息的设备按新的超时时刻重新入堆）"""
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, device_uuid = heapq.heappop(self._deadlines)
+                last_seen = self._last_seen.get(device_uuid)
+                if last_seen is None:
+                    continue
+                deadline = last_seen + self.timeout
+                if deadline > now:
+                    heapq.heappush(self._deadlines, (deadline, device_uuid))
+                else:
+                    del self._last_seen[device_uuid]
+                    expired.append(device_uuid)
+        return expired
+
+    # ------------------------------------------------------------------
+    # 检测
+    # ------------------------------------------------------------------
+
+    def sweep(self) -> Dict[str, datetime]:
+        """把超时设备批量置为离线（单个事务），返回实际离线的设备"""
+        now = self.now_func()
+        expired = self._pop_expired(now)
+        self.stats["sweeps"] += 1
+        if not expired:
+            return {}
+        self.stats["expired_candidates"] += len(expired)
+
+        cutoff = now - self.timeout
+        transitions: Dict[str, datetime] = {}
+        db = self.session_factory()
+        try:
+            for i in range(0, len(expired), SQL_CHUNK_SIZE):
+                params = {"uuids": expired[i:i + SQL_CHUNK_SIZE], "cutoff": cutoff}
+                # 锁定待更新的行，确保推送的状态变化与 UPDATE 一致
+                rows = db.execute(SELECT_EXPIRED_SQL, params).fetchall()
+                transitions.update({device_uuid: last_seen for device_uuid, last_seen in rows})
+            if transitions:
+                uuids = list(transitions)
+                for i in range(0, len(uuids), SQL_CHUNK_SIZE):
+                    db.execute(UPDATE_OFFLINE_SQL, {"uuids": uuids[i:i + SQL_CHUNK_SIZE], "cutoff": cutoff})
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 放回索引，下次检测重试
+            with self._lock:
+                for device_uuid in expired:
+                    if device_uuid not in self._last_seen:
+                        self._last_seen[device_uuid] = now - self.timeout
+                        heapq.heappush(self._deadlines, (now, device_uuid))
+            raise
+        finally:
+            db.close()
+
+        if transitions:
+            self.stats["offline_transitions"] += len(transitions)
+            logger.info(f"📴 {len(transitions)} 台设备超时离线: {sorted(transitions)[:5]}")
+            if self.on_offline is not None:
+                try:
+                    self.on_offline(transitions)
+                except Exception as e:
+                    logger.warning(f"⚠️ 设备离线回调失败: {e}")
+        return transitions
+
+    def get_metrics(self):
+        with self._lock:
+            tracked = len(self._last_seen)
+        return {**self.stats, "tracked_devices": tracked}
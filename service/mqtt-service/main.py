@@ -7,13 +7,17 @@ import logging
 import sys
 import time
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import paho.mqtt.client as mqtt
-from sqlalchemy.orm import Session
 from sqlalchemy import text
 from database import SessionLocal, engine
-from models import Device, Product, Base
+from models import Base
 from config import settings
+from ingest import IngestMessage, SensorIngestPipeline, SensorReading
+from push import SensorPushPublisher
+from history import PartitionManager, ROLLUP_TABLES, SEGMENTS_TABLE, TimeSeriesWriter
+from liveness import DeviceLivenessTracker
+from registry import DeviceRegistry
 
 # 配置日志
 logging.basicConfig(
@@ -29,6 +33,12 @@ logger = logging.getLogger(__name__)
 # 北京时区
 BEIJING_TZ = timezone(timedelta(hours=8))
 
+# device_sensors 字段长度（与 SQL/01_init_database.sql 一致），超长数据会导致整批写入失败
+SENSOR_NAME_MAX_LENGTH = 50
+SENSOR_VALUE_MAX_LENGTH = 255
+SENSOR_UNIT_MAX_LENGTH = 20
+SENSOR_TYPE_MAX_LENGTH = 50
+
 def get_beijing_now():
     """获取当前北京时间（不带时区信息）"""
     return datetime.now(BEIJING_TZ).replace(tzinfo=None)
@@ -48,6 +58,60 @@ class MQTTService:
         self.reconnect_count = 0
         self.max_reconnect_delay = 300  # 最大重连延迟（秒）
         
+        # 实时推送（批次提交后发布设备增量）
+        self.push_publisher: Optional[SensorPushPublisher] = None
+        if settings.SENSOR_PUSH_ENABLED:
+            self.push_publisher = SensorPushPublisher(settings.REDIS_URL, settings.SENSOR_PUSH_CHANNEL)
+        
+        # 历史数据（原始读数分段存储 + 分钟/小时聚合）
+        self.history: Optional[TimeSeriesWriter] = None
+        self.partition_manager: Optional[PartitionManager] = None
+        if settings.HISTORY_ENABLED:
+            self.history = TimeSeriesWriter(
+                SessionLocal,
+                segment_seconds=settings.HISTORY_SEGMENT_SECONDS,
+                segment_max_points=settings.HISTORY_SEGMENT_MAX_POINTS,
+                rollup_interval=settings.HISTORY_ROLLUP_INTERVAL
+            )
+            self.partition_manager = PartitionManager(
+                SessionLocal,
+                retention_days={
+                    SEGMENTS_TABLE: settings.HISTORY_RAW_RETENTION_DAYS,
+                    ROLLUP_TABLES["1m"]: settings.HISTORY_1M_RETENTION_DAYS,
+                    ROLLUP_TABLES["1h"]: settings.HISTORY_1H_RETENTION_DAYS,
+                },
+                check_interval=settings.HISTORY_PARTITION_CHECK_INTERVAL
+            )
+        
+        # 设备在线检测（超时设备批量置为离线，并推送离线状态）
+        self.liveness = DeviceLivenessTracker(
+            SessionLocal,
+            now_func=get_beijing_now,
+            timeout_seconds=settings.DEVICE_OFFLINE_TIMEOUT_MINUTES * 60,
+            sweep_interval=settings.LIVENESS_SWEEP_INTERVAL,
+            reload_interval=settings.LIVENESS_RELOAD_INTERVAL,
+            on_offline=self._push_offline if self.push_publisher else None
+        )
+        
+        # 数据写入流水线（回调线程解析入队，写入线程批量落库）
+        self.pipeline = SensorIngestPipeline(
+            SessionLocal,
+            queue_size=settings.INGEST_QUEUE_SIZE,
+            batch_size=settings.INGEST_BATCH_SIZE,
+            flush_interval=settings.INGEST_FLUSH_INTERVAL,
+            enqueue_timeout=settings.INGEST_ENQUEUE_TIMEOUT,
+            lag_warning_seconds=settings.INGEST_LAG_WARNING_SECONDS,
+            seen_flush_interval=settings.INGEST_SEEN_FLUSH_INTERVAL,
+            on_flushed=self._push_updates if self.push_publisher else None,
+            history=self.history,
+            liveness=self.liveness,
+            registry=DeviceRegistry(
+                max_size=settings.DEVICE_REGISTRY_CACHE_SIZE,
+                ttl=settings.DEVICE_REGISTRY_TTL,
+                negative_ttl=settings.DEVICE_REGISTRY_NEGATIVE_TTL
+            )
+        )
+        
         # 统计信息
         self.stats = {
             "total_messages": 0,
@@ -59,6 +123,18 @@ class MQTTService:
         
         logger.info(f"初始化MQTT服务 - Broker: {self.broker_host}:{self.broker_port}")
         
+    def _push_updates(self, updates: Dict[str, Dict[str, Any]], batch_time: datetime):
+        """写入线程回调：发布本批次已落库的设备增量"""
+        self.push_publisher.publish(updates, batch_time.isoformat())
+    
+    def _push_offline(self, transitions: Dict[str, datetime]):
+        """在线检测回调：发布超时离线的设备"""
+        updates = {
+            device_uuid: {"online": False, "last_seen": last_seen.isoformat() if last_seen else None}
+            for device_uuid, last_seen in transitions.items()
+        }
+        self.push_publisher.publish(updates, get_beijing_now().isoformat())
+    
     def on_connect(self, client, userdata, flags, rc, properties=None):
         """MQTT连接回调"""
         if rc == 0:
@@ -108,7 +184,7 @@ class MQTTService:
             logger.info("📴 MQTT正常断开连接")
     
     def on_message(self, client, userdata, msg):
-        """MQTT消息接收回调"""
+        """MQTT消息接收回调（只解析消息并放入写入队列，数据库写入由写入线程批量完成）"""
         self.stats["total_messages"] += 1
         self.stats["last_message_time"] = get_beijing_now()
         
@@ -116,7 +192,7 @@ class MQTTService:
             topic = msg.topic
             payload = msg.payload.decode('utf-8')
             
-            logger.info(f"📨 收到MQTT消息 - 主题: {topic}")
+            logger.debug(f"📨 收到MQTT消息 - 主题: {topic}")
             
             # 解析主题获取设备ID
             topic_parts = topic.split('/')
@@ -128,8 +204,13 @@ class MQTTService:
                 # 解析JSON数据
                 try:
                     data = json.loads(payload)
-                    self.process_device_message(device_uuid, message_type, data)
-                    self.stats["success_messages"] += 1
+                    message = self.decode_device_message(device_uuid, message_type, data)
+                    if message is None:
+                        return
+                    if self.pipeline.submit(message):
+                        self.stats["success_messages"] += 1
+                    else:
+                        self.stats["failed_messages"] += 1
                 except json.JSONDecodeError as e:
                     self.stats["failed_messages"] += 1
                     logger.error(f"❌ JSON解析失败: {e}, payload: {payload[:100]}")
@@ -144,90 +225,57 @@ class MQTTService:
             self.stats["failed_messages"] += 1
             logger.error(f"❌ 处理MQTT消息时出错: {e}", exc_info=True)
     
-    def process_device_message(self, device_uuid: str, message_type: str, data: Dict[str, Any]):
-        """处理设备消息"""
-        db = SessionLocal()
-        try:
-            # 查找设备
-            device = db.query(Device).filter(
-                Device.uuid == device_uuid
-            ).first()
-            
-            if not device:
-                logger.warning(f"⚠️ 设备不存在: {device_uuid}")
-                return
-            
-            logger.info(f"✅ 找到设备: {device.name} (ID: {device.device_id})")
-            
-            # 根据消息类型处理
-            if message_type == "data":
-                # 传感器数据上报
-                logger.info(f"📊 处理传感器数据: {data}")
-                
-                # 兼容两种数据格式：
-                # 1. HTTP API 格式: {"sensors": [...], "status": {...}, "location": {...}}
-                # 2. MQTT 简单格式: {"temperature": 25.5, "humidity": 60}
-                
-                if "sensors" in data:
-                    # HTTP API 格式 - 转换为标准存储格式
-                    self._process_http_format_data(db, device_uuid, data)
-                else:
-                    # MQTT 简单格式 - 直接存储
-                    self._process_mqtt_format_data(db, device_uuid, data)
-                
-                device.last_seen = get_beijing_now()
-                device.is_online = True
-                logger.debug(f"传感器数据已更新到设备表")
-                
-            elif message_type == "status":
-                # 设备状态更新
-                logger.info(f"📡 处理设备状态: {data}")
-                
-                # 更新或合并状态数据
-                if device.last_report_data:
-                    # 合并到现有数据
-                    if "status" not in device.last_report_data:
-                        device.last_report_data["status"] = {}
-                    device.last_report_data["status"].update(data)
-                else:
-                    # 首次上报
-                    device.last_report_data = {"status": data}
-                
-                device.last_seen = get_beijing_now()
-                device.is_online = True
-                logger.debug(f"设备状态已更新到设备表")
-                
-                # 更新设备状态字段
-                if "status" in data:
-                    device.device_status = data["status"]
-                
-            elif message_type == "heartbeat":
-                # 心跳数据
-                logger.debug(f"💓 处理心跳数据")
-                
-                # 更新设备心跳数据
-                device.last_seen = get_beijing_now()
-                device.last_heartbeat = get_beijing_now()
-                device.is_online = True
-                logger.debug(f"设备心跳已更新到设备表")
-            
-            # 提交数据库更改
-            db.commit()
-            logger.info(f"✅ 设备数据已更新: {device.name}")
-            
-        except Exception as e:
-            logger.error(f"❌ 处理设备消息失败: {e}", exc_info=True)
-            db.rollback()
-        finally:
-            db.close()
+    def decode_device_message(self, device_uuid: str, message_type: str, data: Any) -> Optional[IngestMessage]:
+        """将设备消息解析为写入队列中的记录（不访问数据库）"""
+        if message_type not in ("data", "status", "heartbeat"):
+            logger.debug(f"忽略未知消息类型: {message_type}")
+            return None
+        if not isinstance(data, dict):
+            raise ValueError(f"消息内容必须是JSON对象: {type(data).__name__}")
+        
+        readings: List[SensorReading] = []
+        if message_type == "data":
+            # 兼容两种数据格式：
+            # 1. HTTP API 格式: {"sensors": [...], "status": {...}, "location": {...}}
+            # 2. MQTT 简单格式: {"temperature": 25.5, "humidity": 60}
+            if "sensors" in data:
+                readings = self._parse_http_format_data(data)
+            else:
+                readings = self._parse_mqtt_format_data(data)
+            readings = self._sanitize_readings(device_uuid, readings)
+            logger.debug(f"📊 设备 {device_uuid} 上报 {len(readings)} 个传感器数据")
+        
+        return IngestMessage(
+            device_uuid=device_uuid,
+            message_type=message_type,
+            readings=readings,
+            status=data if message_type == "status" else None,
+            received_time=get_beijing_now(),
+            received_at=time.monotonic()
+        )
     
-    def _process_http_format_data(self, db: Session, device_uuid: str, data: Dict[str, Any]):
-        """处理 HTTP API 格式的传感器数据，直接写入 device_sensors 表"""
+    def _sanitize_readings(self, device_uuid: str, readings: List[SensorReading]) -> List[SensorReading]:
+        """按 device_sensors 字段长度校验读数：名称或数值超长的读数丢弃，单位和类型截断"""
+        valid = []
+        for reading in readings:
+            name = str(reading.sensor_name or "")
+            if not name or len(name) > SENSOR_NAME_MAX_LENGTH or len(str(reading.sensor_value)) > SENSOR_VALUE_MAX_LENGTH:
+                logger.warning(f"⚠️ 设备 {device_uuid} 传感器数据不合法（名称为空或名称/数值超长），忽略: {name[:SENSOR_NAME_MAX_LENGTH]}")
+                continue
+            valid.append(reading._replace(
+                sensor_name=name,
+                sensor_unit=str(reading.sensor_unit or "")[:SENSOR_UNIT_MAX_LENGTH],
+                sensor_type=str(reading.sensor_type or "")[:SENSOR_TYPE_MAX_LENGTH]
+            ))
+        return valid
+    
+    def _parse_http_format_data(self, data: Dict[str, Any]) -> List[SensorReading]:
+        """解析 HTTP API 格式的传感器数据"""
         now = get_beijing_now()
+        readings = []
         
         # 处理传感器数据列表
         sensors_list = data.get("sensors", [])
-        valid_count = 0
         
         for sensor in sensors_list:
             sensor_name = sensor.get("sensor_name")
@@ -249,18 +297,17 @@ class MQTTService:
                 continue
             sensor_unit = sensor.get("unit", "")
             timestamp_str = sensor.get("timestamp", now.isoformat())
-            self._upsert_sensor(db, device_uuid, sensor_name, sensor_value, sensor_unit, sensor.get("sensor_type", ""), timestamp_str)
-            valid_count += 1
+            readings.append(self._make_reading(sensor_name, sensor_value, sensor_unit, sensor.get("sensor_type", ""), timestamp_str))
             logger.debug(f"  - {sensor_name}: {sensor_value} {sensor_unit}")
         
-        logger.info(f"✅ 成功处理 {valid_count} 个传感器数据")
+        return readings
     
-    def _process_mqtt_format_data(self, db: Session, device_uuid: str, data: Dict[str, Any]):
-        """处理 MQTT 简单格式的传感器数据，直接写入 device_sensors 表"""
+    def _parse_mqtt_format_data(self, data: Dict[str, Any]) -> List[SensorReading]:
+        """解析 MQTT 简单格式的传感器数据"""
         now = get_beijing_now()
+        readings = []
         
         # 将简单键值对转换为标准格式
-        valid_count = 0
         sensor_type = data.get("sensor", "").upper()
         
         # 特殊处理：雨水传感器旧格式 {"sensor":"RAIN_SENSOR","is_raining":false,"level":1}
@@ -268,15 +315,12 @@ class MQTTService:
             rain_value = data.get("is_raining")
             rain_level = data.get("level")
             if rain_value is not None:
-                self._upsert_sensor(db, device_uuid, "rain", rain_value, "", sensor_type, data.get("timestamp", now.isoformat()))
-                valid_count += 1
+                readings.append(self._make_reading("rain", rain_value, "", sensor_type, data.get("timestamp", now.isoformat())))
                 logger.debug(f"  - rain: {rain_value}")
             if isinstance(rain_level, (int, float)):
-                self._upsert_sensor(db, device_uuid, "rain_level", rain_level, "", sensor_type, data.get("timestamp", now.isoformat()))
-                valid_count += 1
+                readings.append(self._make_reading("rain_level", rain_level, "", sensor_type, data.get("timestamp", now.isoformat())))
                 logger.debug(f"  - rain_level: {rain_level}")
-            logger.info(f"✅ 成功处理 {valid_count} 个传感器数据")
-            return
+            return readings
         
         for key, value in data.items():
             # 跳过特殊字段
@@ -291,11 +335,10 @@ class MQTTService:
             # 只处理数值类型的传感器数据
             if isinstance(value, (int, float)):
                 timestamp_str = data.get("timestamp", now.isoformat())
-                self._upsert_sensor(db, device_uuid, key, value, "", data.get("sensor", ""), timestamp_str)
-                valid_count += 1
+                readings.append(self._make_reading(key, value, "", data.get("sensor", ""), timestamp_str))
                 logger.debug(f"  - {key}: {value}")
         
-        logger.info(f"✅ 成功处理 {valid_count} 个传感器数据")
+        return readings
     
     def _validate_sensor_name(self, name: str) -> bool:
         """验证传感器名称格式
@@ -332,39 +375,26 @@ class MQTTService:
         except (ValueError, TypeError):
             return False
     
-    def _upsert_sensor(self, db: Session, device_uuid: str, sensor_name: str, sensor_value: Any, sensor_unit: str, sensor_type: str, timestamp_str: str):
-        """将单个传感器数据写入 device_sensors 表（使用 device_uuid，UPSERT）"""
+    def _make_reading(self, sensor_name: str, sensor_value: Any, sensor_unit: str, sensor_type: str, timestamp_str: Any) -> SensorReading:
+        """构造单个传感器读数（解析时间戳，解析失败使用当前时间）"""
         try:
-            # 解析时间戳
-            try:
-                if isinstance(timestamp_str, str):
-                    timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                else:
-                    timestamp = get_beijing_now()
-            except Exception:
+            if isinstance(timestamp_str, str):
+                timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+                if timestamp.tzinfo is not None:
+                    # 带时区的时间戳换算为不带时区的北京时间，与其他时间字段一致
+                    timestamp = timestamp.astimezone(BEIJING_TZ).replace(tzinfo=None)
+            else:
                 timestamp = get_beijing_now()
-            
-            sql = text("""
-                INSERT INTO device_sensors 
-                (device_uuid, sensor_name, sensor_value, sensor_unit, sensor_type, timestamp)
-                VALUES (:device_uuid, :sensor_name, :sensor_value, :sensor_unit, :sensor_type, :timestamp)
-                ON DUPLICATE KEY UPDATE
-                    sensor_value = VALUES(sensor_value),
-                    sensor_unit = VALUES(sensor_unit),
-                    sensor_type = VALUES(sensor_type),
-                    timestamp = VALUES(timestamp)
-            """)
-            
-            db.execute(sql, {
-                "device_uuid": device_uuid,
-                "sensor_name": sensor_name,
-                "sensor_value": str(sensor_value),
-                "sensor_unit": sensor_unit or "",
-                "sensor_type": sensor_type or "",
-                "timestamp": timestamp
-            })
-        except Exception as e:
-            logger.error(f"❌ 写入 device_sensors 失败: {e}", exc_info=True)
+        except Exception:
+            timestamp = get_beijing_now()
+        
+        return SensorReading(
+            sensor_name=sensor_name,
+            sensor_value=sensor_value,
+            sensor_unit=sensor_unit or "",
+            sensor_type=sensor_type or "",
+            timestamp=timestamp
+        )
     
     def start(self):
         """启动MQTT服务"""
@@ -389,6 +419,12 @@ class MQTTService:
             # 启用自动重连
             self.client.reconnect_delay_set(min_delay=1, max_delay=120)
             
+            # 启动数据写入线程
+            self.pipeline.start()
+            self.liveness.start()
+            if self.partition_manager:
+                self.partition_manager.start()
+            
             # 连接到MQTT Broker
             logger.info(f"🔌 正在连接到MQTT Broker: {self.broker_host}:{self.broker_port}")
             self.client.connect(self.broker_host, self.broker_port, 60)
@@ -408,12 +444,12 @@ class MQTTService:
             sys.exit(1)
     
     def _start_stats_timer(self):
-        """启动统计定时器（每5分钟打印一次统计信息）"""
+        """启动统计定时器（默认每5分钟打印一次统计信息）"""
         import threading
         
         def print_stats():
-            while self.client and self.is_connected:
-                time.sleep(300)  # 5分钟
+            while self.client:
+                time.sleep(settings.STATS_INTERVAL)
                 self._print_stats()
         
         stats_thread = threading.Thread(target=print_stats, daemon=True)
@@ -437,6 +473,30 @@ class MQTTService:
         logger.info(f"  成功率: {success_rate:.2f}%")
         if self.stats["last_message_time"]:
             logger.info(f"  最后消息: {self.stats['last_message_time']}")
+        
+        metrics = self.pipeline.get_metrics()
+        logger.info(f"  写入队列: {metrics['queue_depth']}/{metrics['queue_capacity']}（最高 {metrics['queue_high_watermark']}）")
+        logger.info(f"  背压等待: {metrics['backpressure_waits']} 次，累计 {metrics['backpressure_seconds']} 秒，丢弃 {metrics['dropped']} 条")
+        logger.info(f"  写入批次: {metrics['batches']}（最近 {metrics['last_batch_size']} 条，耗时 {metrics['last_flush_ms']}ms）")
+        logger.info(f"  写入延迟: 最近 {metrics['last_lag_seconds']} 秒，最大 {metrics['max_lag_seconds']} 秒")
+        logger.info(f"  传感器合并: {metrics['sensor_readings']} 个读数 -> {metrics['sensor_rows']} 行")
+        logger.info(f"  在线时间合并: {metrics['seen_updates']} 次更新 -> {metrics['seen_rows']} 行（{metrics['seen_flushes']} 次写入）")
+        logger.info(f"  写入失败: {metrics['failed_messages']}，设备不存在: {metrics['unknown_device_messages']}")
+        if self.push_publisher:
+            push_stats = self.push_publisher.stats
+            logger.info(f"  实时推送: {push_stats['published']} 批次，{push_stats['devices']} 次设备更新，"
+                        f"跳过 {push_stats['skipped']}，失败 {push_stats['errors']}")
+        registry_metrics = self.pipeline.registry.get_metrics()
+        logger.info(f"  设备缓存: {registry_metrics['size']} 条，命中率 {registry_metrics['hit_rate']}，"
+                    f"数据库查询 {registry_metrics['loads']} 次")
+        liveness_metrics = self.liveness.get_metrics()
+        logger.info(f"  在线检测: 跟踪 {liveness_metrics['tracked_devices']} 台设备，"
+                    f"超时离线 {liveness_metrics['offline_transitions']} 台，失败 {liveness_metrics['errors']} 次")
+        if self.history:
+            history_metrics = self.history.get_metrics()
+            logger.info(f"  历史数据: {history_metrics['points']} 个数据点，已写入 {history_metrics['segments']} 段"
+                        f"（平均 {history_metrics['bytes_per_point']} 字节/点），缓冲 {history_metrics['buffered_points']} 点，"
+                        f"丢失 {history_metrics['failed_points']}")
         logger.info("=" * 70)
     
     def stop(self):
@@ -445,7 +505,14 @@ class MQTTService:
             logger.info("🛑 正在断开MQTT连接...")
             self.client.disconnect()
             self.client.loop_stop()
-            logger.info("✅ MQTT服务已停止")
+        # 写完队列中剩余的消息（包括内存中的历史数据）
+        self.pipeline.stop()
+        self.liveness.stop()
+        if self.partition_manager:
+            self.partition_manager.stop()
+        if self.push_publisher:
+            self.push_publisher.close()
+        logger.info("✅ MQTT服务已停止")
 
 
 def main():
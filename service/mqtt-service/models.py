@@ -22,6 +22,7 @@ class Device(Base):
     last_report_data = Column(JSON, nullable=True, comment="最后上报数据")
     product_id = Column(Integer, ForeignKey("device_products.id"), nullable=True)
     user_id = Column(Integer, nullable=True)
+    team_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=False)
     
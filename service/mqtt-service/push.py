@@ -0,0 +1,80 @@
+"""
+传感器数据推送
+每个写入批次提交后，把本批次涉及设备的最新数据（传感器增量、状态、在线时间）
+作为一条消息发布到 Redis 频道，由 backend 转发给 WebSocket/SSE 订阅者：
+- 每批次一次 PUBLISH，不按设备或读数逐条发送
+- Redis 不可用时暂停推送一段时间，不影响数据落库
+"""
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Redis 失败后暂停推送的时间（秒），避免每个批次都等待超时
+REDIS_RETRY_INTERVAL = 30
+
+
+class SensorPushPublisher:
+    """传感器增量发布（在写入线程中同步调用）"""
+
+    def __init__(self, redis_url: str, channel: str):
+        self.redis_url = redis_url
+        self.channel = channel
+        self._client = None
+        self._disabled_until = 0.0
+        self.stats = {
+            "published": 0,       # 已发布的批次消息数
+            "devices": 0,         # 累计推送的设备更新数
+            "skipped": 0,         # Redis 不可用时跳过的批次数
+            "errors": 0,
+        }
+
+    def _get_client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(
+                self.redis_url,
+                socket_timeout=0.5,
+                socket_connect_timeout=0.5
+            )
+        return self._client
+
+    def publish(self, updates: Dict[str, Dict[str, Any]], timestamp: Optional[str] = None) -> bool:
+        """
+        发布一个批次的设备更新
+
+        Args:
+            updates: 设备UUID -> {"sensors": {...}, "status": {...}, "last_seen": ..., "online": ...}
+            timestamp: 批次时间（ISO格式）
+
+        Returns:
+            bool: 是否发布成功
+        """
+        if not updates:
+            return True
+        if time.monotonic() < self._disabled_until:
+            self.stats["skipped"] += 1
+            return False
+
+        payload = json.dumps({"ts": timestamp, "devices": updates}, ensure_ascii=False, default=str)
+        try:
+            self._get_client().publish(self.channel, payload)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self._disabled_until = time.monotonic() + REDIS_RETRY_INTERVAL
+            logger.warning(f"⚠️ 传感器数据推送失败，{REDIS_RETRY_INTERVAL}秒内暂停推送: {e}")
+            return False
+
+        self.stats["published"] += 1
+        self.stats["devices"] += len(updates)
+        return True
+
+    def close(self):
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception:
+                pass
+            self._client = None
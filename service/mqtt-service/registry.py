@@ -0,0 +1,126 @@
+"""
+设备注册表缓存
+写入线程每个批次都要确认消息中的设备是否存在。本模块缓存设备身份信息：
+- 按 uuid 缓存 (id, product_id, user_id, team_id, is_active)，LRU 限制条目数
+- 批次中未缓存的设备合并为一次 IN 查询加载，已知设备不再查询数据库
+- 不存在的 uuid 也缓存（负缓存，TTL 较短），未注册设备持续上报时不会每批次查询
+- 设备在 backend 中注册/修改/删除后，最长在 TTL 后生效
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Device
+
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 最多包含的 IN 列表长度
+SQL_CHUNK_SIZE = 500
+
+
+class DeviceEntry(NamedTuple):
+    """设备身份信息投影"""
+    id: int
+    product_id: Optional[int]
+    user_id: Optional[int]
+    team_id: Optional[int]
+    is_active: bool
+
+
+class DeviceRegistry:
+    """设备注册表缓存（LRU + TTL，含负缓存）"""
+
+    def __init__(self, max_size: int = 100000, ttl: float = 300, negative_ttl: float = 60):
+        """
+        Args:
+            max_size: 最多缓存的设备数（0 表示禁用缓存）
+            ttl: 已知设备的缓存有效期（秒）
+            negative_ttl: 不存在设备的缓存有效期（秒），也是新注册设备开始被接收的最长延迟
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # 设备UUID -> (过期时间, 设备信息或None)
+        self._items: "OrderedDict[str, Tuple[float, Optional[DeviceEntry]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "loads": 0,  # 数据库查询次数
+        }
+
+    def resolve(self, db: Session, device_uuids: Iterable[str]) -> Dict[str, DeviceEntry]:
+        """
+        获取一批设备的信息（未缓存的设备合并查询）
+
+        Returns:
+            Dict[str, DeviceEntry]: 存在的设备，不存在的设备不在结果中
+        """
+        found: Dict[str, DeviceEntry] = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for device_uuid in set(device_uuids):
+                item = self._items.get(device_uuid)
+                if item is None or item[0] <= now:
+                    missing.append(device_uuid)
+                    continue
+                self._items.move_to_end(device_uuid)
+                if item[1] is None:
+                    self.stats["negative_hits"] += 1
+                else:
+                    self.stats["hits"] += 1
+                    found[device_uuid] = item[1]
+
+        if not missing:
+            return found
+        self.stats["misses"] += len(missing)
+
+        loaded = self._load(db, missing)
+        found.update(loaded)
+        if self.max_size > 0:
+            with self._lock:
+                for device_uuid in missing:
+                    entry = loaded.get(device_uuid)
+                    expires_at = now + (self.ttl if entry is not None else self.negative_ttl)
+                    self._items[device_uuid] = (expires_at, entry)
+                    self._items.move_to_end(device_uuid)
+                while len(self._items) > self.max_size:
+                    self._items.popitem(last=False)
+        return found
+
+    def _load(self, db: Session, device_uuids: list) -> Dict[str, DeviceEntry]:
+        loaded: Dict[str, DeviceEntry] = {}
+        for i in range(0, len(device_uuids), SQL_CHUNK_SIZE):
+            rows = db.query(
+                Device.uuid, Device.id, Device.product_id, Device.user_id, Device.team_id, Device.is_active
+            ).filter(Device.uuid.in_(device_uuids[i:i + SQL_CHUNK_SIZE]))
+            for row in rows:
+                loaded[row.uuid] = DeviceEntry(
+                    id=row.id,
+                    product_id=row.product_id,
+                    user_id=row.user_id,
+                    team_id=row.team_id,
+                    is_active=bool(row.is_active) if row.is_active is not None else True
+                )
+            self.stats["loads"] += 1
+        return loaded
+
+    def invalidate(self, *device_uuids: str):
+        with self._lock:
+            for device_uuid in device_uuids:
+                self._items.pop(device_uuid, None)
+
+    def get_metrics(self) -> Dict[str, object]:
+        hits = self.stats["hits"] + self.stats["negative_hits"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._items),
+            "hit_rate": round(hits / total, 4) if total else None,
+        }